@@ -1,20 +1,54 @@
 import os
+import atexit
 import json
+import re
+import bisect
 import uuid
+import hashlib
+import itertools
+import tempfile
 import logging
-from datetime import datetime
-from functools import wraps
-from werkzeug.utils import secure_filename
+import threading
+import multiprocessing
+import time
+import unicodedata
+import base64
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from collections import OrderedDict
+from functools import wraps, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import quote
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import ClosingIterator
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, session, send_from_directory, abort
+    flash, session, send_from_directory, abort, Response, g,
+    before_render_template, template_rendered
 )
 
+try:
+    import fcntl
+except ImportError:   # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+import fuzzy
+import metrics
+import popularity
+import related
+import suggest
+import pdfinfo
+import snapshot
+from records import Book, User
+from sqlite_store import SQLiteStore
+
 # -------------------------
 # CONFIGURATION
 # -------------------------
-logging.basicConfig(level=logging.DEBUG)
+# DEBUG logs per-request detail; keep it off the hot path in production
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -25,6 +59,13 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf'}
 MAX_CONTENT_LENGTH = 300 * 1024 * 1024  # 300MB max file size
 
+# Browse pagination
+BROWSE_PAGE_SIZE = 24
+BROWSE_MAX_PAGE_SIZE = 100
+SHELF_SIZE = 5      # books per popularity shelf on the home page
+TRENDING_SIZE = 20  # books per list on /trending
+RELATED_SIZE = 6    # related books shown on a book's page
+
 # Use absolute path to avoid relative path issues
 app.config['UPLOAD_FOLDER'] = os.path.abspath(UPLOAD_FOLDER)
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
@@ -35,6 +76,15 @@ logger.debug(f"Upload folder set to: {app.config['UPLOAD_FOLDER']}")
 
 # Data persistence
 DATA_FILE = 'data_store.json'
+SNAPSHOT_FILE = 'data_store.snap'
+SNAPSHOT_FORMAT = os.environ.get('SNAPSHOT_FORMAT', 'binary')   # 'binary' or 'json'
+JOURNAL_FILE = 'data_store.journal'
+LOCK_FILE = 'data_store.lock'
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', 1000))
+
+# Storage engine: 'memory' (dicts + snapshot/journal above) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'memory')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'kitabghar.db')
 
 # In-memory storage
 users_db = {}   # {user_id: user_data}
@@ -42,148 +92,1233 @@ books_db = {}   # {book_id: book_data}
 user_counter = 1
 book_counter = 1
 
+# Journal state
+_journal_lock = threading.RLock()
+_journal_seq = 0       # sequence number of the last record written or replayed
+_catalog_seq = 0       # _journal_seq as of the last change to books (counters aside)
+_journal_records = 0   # records in the journal file since the last compaction
+_journal_pos = None    # (descriptor, byte offset) of the journal read so far
+_journal_stat = None   # (inode, size, mtime_ns) when this process last caught up
+_lock_fd = None        # LOCK_FILE descriptor, opened per process
+_lock_pid = None
+_lock_depth = 0
+
+# Journal ops that change what the catalog API returns
+CATALOG_OPS = frozenset(('book_add', 'book_set', 'book_del'))
+
+# Buffered counter increments, flushed to the journal in batches
+COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+COUNTER_FLUSH_THRESHOLD = int(os.environ.get('COUNTER_FLUSH_THRESHOLD', 500))
+_counter_lock = threading.Lock()
+_counter_wakeup = threading.Event()
+_pending_counts = {}   # {(book_id, field): increments not yet journaled}
+_held_counts = None    # {(book_id, field): n} kept off the records while save_data() serializes
+_trend_epoch = popularity.EPOCH   # what trend scores and their pending increments count from
+
 ROLES = {
     'reader': 'Reader',
     'author': 'Author',
     'admin': 'Admin'
 }
 
+# -------------------------
+# METRICS
+# -------------------------
+# Served at /metrics (see metrics.py). METRICS_ENABLED=0 removes the
+# instrumentation rather than just skipping the bookkeeping.
+# PROFILE_SAMPLE_INTERVAL > 0 starts a stack sampler; admins read its
+# folded stacks at /metrics/profile.
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0))
+
+REQUEST_SECONDS = metrics.Histogram(
+    'kitabghar_request_duration_seconds', 'Time to produce a response, by endpoint.',
+    ('endpoint', 'method'))
+REQUESTS = metrics.Counter(
+    'kitabghar_requests_total', 'Responses by endpoint and status.', ('endpoint', 'status'))
+TEMPLATE_SECONDS = metrics.Histogram(
+    'kitabghar_template_render_seconds', 'Template rendering time.', ('template',))
+SEARCH_SECONDS = metrics.Histogram('kitabghar_search_seconds', 'search_books() time.')
+PERSIST_SECONDS = metrics.Histogram(
+    'kitabghar_persistence_write_seconds', 'Journal appends and snapshot writes.', ('kind',))
+PERSIST_BYTES = metrics.Counter(
+    'kitabghar_persistence_written_bytes_total', 'Bytes written to the journal and snapshots.',
+    ('kind',))
+ACTIVE_TRANSFERS = metrics.Gauge(
+    'kitabghar_active_transfers', 'PDF responses still being sent.', ('endpoint',))
+BYTES_SERVED = metrics.Counter(
+    'kitabghar_served_bytes_total', 'PDF bytes sent by this process.', ('endpoint',))
+PROCESS_INFO = metrics.Gauge('kitabghar_process_info', 'The worker that answered this scrape.', ('pid',))
+metrics.Gauge('kitabghar_books', 'Books in the catalog.', fn=lambda: count_books())
+metrics.Gauge('kitabghar_users', 'Registered users.', fn=lambda: count_users())
+metrics.Gauge('kitabghar_pending_counter_updates', 'View/download increments not yet flushed.',
+              fn=lambda: len(_pending_counts))
+
 # -------------------------
 # HELPER FUNCTIONS
 # -------------------------
 def _dt_to_iso(v):
     return v.isoformat() if isinstance(v, datetime) else v
 
-def _iso_to_dt(s):
-    if isinstance(s, str):
-        try:
-            return datetime.fromisoformat(s)
-        except Exception:
-            return s
-    return s
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # -------------------------
 # PERSISTENCE
 # -------------------------
-def load_data():
-    global users_db, books_db, user_counter, book_counter
-    if not os.path.exists(DATA_FILE):
-        logger.debug("No data file found; starting with defaults.")
+# The store is a JSON snapshot (DATA_FILE) plus an append-only journal of
+# mutations (JOURNAL_FILE). Every mutation appends one JSON line; once the
+# journal holds JOURNAL_COMPACT_EVERY records it is folded into a new snapshot.
+# Records carry a sequence number and the snapshot remembers the last one it
+# contains, so replaying after a crash mid-compaction never applies twice.
+#
+# With SNAPSHOT_FORMAT=binary the snapshot is SNAPSHOT_FILE instead (see
+# snapshot.py): it is memory-mapped at startup and only the fields listings
+# and indexes need are decoded; descriptions and extracted text are parsed
+# per book on first use. Compaction writes only the configured format and
+# leaves a snapshot in the other one alone, so switching back (or to an older
+# release that only reads DATA_FILE) still finds that file. When both are
+# present the loader reads the newer one.
+def _serialize_user(user):
+    return {**user, 'created_at': _dt_to_iso(user.get('created_at'))}
+
+def _serialize_book(book):
+    return {**book, 'uploaded_at': _dt_to_iso(book.get('uploaded_at'))}
+
+def _deserialize_user(raw):
+    # records.User parses the ISO created_at into epoch seconds
+    return User(raw)
+
+def _deserialize_book(raw):
+    book = Book(raw)
+    book.setdefault('views', 0)
+    return book
+
+def _apply_record(rec, index=True):
+    """Apply one journal record to the in-memory store.
+
+    Secondary indexes are kept in step unless index=False (load_data()
+    rebuilds them once at the end instead).
+    """
+    with _index_write():
+        _apply_record_locked(rec, index)
+
+def _apply_record_locked(rec, index):
+    global user_counter, book_counter
+    op = rec.get('op')
+    if op == 'user_add':
+        user = _deserialize_user(rec['user'])
+        users_db[user['id']] = user
+        user_counter = max(user_counter, user['id'] + 1)
+        if index:
+            _index_user(user)
+    elif op == 'user_set':
+        user = users_db.get(rec['id'])
+        if user:
+            if index:
+                _unindex_user(user)
+            user.update(rec['fields'])
+            if index:
+                _index_user(user)
+    elif op == 'user_del':
+        user = users_db.pop(rec['id'], None)
+        if user and index:
+            _unindex_user(user)
+    elif op == 'book_add':
+        book = _deserialize_book(rec['book'])
+        books_db[book['id']] = book
+        book_counter = max(book_counter, book['id'] + 1)
+        if index:
+            _index_book(book)
+    elif op == 'book_del':
+        book = books_db.pop(rec['id'], None)
+        if book and index:
+            _unindex_book(book)
+    elif op == 'book_inc':
+        book = books_db.get(rec['id'])
+        if book:
+            with _counter_lock:
+                book[rec['field']] = book.get(rec['field'], 0) + rec.get('n', 1)
+                if index and rec['field'] in TREND_FIELDS:
+                    _rank_book(book)
+    elif op == 'book_set':
+        book = books_db.get(rec['id'])
+        if book:
+            if index:
+                _set_book_fields(book, rec['fields'])
+            else:
+                book.update(rec['fields'])
+    elif op == 'trend_rebase':
+        _rebase_trends_locked(rec['epoch'], index)
+    elif op != 'snapshot':
+        logger.warning(f"Unknown journal op {op!r}; skipped.")
+
+# Several worker processes may share one snapshot + journal. Every write
+# happens under an exclusive flock on LOCK_FILE after first applying whatever
+# other workers appended (read incrementally from the last offset seen), so
+# ids and sequence numbers never collide. Readers notice foreign writes with
+# one stat() per request and catch up without the flock, so a request never
+# waits for another worker's compaction. Compaction swaps in a fresh journal
+# whose first line is a 'snapshot' marker. Each worker keeps the journal it
+# reads open, so it can still finish the replaced file and carry on after
+# the marker. Only a worker that missed a whole journal reloads the snapshot.
+@contextmanager
+def _store_lock():
+    """Hold the store lock across threads and worker processes (re-entrant)."""
+    global _lock_fd, _lock_pid, _lock_depth
+    with _journal_lock:
+        if _lock_depth == 0 and fcntl:
+            if _lock_pid != os.getpid():
+                # a descriptor inherited over fork would share the parent's lock
+                if _lock_fd is not None:
+                    os.close(_lock_fd)
+                _lock_fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+                _lock_pid = os.getpid()
+            fcntl.flock(_lock_fd, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0 and fcntl:
+                fcntl.flock(_lock_fd, fcntl.LOCK_UN)
+
+@contextmanager
+def _synced_store():
+    """Lock the store and catch up with other workers' writes first."""
+    with _store_lock():
+        _refresh_journal()
+        yield
+
+def _same_file(a, b):
+    return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+
+def _read_journal(fd, start, size, index):
+    """Apply the records in bytes [start, size) of the journal open as `fd`.
+
+    Returns the offset after the last complete line, or None at a 'snapshot'
+    marker newer than this process's state: records it never read were
+    compacted away.
+    """
+    global _journal_seq, _journal_records, _catalog_seq
+    data = os.pread(fd, size - start, start)
+    offset = applied = 0
+    while True:
+        end = data.find(b'\n', offset)
+        if end == -1:
+            break
+        line = data[offset:end]
+        offset = end + 1
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            logger.error(f"Skipping corrupt journal record ending at byte {start + end}.")
+            continue
+        _journal_records += 1
+        if rec.get('seq', 0) <= _journal_seq:
+            continue
+        if rec.get('op') == 'snapshot':
+            return None
+        _apply_record(rec, index)
+        _journal_seq = rec['seq']
+        if rec.get('op') in CATALOG_OPS:
+            _catalog_seq = _journal_seq
+        applied += 1
+    if applied:
+        logger.debug(f"Replayed {applied} journal records.")
+    return start + offset
+
+def _replay_journal(index=True):
+    """Apply journal records newer than what this process holds.
+
+    Reading resumes where the previous call stopped, in the journal this
+    process keeps open. If another worker has compacted since, that file is
+    complete (compaction renames the new journal in last, under the store
+    lock), so it is read to the end before moving on to the new one. Call
+    with _journal_lock held; the store lock is only needed to truncate a
+    torn last line, which without it may be a record still being written.
+    """
+    global _journal_records, _journal_pos, _journal_stat
+    try:
+        fd = os.open(JOURNAL_FILE, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    st = os.fstat(fd)
+    if _journal_pos and _same_file(os.fstat(_journal_pos[0]), st):
+        os.close(fd)
+        fd, start = _journal_pos
+    else:
+        if _journal_pos:
+            old, offset = _journal_pos
+            _journal_pos = None
+            done = _read_journal(old, offset, os.fstat(old).st_size, index)
+            os.close(old)
+            if done is None:
+                os.close(fd)
+                _reload_store()
+                return
+        start = _journal_records = 0
+        _journal_pos = (fd, 0)
+
+    end = _read_journal(fd, start, st.st_size, index)
+    if end is None:
+        # this process missed a whole journal; only the snapshot has those records
+        os.close(fd)
+        _journal_pos = None
+        _reload_store()
         return
+    if end < st.st_size and _lock_depth:
+        logger.warning(f"Dropping torn journal record at byte {end}.")
+        os.truncate(JOURNAL_FILE, end)
+        st = os.fstat(fd)
+    _journal_pos = (fd, end)
+    _journal_stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _journal_caught_up(st):
+    """Note that this process holds everything in the journal `st` describes."""
+    global _journal_pos, _journal_stat
+    fd = _journal_pos[0] if _journal_pos else None
+    if fd is None or not _same_file(os.fstat(fd), st):
+        if fd is not None:
+            os.close(fd)
+        fd = os.open(JOURNAL_FILE, os.O_RDONLY)
+    _journal_pos = (fd, st.st_size)
+    _journal_stat = (st.st_ino, st.st_size, st.st_mtime_ns)
 
+def _refresh_journal():
+    """Pick up other workers' writes; a single stat() when nothing changed."""
     try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Load users
-        raw_users = data.get('users_db', {})
-        users_db = {}
-        for k, v in raw_users.items():
-            uid = int(k)
-            user = v.copy()
-            if 'created_at' in user:
-                user['created_at'] = _iso_to_dt(user['created_at'])
-            users_db[uid] = user
-
-        # Load books
-        raw_books = data.get('books_db', {})
-        books_db = {}
-        for k, v in raw_books.items():
-            bid = int(k)
-            book = v.copy()
-            if 'uploaded_at' in book:
-                book['uploaded_at'] = _iso_to_dt(book['uploaded_at'])
-            book.setdefault('views', 0)
-            books_db[bid] = book
-
-        user_counter = int(data.get('user_counter', max(users_db.keys(), default=0) + 1))
-        book_counter = int(data.get('book_counter', max(books_db.keys(), default=0) + 1))
-        logger.debug(f"Loaded {len(users_db)} users, {len(books_db)} books.")
-    except Exception as e:
-        logger.error(f"Failed to load data: {e}")
+        st = os.stat(JOURNAL_FILE)
+    except FileNotFoundError:
+        return
+    if (st.st_ino, st.st_size, st.st_mtime_ns) != _journal_stat:
+        with _journal_lock:
+            _replay_journal()
+
+def _reload_store():
+    """Reload from disk, keeping counter increments not yet flushed."""
+    with _counter_lock:
+        pending = dict(_pending_counts)
+        epoch = _trend_epoch
+    logger.info("Journal records were compacted before this worker read them; reloading.")
+    load_data()
+    with _counter_lock:
+        _rescale_pending_locked(pending, popularity.rescale(epoch, _trend_epoch))
+        for key, n in pending.items():
+            book = books_db.get(key[0])
+            if book:
+                book[key[1]] = book.get(key[1], 0) + n
+                if key[1] in TREND_FIELDS:
+                    _rank_book(book)
+            _pending_counts[key] = _pending_counts.get(key, 0) + n
 
+@metrics.timed(PERSIST_SECONDS, ('journal',))
+def _journal_append(records):
+    """Append (op, fields) records to the journal in one write.
+
+    Compaction is only considered after the whole batch is on disk, so a
+    snapshot never lands in the middle of a batch.
+    """
+    global _journal_seq, _journal_records, _catalog_seq
+    with _synced_store():
+        lines = []
+        for op, fields in records:
+            _journal_seq += 1
+            if op in CATALOG_OPS:
+                _catalog_seq = _journal_seq
+            lines.append(json.dumps({'seq': _journal_seq, 'op': op, **fields}, separators=(',', ':')))
+        payload = ('\n'.join(lines) + '\n').encode('utf-8')
+        try:
+            with open(JOURNAL_FILE, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                st = os.fstat(f.fileno())
+        except Exception as e:
+            logger.error(f"Failed to append to journal: {e}")
+            return
+        if metrics.ENABLED:
+            PERSIST_BYTES.inc(('journal',), len(payload))
+        _journal_caught_up(st)
+        _journal_records += len(lines)
+        if _journal_records >= JOURNAL_COMPACT_EVERY:
+            save_data()
+
+def _journal(op, **fields):
+    """Append a single mutation to the journal."""
+    _journal_append([(op, fields)])
+
+def read_snapshot():
+    """Read the snapshot on disk into {'users_db', 'books_db', counters}, or None.
+
+    Of the two formats, the most recently written snapshot is read; the other
+    is older than the journal. On a tie the file in SNAPSHOT_FORMAT wins. The
+    next compaction writes SNAPSHOT_FORMAT, converting a snapshot in the other.
+    """
+    candidates = []
+    for path, fmt in ((SNAPSHOT_FILE, 'binary'), (DATA_FILE, 'json')):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        candidates.append((mtime, fmt == SNAPSHOT_FORMAT, path, fmt))
+    if not candidates:
+        return None
+    _, _, path, fmt = max(candidates)
+    if fmt == 'binary':
+        data = snapshot.read(path)
+        data['users_db'] = {user['id']: user for user in data.pop('users')}
+        data['books_db'] = {book['id']: book for book in data.pop('books')}
+        return data
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data['users_db'] = {int(k): _deserialize_user(v) for k, v in data.get('users_db', {}).items()}
+    data['books_db'] = {int(k): _deserialize_book(v) for k, v in data.get('books_db', {}).items()}
+    return data
+
+def load_data():
+    global users_db, books_db, user_counter, book_counter, _journal_seq, _journal_records, _journal_pos
+    global _catalog_seq, _trend_epoch
+    with _store_lock(), _index_write():
+        previous = books_db
+        users_db, books_db = {}, {}
+        user_counter = book_counter = 1
+        _journal_seq = _journal_records = _catalog_seq = 0
+        _trend_epoch = popularity.EPOCH
+        if _journal_pos:
+            os.close(_journal_pos[0])
+        _journal_pos = None
+        _pending_counts.clear()
+        if not any(os.path.exists(p) for p in (SNAPSHOT_FILE, DATA_FILE, JOURNAL_FILE)):
+            logger.debug("No data file found; starting with defaults.")
+            _rebuild_indexes()
+            _queue_search_reindex(previous)
+            return
+
+        try:
+            data = read_snapshot()
+            if data is not None:
+                users_db, books_db = data['users_db'], data['books_db']
+                user_counter = int(data.get('user_counter', max(users_db.keys(), default=0) + 1))
+                book_counter = int(data.get('book_counter', max(books_db.keys(), default=0) + 1))
+                _journal_seq = _catalog_seq = int(data.get('journal_seq', 0))
+                _trend_epoch = float(data.get('trend_epoch', popularity.EPOCH))
+
+            _replay_journal(index=False)
+            _rebuild_indexes()
+            _log_user_collisions()
+            _queue_search_reindex({**dict.fromkeys(books_db), **previous})
+            logger.debug(f"Loaded {len(users_db)} users, {len(books_db)} books.")
+        except Exception as e:
+            logger.error(f"Failed to load data: {e}")
+
+def _write_atomic(path, data):
+    """Replace `path` with `data` so readers and crashes see the old or the new file, never a mix.
+
+    The bytes go to a uniquely named temp file that is fsynced before the
+    rename, and the directory is fsynced after it so the rename itself is
+    durable.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def _serialize_snapshot(meta):
+    if SNAPSHOT_FORMAT == 'binary':
+        return snapshot.dumps(users_db.values(), books_db.values(), **meta)
+    payload = {
+        'users_db': {str(k): _serialize_user(v) for k, v in users_db.items()},
+        'books_db': {str(k): _serialize_book(v) for k, v in books_db.items()},
+        **meta
+    }
+    return json.dumps(payload, indent=2).encode('utf-8')
+
+def _release_held_counts():
+    """Apply the counter bumps held back during serialization to the records."""
+    global _held_counts
+    with _counter_lock:
+        held, _held_counts = _held_counts, None
+        for (book_id, field), n in held.items():
+            book = books_db.get(book_id)
+            if book:
+                book[field] = book.get(field, 0) + n
+                if field in TREND_FIELDS:
+                    _rank_book(book)
+
+@metrics.timed(PERSIST_SECONDS, ('snapshot',))
 def save_data():
+    """Compact the store: write a full snapshot and start an empty journal."""
+    global _journal_records, _held_counts
+    with _synced_store():
+        try:
+            # The snapshot holds every increment buffered so far, so those are
+            # not journaled again. Bumps made while it is serialized stay
+            # pending and are held off the records until it is done (see
+            # _bump_locked()), so /read and /download never wait for it.
+            with _counter_lock:
+                meta = {'user_counter': user_counter, 'book_counter': book_counter,
+                        'journal_seq': _journal_seq, 'trend_epoch': _trend_epoch}
+                taken = list(_pending_counts.items())
+                _pending_counts.clear()
+                _held_counts = {}
+            try:
+                data = _serialize_snapshot(meta)
+            finally:
+                _release_held_counts()
+            path = SNAPSHOT_FILE if SNAPSHOT_FORMAT == 'binary' else DATA_FILE
+            try:
+                _write_atomic(path, data)
+            except BaseException:
+                # nothing was saved; those increments still need journaling
+                with _counter_lock:
+                    for key, n in taken:
+                        _pending_counts[key] = _pending_counts.get(key, 0) + n
+                raise
+            if metrics.ENABLED:
+                PERSIST_BYTES.inc(('snapshot',), len(data))
+
+            # A new file (not a truncation) so other workers see the inode change.
+            marker = (json.dumps({'seq': _journal_seq, 'op': 'snapshot'}) + '\n').encode('utf-8')
+            _write_atomic(JOURNAL_FILE, marker)
+            _journal_caught_up(os.stat(JOURNAL_FILE))
+            _journal_records = 0
+            logger.debug("Saved data to disk.")
+        except Exception as e:
+            logger.error(f"Failed to save data: {e}")
+
+# -------------------------
+# VIEW / DOWNLOAD COUNTERS
+# -------------------------
+# Counter bumps update the book in memory straight away (so pages show them)
+# but only reach the store in coalesced batches written by a background
+# flusher, keeping disk I/O out of /read and /download. Stores that hand out
+# copies (SQLite) get the pending increments overlaid on every read. While
+# save_data() serializes a snapshot, bumps are held aside and land on the
+# records once it is done.
+#
+# Each bump also adds to the book's time-decayed score for that counter
+# (popularity.py), which is buffered and journaled the same way. The flusher
+# also moves the epoch those scores count from forward when it is due
+# (rebase_trends()); pending increments are rescaled along with the scores,
+# and each flush tells the store which epoch its increments count from.
+TREND_FIELDS = frozenset(popularity.TREND_FIELDS.values())
+COUNTER_FIELDS = ('views', 'downloads', *popularity.TREND_FIELDS.values())
+
+def _bump_locked(book, field, n):
+    key = (book['id'], field)
+    if _held_counts is None:
+        book[field] = book.get(field, 0) + n
+    else:
+        _held_counts[key] = _held_counts.get(key, 0) + n
+    _pending_counts[key] = _pending_counts.get(key, 0) + n
+
+def bump_counter(book, field):
+    with _counter_lock:
+        _bump_locked(book, field, 1)
+        trend = popularity.TREND_FIELDS.get(field)
+        if trend:
+            try:
+                _bump_locked(book, trend, popularity.weight(epoch=_trend_epoch))
+            except OverflowError:
+                # the epoch is long overdue for a rebase, which the flusher
+                # is woken to do; until then only the plain count moves
+                logger.warning("Trend epoch too old to score events; rebasing.")
+                _counter_wakeup.set()
+            else:
+                if store.live_records:
+                    _rank_book(book)
+        if len(_pending_counts) >= COUNTER_FLUSH_THRESHOLD:
+            _counter_wakeup.set()
+
+def _overlay_pending(books):
+    """Add increments not yet flushed to book copies read from the store."""
+    if store.live_records or not _pending_counts:
+        return books
+    with _counter_lock:
+        for book in books:
+            for field in COUNTER_FIELDS:
+                n = _pending_counts.get((book['id'], field))
+                if n:
+                    book[field] = book.get(field, 0) + n
+    return books
+
+def flush_counters():
+    """Write all buffered counter increments to the store."""
+    with _journal_lock:
+        with _counter_lock:
+            if not _pending_counts:
+                return
+            pending = list(_pending_counts.items())
+            epoch = _trend_epoch
+            _pending_counts.clear()
+        store.record_counts(pending, epoch)
+        logger.debug(f"Flushed {len(pending)} counter updates.")
+
+def _rescale_pending_locked(counts, factor):
+    """Multiply the trend increments in {(book_id, field): n} by `factor`."""
+    if factor != 1:
+        for key in counts:
+            if key[1] in TREND_FIELDS:
+                counts[key] *= factor
+
+def _set_trend_epoch(epoch):
+    """Count pending trend increments from `epoch`, if the store moved on to it."""
+    global _trend_epoch
+    with _counter_lock:
+        if epoch > _trend_epoch:
+            _rescale_pending_locked(_pending_counts, popularity.rescale(_trend_epoch, epoch))
+            _trend_epoch = epoch
+
+def _rebase_trends_locked(epoch, index=True):
+    """Count every in-memory trend score from `epoch`. Call under _index_write()."""
+    global _trend_epoch
+    with _counter_lock:
+        if epoch <= _trend_epoch:
+            return
+        factor = popularity.rescale(_trend_epoch, epoch)
+        for book in books_db.values():
+            for field in TREND_FIELDS:
+                if book.get(field):
+                    book[field] *= factor
+        _rescale_pending_locked(_pending_counts, factor)
+        if _held_counts:
+            _rescale_pending_locked(_held_counts, factor)
+        _trend_epoch = epoch
+        if index:
+            for ranking in _rankings.values():
+                ranking.rebuild(books_db.values())
+
+def rebase_trends():
+    """Move the store's trend epoch forward once it is due (see popularity.py)."""
+    epoch = store.trend_epoch()
+    new = popularity.rebased(epoch)
+    if new != epoch:
+        store.rebase_trends(epoch, new)
+        logger.info(f"Trend scores rebased by {round((new - epoch) / popularity.HALF_LIFE)} half-lives.")
+    _set_trend_epoch(store.trend_epoch())
+
+def _counter_flusher():
+    while True:
+        _counter_wakeup.wait(COUNTER_FLUSH_INTERVAL)
+        _counter_wakeup.clear()
+        try:
+            store.refresh()   # keeps an idle worker within a journal of the others
+            flush_counters()
+            rebase_trends()
+        except Exception:
+            logger.exception("Counter flush failed")
+
+def start_counter_flusher():
+    thread = threading.Thread(target=_counter_flusher, name='counter-flusher', daemon=True)
+    thread.start()
+    atexit.register(flush_counters)
+    return thread
+
+# -------------------------
+# PASSWORD HASHING
+# -------------------------
+# Password hashes are slow on purpose, so a login burst could otherwise keep
+# every request thread busy hashing while /browse and /read wait. Hashing runs
+# on a small pool instead; the hash functions release the GIL, so the pool
+# threads run on other cores. At most HASH_WORKERS + HASH_QUEUE_DEPTH hashes
+# may be running or queued; past that, callers get HashingOverloaded at once
+# and the route answers 503 rather than tying up a thread.
+#
+# An admitted login still waits in its request thread for the hash, so
+# HASH_WORKERS + HASH_QUEUE_DEPTH must stay below the request threads per
+# process, or a flood can hold all of them. Set SERVER_THREADS to gunicorn's
+# --threads; the defaults keep the pool to half of it, and init_app() warns
+# if the settings leave no thread free.
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS',
+                                  max(min((os.cpu_count() or 1) // 2, SERVER_THREADS // 4), 1)))
+HASH_QUEUE_DEPTH = int(os.environ.get('HASH_QUEUE_DEPTH', max(SERVER_THREADS // 2 - HASH_WORKERS, 0)))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+HASH_RETRY_AFTER = 2   # seconds, sent with the 503
+# werkzeug method string; stored hashes made with other parameters are
+# upgraded on the user's next successful login
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+HASH_SECONDS = metrics.Histogram('kitabghar_password_hash_seconds',
+                                 'Time in the hashing pool, queueing included.', ('op',))
+HASH_REJECTED = metrics.Counter('kitabghar_password_hash_rejected_total',
+                                'Hashes refused because the pool was full.', ('op',))
+
+class HashingOverloaded(Exception):
+    """The password hashing pool is full; retry later."""
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_DEPTH)
+_hash_params = None
+
+def _run_hash(op, fn, *args):
+    """Run fn on the hashing pool and wait for it, or raise HashingOverloaded."""
+    if not _hash_slots.acquire(blocking=False):
+        if metrics.ENABLED:
+            HASH_REJECTED.inc((op,))
+        raise HashingOverloaded()
+    start = time.perf_counter()
     try:
-        users_serial = {
-            str(k): {**v, 'created_at': _dt_to_iso(v.get('created_at'))}
-            for k, v in users_db.items()
-        }
-        books_serial = {
-            str(k): {**v, 'uploaded_at': _dt_to_iso(v.get('uploaded_at'))}
-            for k, v in books_db.items()
-        }
-        payload = {
-            'users_db': users_serial,
-            'books_db': books_serial,
-            'user_counter': user_counter,
-            'book_counter': book_counter
-        }
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(payload, f, indent=2)
-        logger.debug("Saved data to disk.")
-    except Exception as e:
-        logger.error(f"Failed to save data: {e}")
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    # the slot is held until the hash finishes, even if the caller gave up
+    future.add_done_callback(lambda _: _hash_slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HashingOverloaded() from None
+    finally:
+        if metrics.ENABLED:
+            HASH_SECONDS.observe(time.perf_counter() - start, (op,))
+
+def _current_hash_params():
+    """The 'method:params' prefix that PASSWORD_HASH_METHOD produces today."""
+    global _hash_params
+    if _hash_params is None:
+        _hash_params = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return _hash_params
+
+def _verify_and_upgrade(stored, password):
+    """(matches, replacement hash or None); runs on the hashing pool."""
+    if not check_password_hash(stored, password):
+        return False, None
+    if stored.split('$', 1)[0] == _current_hash_params():
+        return True, None
+    return True, generate_password_hash(password, PASSWORD_HASH_METHOD)
+
+def hash_password(password):
+    return _run_hash('hash', generate_password_hash, password, PASSWORD_HASH_METHOD)
 
 # -------------------------
 # USER MANAGEMENT
 # -------------------------
 def create_user(username, email, password, role='reader'):
-    global user_counter
-    user_id = user_counter
-    user_counter += 1
     user_data = {
-        'id': user_id,
         'username': username,
         'email': email,
-        'password_hash': generate_password_hash(password),
+        'password_hash': hash_password(password),
         'role': role,
         'created_at': datetime.now()
     }
-    users_db[user_id] = user_data
-    save_data()
-    return user_data
+    return store.add_user(user_data)
+
+def remove_user(user_id):
+    return store.delete_user(user_id)
 
 def get_user_by_username(username):
-    return next((u for u in users_db.values() if u['username'] == username), None)
+    return store.get_user_by_username(username) if username else None
+
+def get_user_by_email(email):
+    return store.get_user_by_email(email) if email else None
 
 def get_user_by_id(user_id):
     try:
         user_id = int(user_id)
     except Exception:
         return None
-    return users_db.get(user_id)
+    return store.get_user(user_id)
+
+def list_users():
+    """All users, newest first."""
+    return store.list_users()
+
+def count_users():
+    return store.count_users()
 
 def authenticate_user(username, password):
+    """The user if the password matches, else None; may raise HashingOverloaded."""
     user = get_user_by_username(username)
-    return user if user and check_password_hash(user['password_hash'], password) else None
+    if not user:
+        return None
+    ok, new_hash = _run_hash('verify', _verify_and_upgrade, user['password_hash'], password)
+    if not ok:
+        return None
+    if new_hash:
+        logger.info(f"Rehashed password for user {user['id']} with {PASSWORD_HASH_METHOD}")
+        user = store.update_user(user['id'], {'password_hash': new_hash}) or user
+    return user
 
 # -------------------------
 # BOOK MANAGEMENT
 # -------------------------
-def create_book(title, author, category, description, filename, uploaded_by):
-    global book_counter
-    book_id = book_counter
-    book_counter += 1
+def create_book(title, author, category, description, filename, uploaded_by, sha256=None):
     book_data = {
-        'id': book_id,
         'title': title,
         'author': author,
         'category': category,
         'description': description,
         'filename': filename,
+        'sha256': sha256,
         'uploaded_by': uploaded_by,
         'uploaded_at': datetime.now(),
         'downloads': 0,
         'views': 0
     }
-    books_db[book_id] = book_data
-    save_data()
-    return book_data
+    return store.add_book(book_data)
+
+def update_book(book_id, **fields):
+    """Set fields on a book, keeping the search index in step."""
+    return store.update_book(book_id, fields)
+
+def remove_book(book_id):
+    return store.delete_book(book_id)
+
+def get_book(book_id):
+    book = store.get_book(book_id)
+    return _overlay_pending([book])[0] if book else None
+
+def count_books(category=None):
+    return store.count_books(category)
+
+def recent_books(offset=0, limit=None, category=None, before=None):
+    """Return a newest-first page of books without sorting the catalog.
+
+    `before` is a store.recency_key() from an earlier page; the page then
+    starts right after that book, wherever books were added or deleted since.
+    Raises ValueError for a key the store could not have made.
+    """
+    return _overlay_pending(store.recent_books(offset, limit, category, before))
+
+def popular_books(field, limit=None, category=None):
+    """Books by time-decayed 'views' or 'downloads', highest first, without sorting the catalog."""
+    return _overlay_pending(store.popular_books(popularity.TREND_FIELDS[field], limit, category))
+
+def books_by_uploader(user_id):
+    """Books uploaded by one user, newest first."""
+    return _overlay_pending(store.books_by_uploader(user_id))
+
+@metrics.timed(SEARCH_SECONDS)
+def search_books(query=None, category=None, mode=None):
+    """Find books matching every term of `query`, best matches first.
+
+    Each query term matches indexed terms it is a prefix of; when nothing
+    does, misspelled title/author words are matched by trigram similarity.
+    mode='fuzzy' goes straight to that, and mode='substring' (or SEARCH_MODE)
+    selects the original linear substring scan instead.
+    """
+    return _overlay_pending(store.search_books(query, category, mode or SEARCH_MODE))
+
+def get_all_categories():
+    return store.get_all_categories()
+
+def category_counts():
+    """[(category, number of books)] sorted by name, from the category index."""
+    return store.category_counts()
+
+def suggest_completions(prefix, limit=suggest.DEFAULT_LIMIT):
+    """[(text, kind, books)] titles, authors and categories starting with prefix."""
+    return store.suggest(prefix, limit)
+
+def catalog_version():
+    """A number that changes whenever books are added, edited or removed."""
+    return store.catalog_version()
+
+def search_ready():
+    """False while search and completions are still served without their index."""
+    return store.search_ready()
+
+# -------------------------
+# INDEXES
+# -------------------------
+# Secondary indexes over users_db/books_db, kept current by MemoryStore's
+# add/update/delete methods and rebuilt from scratch by load_data(), except
+# the search index, which catches up on a background thread.
+#
+# Readers never lock. Writers, already serialized by _journal_lock, make
+# _index_version odd while they change the dicts or indexes and even again
+# when done; a reader that saw the version move, or tripped over a
+# half-applied change, simply runs again.
+READ_RETRIES = 8
+_index_version = 0
+_index_depth = 0
+
+@contextmanager
+def _index_write():
+    global _index_version, _index_depth
+    with _journal_lock:
+        if _index_depth == 0:
+            _index_version += 1
+        _index_depth += 1
+        try:
+            yield
+        finally:
+            _index_depth -= 1
+            if _index_depth == 0:
+                _index_version += 1
+
+def _consistent_read(fn, *args):
+    """Run a read over the in-memory store without locking, retrying on conflicts."""
+    for _ in range(READ_RETRIES):
+        version = _index_version
+        if version % 2 == 0:
+            try:
+                result = fn(*args)
+                if _index_version == version:
+                    return result
+            except (RuntimeError, KeyError, IndexError):
+                pass   # raced with a writer
+        time.sleep(0)
+    # writers kept winning; wait for them once instead
+    with _journal_lock:
+        return fn(*args)
+
+def _index_book(book):
+    _index_terms(book)
+    with _counter_lock:
+        _rank_book(book)
+    bisect.insort(_recent_keys, _recency_key(book))
+    _index_category(book)
+    _add_key(_uploader_keys, book.get('uploaded_by'), book)
+    key = _blob_key(book.get('filename'))
+    _blob_refs[key] = _blob_refs.get(key, 0) + 1
+
+def _unindex_book(book):
+    _unindex_terms(book)
+    with _counter_lock:
+        for ranking in _rankings.values():
+            ranking.remove(book['id'])
+    key = _blob_key(book.get('filename'))
+    _blob_refs[key] = _blob_refs.get(key, 1) - 1
+    if _blob_refs[key] <= 0:
+        del _blob_refs[key]
+    key = _recency_key(book)
+    i = bisect.bisect_left(_recent_keys, key)
+    if i < len(_recent_keys) and _recent_keys[i] == key:
+        del _recent_keys[i]
+    _unindex_category(book)
+    _remove_key(_uploader_keys, book.get('uploaded_by'), book)
+
+def _set_book_fields(book, fields):
+    """book.update(fields), keeping the indexes that depend on those fields in step."""
+    reindex = any(name in fields for name in INDEXED_FIELDS)
+    if reindex:
+        _unindex_terms(book)
+    if 'category' in fields:
+        _unindex_category(book)
+    if 'uploaded_by' in fields:
+        _remove_key(_uploader_keys, book.get('uploaded_by'), book)
+    book.update(fields)
+    if reindex:
+        _index_terms(book)
+    if 'uploaded_by' in fields:
+        _add_key(_uploader_keys, book.get('uploaded_by'), book)
+    if 'category' in fields:
+        _index_category(book)
+        with _counter_lock:
+            _rank_book(book)
+
+def _rebuild_indexes():
+    with _index_write():
+        _rebuild_indexes_locked()
+
+def _rebuild_indexes_locked():
+    _users_by_name.clear()
+    _users_by_email.clear()
+    for user in users_db.values():
+        _index_user(user)
+    _recent_keys.clear()
+    _category_keys.clear()
+    _uploader_keys.clear()
+    _blob_refs.clear()
+    for book in books_db.values():
+        key = _recency_key(book)
+        _recent_keys.append(key)
+        _category_keys.setdefault(book.get('category') or '', []).append(key)
+        _uploader_keys.setdefault(book.get('uploaded_by'), []).append(key)
+        key = _blob_key(book.get('filename'))
+        _blob_refs[key] = _blob_refs.get(key, 0) + 1
+    _recent_keys.sort()
+    for keys in itertools.chain(_category_keys.values(), _uploader_keys.values()):
+        keys.sort()
+    with _counter_lock:
+        for ranking in _rankings.values():
+            ranking.rebuild(books_db.values())
+
+# Username and email indexes: case-normalized key -> users, so login and
+# registration lookups don't scan users_db. Registration refuses a name or
+# email another user has in any case, but older stores can hold users whose
+# names differ only in case ("Alice" and "alice"). Those share a key; a
+# lookup prefers the exact spelling, then the oldest account, so each of
+# them can still log in. Lists are replaced, never changed in place, since
+# lookups don't take the index lock.
+_users_by_name = {}    # {normalized username: [users, oldest first]}
+_users_by_email = {}   # {normalized email: [users, oldest first]}
+
+def _normalize_key(value):
+    return value.strip().casefold()
+
+def _user_keys(user):
+    return ((_users_by_name, user['username']), (_users_by_email, user.get('email')))
+
+def _index_user(user):
+    for index, value in _user_keys(user):
+        if value:
+            key = _normalize_key(value)
+            index[key] = sorted([*index.get(key, ()), user], key=lambda u: u['id'])
+
+def _unindex_user(user):
+    for index, value in _user_keys(user):
+        if not value:
+            continue
+        key = _normalize_key(value)
+        remaining = [u for u in index.get(key, ()) if u is not user]
+        if remaining:
+            index[key] = remaining
+        else:
+            index.pop(key, None)
+
+def _lookup_user(index, field, value):
+    users = index.get(_normalize_key(value))
+    if not users:
+        return None
+    value = value.strip()
+    return next((u for u in users if u.get(field) == value), users[0])
+
+def _log_user_collisions():
+    for index, field in ((_users_by_name, 'username'), (_users_by_email, 'email')):
+        for users in index.values():
+            if len(users) > 1:
+                logger.warning(f"Users {', '.join(str(u['id']) for u in users)} share the {field} "
+                               f"{users[0][field]!r} apart from case; lookups prefer the exact spelling.")
 
-def search_books(query=None, category=None):
+# Recency index: (upload timestamp, book_id) pairs in ascending order, so the
+# newest books sit at the end of the list.
+_recent_keys = []
+
+def _recency_key(book):
+    ts = getattr(book, 'uploaded_ts', 0)
+    return (ts if isinstance(ts, int) else 0, book['id'])
+
+def iter_recent_books(category=None):
+    """Yield books newest first, optionally limited to one category."""
+    keys = _category_keys.get(category, ()) if category else _recent_keys
+    for _, book_id in reversed(keys):
+        book = books_db.get(book_id)
+        if book:
+            yield book
+
+def _recent_slice(offset=0, limit=None, category=None, before=None):
+    keys = _category_keys.get(category, []) if category else _recent_keys
+    end = (len(keys) if before is None else bisect.bisect_left(keys, before)) - offset
+    start = 0 if limit is None else max(end - limit, 0)
+    return [books_db[book_id] for _, book_id in reversed(keys[start:max(end, 0)])]
+
+# Category index: category -> that category's recency keys, in the same order
+# as _recent_keys. A category's page of books is a slice and its count a
+# len(), so browsing one category and the category dropdown never scan the
+# catalog. Uncategorized books are under ''. _uploader_keys does the same
+# per uploader for the profile page.
+_category_keys = {}   # {category: [(upload timestamp, book_id), ...] ascending}
+_uploader_keys = {}   # {user id: [(upload timestamp, book_id), ...] ascending}
+
+def _add_key(index, value, book):
+    bisect.insort(index.setdefault(value, []), _recency_key(book))
+
+def _remove_key(index, value, book):
+    keys = index.get(value)
+    if keys is None:
+        return
+    key = _recency_key(book)
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+    if not keys:
+        del index[value]
+
+def _index_category(book):
+    _add_key(_category_keys, book.get('category') or '', book)
+
+def _unindex_category(book):
+    _remove_key(_category_keys, book.get('category') or '', book)
+
+def _category_counts():
+    return sorted((category, len(keys)) for category, keys in _category_keys.items() if category)
+
+# Popularity rankings: one popularity.Ranking per time-decayed score field,
+# moved by bump_counter() and by counter records replayed from other
+# workers. Changes go through _counter_lock rather than _index_write(), so
+# a read or download does not make every reader retry.
+_rankings = {field: popularity.Ranking(field) for field in TREND_FIELDS}
+
+def _rank_book(book):
+    for ranking in _rankings.values():
+        ranking.update(book)
+
+def _top_books(field, limit=None, category=None):
+    ranked = _rankings[field].top(len(books_db) if limit is None else limit, category)
+    return [books_db[book_id] for _, book_id in ranked if book_id in books_db]
+
+# -------------------------
+# SEARCH INDEX
+# -------------------------
+# Inverted index over title, author and description: term -> {book_id: weight}.
+# Weights favour title hits over author hits over description hits. Terms are
+# also kept in a sorted list so prefixes resolve with a bisect.
+#
+# A query nothing matches as typed falls back to fuzzy.TrigramIndex, which
+# matches misspelled title and author words ("premchnd"); mode='fuzzy' asks
+# for it directly. It and the suggest.PrefixIndex behind /suggest are built
+# and kept current along with the index above.
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'index')   # 'index', 'fuzzy' or 'substring'
+SEARCH_FIELDS = (('title', 3), ('author', 2), ('description', 1), ('content_text', 1))
+# a book_set touching any of these re-indexes the book
+INDEXED_FIELDS = frozenset([name for name, _ in SEARCH_FIELDS] + ['category'])
+_TOKEN_RE = re.compile(r'\w+')
+
+_postings = {}       # {term: {book_id: weight}}
+_sorted_terms = []   # every term in _postings, sorted
+_name_trigrams = fuzzy.TrigramIndex()
+_suggestions = suggest.PrefixIndex()
+SEARCH_INDEX_SLICE = int(os.environ.get('SEARCH_INDEX_SLICE', 100))   # books per _index_write()
+# the fields indexed above, by _search_index(), fuzzy and suggest
+SEARCH_KEY_FIELDS = sorted(INDEXED_FIELDS)
+# {book_id: record the index holds for it, or None} for books the background
+# thread has yet to (re)index; writers leave those to it. None: no index.
+_search_pending = None
+_search_ready = False   # the index has covered the catalog once
+_search_built = threading.Event()
+_search_thread = None
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.casefold()) if text else []
+
+def _book_terms(book):
+    weights = {}
+    for field, weight in SEARCH_FIELDS:
+        for term in _tokenize(book.get(field, '')):
+            weights[term] = weights.get(term, 0) + weight
+    return weights
+
+def _search_fields(book):
+    return [book.get(name) for name in SEARCH_KEY_FIELDS]
+
+def start_search_index(wait=False):
+    """Index the catalog for search on a background thread.
+
+    Indexing reads every description and extracted text, so it is not done
+    by load_data(), which would undo the lazy snapshot load, nor by the
+    first search, which would hold up every request behind it. Until the
+    index has covered the catalog, searches scan and /suggest has nothing.
+    """
+    global _search_pending
+    if _search_pending is None:
+        with _index_write():
+            if _search_pending is None:
+                _search_pending = dict.fromkeys(books_db)
+                _start_search_builder()
+    if wait:
+        _search_built.wait()
+
+def _queue_search_reindex(indexed):
+    """Have the search index catch up with books it holds as `indexed` {book_id: record or None}."""
+    if _search_pending is None:
+        return
+    for book_id, book in indexed.items():
+        _search_pending.setdefault(book_id, book)
+    _start_search_builder()
+
+def _start_search_builder():
+    global _search_thread
+    if _search_thread is None and _search_pending is not None:
+        _search_thread = threading.Thread(target=_build_search_index, name='search-index', daemon=True)
+        _search_thread.start()
+
+def _build_search_index():
+    """Index the books in _search_pending, SEARCH_INDEX_SLICE at a time.
+
+    Each slice holds _index_write() only while it is indexed, so other
+    requests wait for one slice at most. A book still pending was indexed
+    as the record it maps to, if any; it is only re-indexed when its search
+    fields differ from that record's.
+    """
+    global _search_ready, _search_thread
+    start, count = time.perf_counter(), 0
+    while True:
+        with _index_write():
+            if not _search_pending:
+                _search_thread = None
+                built, _search_ready = not _search_ready, True
+                break
+            added = []
+            for book_id in list(itertools.islice(_search_pending, SEARCH_INDEX_SLICE)):
+                indexed = _search_pending.pop(book_id)
+                book = books_db.get(book_id)
+                if indexed is not None and book is not None and _search_fields(indexed) == _search_fields(book):
+                    continue
+                if indexed is not None:
+                    _unindex_terms(indexed)
+                if book is not None:
+                    _index_terms(book, suggestions=False)
+                    added.append(book)
+                count += 1
+            _suggestions.add_many(added)
+        time.sleep(0)   # let requests waiting on the lock in
+    _search_built.set()
+    logger.debug(f"{'Built' if built else 'Updated'} search index for {count} books "
+                 f"in {time.perf_counter() - start:.2f}s.")
+
+def _index_terms(book, suggestions=True):
+    if _search_pending is None or book['id'] in _search_pending:
+        return
+    _name_trigrams.add(book)
+    if suggestions:
+        _suggestions.add(book)
+    for term, weight in _book_terms(book).items():
+        posting = _postings.get(term)
+        if posting is None:
+            posting = _postings[term] = {}
+            bisect.insort(_sorted_terms, term)
+        posting[book['id']] = weight
+
+def _unindex_terms(book):
+    if _search_pending is None or book['id'] in _search_pending:
+        return
+    _name_trigrams.remove(book)
+    _suggestions.remove(book)
+    for term in _book_terms(book):
+        posting = _postings.get(term)
+        if posting is None:
+            continue
+        posting.pop(book['id'], None)
+        if not posting:
+            del _postings[term]
+            i = bisect.bisect_left(_sorted_terms, term)
+            if i < len(_sorted_terms) and _sorted_terms[i] == term:
+                del _sorted_terms[i]
+
+def _term_matches(term):
+    """Score books for one query term: exact hits count double, prefix hits once."""
+    scores = {}
+    i = bisect.bisect_left(_sorted_terms, term)
+    while i < len(_sorted_terms) and _sorted_terms[i].startswith(term):
+        candidate = _sorted_terms[i]
+        factor = 2 if candidate == term else 1
+        for book_id, weight in _postings[candidate].items():
+            scores[book_id] = scores.get(book_id, 0) + weight * factor
+        i += 1
+    return scores
+
+def _search_substring(query=None, category=None):
+    if not query and category:
+        # everything in one category, in id order like the full scan
+        return [books_db[book_id] for book_id in sorted(i for _, i in _category_keys.get(category, ()))]
     results = []
     for book in books_db.values():
         if query:
@@ -198,8 +1333,548 @@ def search_books(query=None, category=None):
             results.append(book)
     return results
 
-def get_all_categories():
-    return sorted(set(b.get('category') for b in books_db.values() if b.get('category')))
+def _search_fuzzy(query, category=None):
+    accept = None
+    if category:
+        accept = lambda book_id: books_db.get(book_id, {}).get('category') == category   # noqa: E731
+    hits = _name_trigrams.search(query, accept=accept)
+    return [books_db[book_id] for _, book_id in hits if book_id in books_db]
+
+def _search_index(query=None, category=None, mode='index'):
+    terms = _tokenize(query)
+    if not query or mode == 'substring' or not terms:
+        return _search_substring(query, category)
+    if mode == 'fuzzy':
+        return _search_fuzzy(query, category)
+
+    scores = None
+    for term in sorted(set(terms), key=len, reverse=True):
+        matches = _term_matches(term)
+        if scores is None:
+            scores = matches
+        else:
+            scores = {b: s + matches[b] for b, s in scores.items() if b in matches}
+        if not scores:
+            break
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+    results = []
+    for book_id, _ in ranked:
+        book = books_db.get(book_id)
+        if book and (not category or book.get('category') == category):
+            results.append(book)
+    # nothing matched as typed; try typo-tolerant title/author matching
+    return results or _search_fuzzy(query, category)
+
+# -------------------------
+# STORAGE ENGINES
+# -------------------------
+# The USER / BOOK MANAGEMENT helpers all go through `store`. The memory
+# engine wraps the dicts, journal and indexes in this module; the SQLite
+# engine (sqlite_store.py) keeps records on disk so startup and RSS do not
+# grow with the catalog, and several workers can share one database.
+# import_store.py copies an existing snapshot + journal into SQLite.
+class MemoryStore:
+    """Storage engine over users_db/books_db and the journal."""
+
+    # records handed out are the stored dicts, so counter bumps land in place
+    live_records = True
+
+    def load(self):
+        load_data()
+
+    def refresh(self):
+        _refresh_journal()
+
+    def checkpoint(self):
+        save_data()
+
+    # Mutations run under _synced_store() so ids are allocated, and the
+    # change applied, on top of everything other workers have written.
+    def add_user(self, user):
+        global user_counter
+        with _synced_store():
+            user = User(user, id=user_counter)
+            user_counter += 1
+            with _index_write():
+                users_db[user['id']] = user
+                _index_user(user)
+            _journal('user_add', user=_serialize_user(user))
+        return user
+
+    def update_user(self, user_id, fields):
+        with _synced_store():
+            user = users_db.get(user_id)
+            if user is None:
+                return None
+            with _index_write():
+                _unindex_user(user)
+                user.update(fields)
+                _index_user(user)
+            _journal('user_set', id=user_id, fields=fields)
+        return user
+
+    def delete_user(self, user_id):
+        with _synced_store():
+            with _index_write():
+                user = users_db.pop(user_id, None)
+                if user:
+                    _unindex_user(user)
+            if user:
+                _journal('user_del', id=user_id)
+        return user
+
+    def get_user(self, user_id):
+        return users_db.get(user_id)
+
+    def get_user_by_username(self, username):
+        return _lookup_user(_users_by_name, 'username', username)
+
+    def get_user_by_email(self, email):
+        return _lookup_user(_users_by_email, 'email', email)
+
+    def list_users(self):
+        # users_db keeps insertion (= creation) order, so newest first is just reversed
+        return _consistent_read(lambda: list(reversed(users_db.values())))
+
+    def count_users(self):
+        return len(users_db)
+
+    def add_book(self, book):
+        global book_counter
+        with _synced_store():
+            book = Book(book, id=book_counter)
+            book_counter += 1
+            with _index_write():
+                books_db[book['id']] = book
+                _index_book(book)
+            _journal('book_add', book=_serialize_book(book))
+        return book
+
+    def add_books(self, books):
+        """Add many new books with one journal write instead of one each."""
+        global book_counter
+        added = []
+        with _synced_store():
+            with _index_write():
+                for book in books:
+                    book = Book(book, id=book_counter)
+                    book_counter += 1
+                    books_db[book['id']] = book
+                    _index_book(book)
+                    added.append(book)
+            if added:
+                _journal_append([('book_add', {'book': _serialize_book(book)}) for book in added])
+        return added
+
+    def update_book(self, book_id, fields):
+        with _synced_store():
+            book = books_db.get(book_id)
+            if book is None:
+                return None
+            with _index_write():
+                _set_book_fields(book, fields)
+            _journal('book_set', id=book_id, fields=fields)
+        return book
+
+    def update_books(self, updates):
+        """update_book() for each {book_id: fields}, with one journal write."""
+        records = []
+        with _synced_store():
+            with _index_write():
+                for book_id, fields in updates.items():
+                    book = books_db.get(book_id)
+                    if book is not None:
+                        _set_book_fields(book, fields)
+                        records.append(('book_set', {'id': book_id, 'fields': fields}))
+            if records:
+                _journal_append(records)
+
+    def delete_book(self, book_id):
+        with _synced_store():
+            with _index_write():
+                book = books_db.pop(book_id, None)
+                if book:
+                    _unindex_book(book)
+            if book:
+                _journal('book_del', id=book_id)
+        return book
+
+    def get_book(self, book_id):
+        return books_db.get(book_id)
+
+    def count_books(self, category=None):
+        if category:
+            return len(_category_keys.get(category, ()))
+        return len(books_db)
+
+    def recent_books(self, offset=0, limit=None, category=None, before=None):
+        if before is not None:
+            before = tuple(before)
+            if len(before) != 2 or not all(type(v) is int for v in before):
+                raise ValueError(f'not a recency key: {before!r}')
+        return _consistent_read(_recent_slice, offset, limit, category, before)
+
+    def recency_key(self, book):
+        """The book's place in recent_books(), as a JSON-safe [timestamp, id]."""
+        return list(_recency_key(book))
+
+    def popular_books(self, field, limit=None, category=None):
+        return _consistent_read(_top_books, field, limit, category)
+
+    def books_by_uploader(self, user_id):
+        return _consistent_read(
+            lambda: [books_db[i] for _, i in reversed(_uploader_keys.get(user_id, ()))])
+
+    def books_pending_extraction(self):
+        return _consistent_read(
+            lambda: [b for b in books_db.values() if b.get('extract_status') == 'pending'])
+
+    def file_in_use(self, blob):
+        return blob in _blob_refs
+
+    def search_books(self, query=None, category=None, mode='index'):
+        if query and not _search_ready:
+            start_search_index()
+            mode = 'substring'
+        return _consistent_read(_search_index, query, category, mode)
+
+    def suggest(self, prefix, limit=suggest.DEFAULT_LIMIT):
+        if not _search_ready:
+            start_search_index()
+            return []
+        return _consistent_read(_suggestions.complete, prefix, limit)
+
+    def get_all_categories(self):
+        return [category for category, _ in self.category_counts()]
+
+    def category_counts(self):
+        return _consistent_read(_category_counts)
+
+    def catalog_version(self):
+        return _catalog_seq
+
+    def search_ready(self):
+        return _search_ready
+
+    def record_counts(self, deltas, epoch=popularity.EPOCH):
+        # the in-memory records were already bumped; only the journal is behind
+        with _synced_store():
+            factor = popularity.rescale(epoch, _trend_epoch)
+            _journal_append([('book_inc', {'id': book_id, 'field': field,
+                                           'n': n * factor if field in TREND_FIELDS else n})
+                             for (book_id, field), n in deltas])
+
+    def trend_epoch(self):
+        return _trend_epoch
+
+    def rebase_trends(self, epoch, new):
+        """Count trend scores from `new` instead of `epoch`, unless another worker already moved it."""
+        with _synced_store():
+            if _trend_epoch != epoch:
+                return
+            with _index_write():
+                _rebase_trends_locked(new)
+            _journal('trend_rebase', epoch=new)
+
+    def import_records(self, users, books):
+        """Insert records keeping their ids, then write one fresh snapshot."""
+        global user_counter, book_counter
+        with _store_lock():
+            with _index_write():
+                for user in users:
+                    users_db[user['id']] = user if isinstance(user, User) else User(user)
+                indexed = {book['id']: books_db.get(book['id']) for book in books}
+                for book in books:
+                    books_db[book['id']] = book if isinstance(book, Book) else Book(book)
+                user_counter = max(users_db, default=0) + 1
+                book_counter = max(books_db, default=0) + 1
+                _rebuild_indexes()
+                _queue_search_reindex(indexed)
+            save_data()
+
+if STORAGE_BACKEND == 'sqlite':
+    store = SQLiteStore(SQLITE_PATH)
+elif STORAGE_BACKEND == 'memory':
+    store = MemoryStore()
+else:
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+
+# -------------------------
+# UPLOAD STORAGE
+# -------------------------
+# Uploads are content-addressed: the body is streamed to a temp file while
+# its SHA-256 is computed, then renamed to <sha256>.pdf. Identical content
+# reuses the existing file, and _blob_refs counts the books pointing at each
+# file so it is only removed with the last of them. Reusing or removing a
+# file, and the book change that goes with it, happen under _store_lock(), so
+# a worker never links a new book to a file another worker is deleting.
+#
+# Files live in a two-level hash-prefix layout (uploads/ab/cd/<name>.pdf) and
+# a book's 'filename' is that relative path. Older records hold a bare flat
+# name; resolve_upload() finds those whether or not migrate_uploads.py has
+# moved the file yet.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_blob_refs = {}   # {file basename: number of books using it}
+_HEX_RE = re.compile(r'[0-9a-f]{4}')
+
+def _blob_key(filename):
+    return os.path.basename(filename or '')
+
+def shard_name(name):
+    """Return the sharded relative path ('ab/cd/<name>') for a file name."""
+    name = os.path.basename(name)
+    stem = name.rsplit('.', 1)[0].lower()
+    prefix = stem[:4] if _HEX_RE.match(stem) else hashlib.sha1(name.encode()).hexdigest()[:4]
+    return f"{prefix[:2]}/{prefix[2:4]}/{name}"
+
+def resolve_upload(filename):
+    """Map a book's stored filename to its current path relative to UPLOAD_FOLDER."""
+    if not filename or '/' in filename:
+        return filename
+    sharded = shard_name(filename)
+    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], sharded)):
+        return sharded
+    return filename
+
+def upload_path(filename):
+    return os.path.join(app.config['UPLOAD_FOLDER'], resolve_upload(filename))
+
+def stream_to_temp(stream, suffix='.part'):
+    """Copy an upload stream to a temp file in fixed-size chunks.
+
+    Returns (temp_path, sha256 hex digest).
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=app.config['UPLOAD_FOLDER'])
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()
+
+def store_upload(file, title, author, category, description, uploaded_by):
+    """Store an uploaded PDF by content hash and create its book record."""
+    tmp_path, sha256 = stream_to_temp(file.stream)
+    with _store_lock():
+        filename, reused = _place_upload(tmp_path, sha256)
+        book = create_book(title, author, category, description, filename, uploaded_by, sha256=sha256)
+    if reused:
+        logger.info(f"Upload matches existing file {filename}; reusing it.")
+    else:
+        logger.info(f"Saved uploaded file: {filename}")
+    schedule_extraction(book)
+    schedule_related(book)
+    return book
+
+def store_uploads(items):
+    """Store many files from stream_to_temp() and their books in one step.
+
+    `items` is [(temp path, book)], each book carrying its file's 'sha256';
+    its 'filename' is filled in here. Returns the added books. Extraction
+    is not scheduled: bulk callers extract before storing.
+    """
+    with _store_lock():
+        for tmp_path, book in items:
+            book['filename'], _ = _place_upload(tmp_path, book['sha256'])
+        return store.add_books([book for _, book in items])
+
+def _place_upload(tmp_path, sha256):
+    """Move a temp file to its content-addressed path, or drop it for the stored copy.
+
+    Returns (relative filename, True if the stored copy was reused). Runs
+    under _store_lock(), held until the book using the file is stored.
+    """
+    filename = shard_name(f"{sha256}.pdf")
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(file_path):
+        os.unlink(tmp_path)
+        return filename, True
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    os.replace(tmp_path, file_path)
+    return filename, False
+
+def delete_book_and_file(book_id):
+    """Remove a book, deleting its file if no other book references it."""
+    with _store_lock():
+        book = remove_book(book_id)
+        if book is None or store.file_in_use(_blob_key(book.get('filename'))):
+            return book
+        file_path = upload_path(book.get('filename', ''))
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error deleting {file_path}: {e}")
+    return book
+
+# -------------------------
+# PDF EXTRACTION
+# -------------------------
+# After an upload, a process pool reads the PDF's page count, Info metadata
+# and text (see pdfinfo.py). The request never waits for it: the book's
+# extract_status goes pending -> done/failed and the text is indexed for
+# search when the job finishes.
+#
+# Every gunicorn worker runs init_app(), so each pending job records the pid
+# of the worker that queued it (extract_owner). At startup a worker resumes
+# only the pending jobs whose owner is no longer running, claiming them
+# under _store_lock(), so a job left over from the last run is queued by
+# exactly one worker.
+EXTRACT_ENABLED = os.environ.get('EXTRACT_ENABLED', '1') != '0'
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 1))
+EXTRACT_MAX_TEXT = int(os.environ.get('EXTRACT_MAX_TEXT', 100_000))
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def worker_context():
+    """The multiprocessing context for process pools.
+
+    Workers are never forked from a process that may be running threads (the
+    counter flusher, the hashing pool): one of them could hold a lock at the
+    fork, and the child would wait for it forever. They come from a fork
+    server where there is one, else they are spawned.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _get_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=worker_context())
+            atexit.register(_extract_pool.shutdown, wait=False, cancel_futures=True)
+        return _extract_pool
+
+def schedule_extraction(book):
+    """Queue background extraction for a book; returns immediately."""
+    if not EXTRACT_ENABLED:
+        return
+    update_book(book['id'], extract_status='pending', extract_owner=os.getpid())
+    path = upload_path(book.get('filename', ''))
+    try:
+        future = _get_extract_pool().submit(pdfinfo.extract, path, EXTRACT_MAX_TEXT)
+    except RuntimeError as e:   # pool shut down or broken
+        logger.error(f"Could not queue extraction for book {book['id']}: {e}")
+        update_book(book['id'], extract_status='failed', extract_owner=None)
+        return
+    future.add_done_callback(partial(_extraction_done, book['id']))
+
+def _extraction_done(book_id, future):
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.warning(f"Extraction failed for book {book_id}: {e}")
+        update_book(book_id, extract_status='failed', extract_owner=None)
+        return
+    update_book(book_id, extract_status='done', extract_owner=None,
+                pages=result.get('pages'),
+                pdf_meta=result.get('meta', {}),
+                content_text=result.get('text', ''))
+    logger.debug(f"Extracted book {book_id}: {result.get('pages')} pages.")
+
+def _owner_running(pid):
+    """True if another live process on this host holds the extraction job."""
+    if not pid or pid == os.getpid():
+        return False   # unowned, or left by an earlier process that had our pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass   # alive, just not ours to signal
+    return True
+
+def resume_extractions():
+    """Requeue pending jobs whose worker is gone, claiming each for this process."""
+    with _store_lock():
+        store.refresh()
+        for book in store.books_pending_extraction():
+            if not _owner_running(book.get('extract_owner')):
+                schedule_extraction(book)
+
+# -------------------------
+# RELATED BOOKS
+# -------------------------
+# build_related.py stores each book's most similar books in its 'related'
+# field as [[book_id, similarity], ...], best first (see related.py), so the
+# related section is a field read. A new upload is ranked against the model
+# that job saved and added to the lists it now belongs in, on one background
+# thread, which also keeps two uploads from rewriting the same list at once.
+# Books uploaded since the last build become candidates for each other at the
+# next build.
+RELATED_ENABLED = related.available() and os.environ.get('RELATED_ENABLED', '1') != '0'
+
+_related_pool = None
+_related_pool_lock = threading.Lock()
+_related_model = None   # (model file mtime_ns, related.Model)
+
+def _load_related_model():
+    """The saved model, reloaded when the batch job has replaced it; None if there is none."""
+    global _related_model
+    try:
+        mtime = os.stat(related.MODEL_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _related_model is None or _related_model[0] != mtime:
+        _related_model = (mtime, related.Model.load(related.MODEL_FILE))
+    return _related_model[1]
+
+def schedule_related(book):
+    """Queue finding a new book's related books; returns immediately."""
+    global _related_pool
+    if not RELATED_ENABLED or not os.path.exists(related.MODEL_FILE):
+        return
+    with _related_pool_lock:
+        if _related_pool is None:
+            _related_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='related')
+    _related_pool.submit(_link_related, book['id'])
+
+def _link_related(book_id):
+    try:
+        book = get_book(book_id)
+        model = _load_related_model()
+        if book is None or model is None:
+            return
+        k = model.k
+        # room for books deleted since the build
+        nearest, closer = model.nearest(book, 2 * k)
+        nearest = [[other_id, similarity] for other_id, similarity in nearest if get_book(other_id)]
+        updates = {book_id: {'related': nearest[:k]}}
+        for other_id, similarity in closer.items():
+            other = get_book(other_id)
+            if other is None:
+                continue
+            current = [pair for pair in other.get('related') or [] if pair[0] != book_id]
+            if len(current) >= k and similarity <= current[k - 1][1]:
+                continue
+            current.append([book_id, similarity])
+            current.sort(key=lambda pair: -pair[1])
+            updates[other_id] = {'related': current[:k]}
+        store.update_books(updates)
+        logger.debug(f"Linked book {book_id} to {len(nearest[:k])} related books, "
+                     f"{len(updates) - 1} lists updated.")
+    except Exception:
+        logger.exception(f"Finding related books for book {book_id} failed")
+
+def related_books(book, limit=None):
+    """The books stored as most like `book`, best first, skipping deleted ones."""
+    found = []
+    for book_id, _ in book.get('related') or []:
+        other = get_book(book_id)
+        if other:
+            found.append(other)
+    return found[:limit]
 
 # -------------------------
 # DECORATORS
@@ -232,11 +1907,82 @@ def require_role(required_role):
 # -------------------------
 # LOAD INITIAL DATA
 # -------------------------
-load_data()
-if not users_db:
-    create_user('admin', 'Suman.m202@gmail.com', 'admin123', 'admin')
-    create_user('author1', 'author@example.com', 'author123', 'author')
-    create_user('reader1', 'reader@example.com', 'reader123', 'reader')
+def seed_default_users():
+    """Create the default accounts in an empty store, once across all workers."""
+    with _store_lock():
+        store.refresh()
+        if count_users():
+            return
+        create_user('admin', 'Suman.m202@gmail.com', 'admin123', 'admin')
+        create_user('author1', 'author@example.com', 'author123', 'author')
+        create_user('reader1', 'reader@example.com', 'reader123', 'reader')
+
+def init_app(serve=True):
+    """Load the store and create the default accounts; returns the Flask app.
+
+    Importing this module starts nothing. A process that serves requests calls
+    init_app() once (main.py does), which also starts indexing the catalog for
+    search, the counter flusher, the profiler and the extraction jobs left
+    unfinished by the last run. Offline
+    tools call init_app(serve=False): they get the catalog, but no background
+    threads or extraction workers of their own.
+    """
+    store.load()
+    seed_default_users()
+    if serve:
+        if HASH_WORKERS + HASH_QUEUE_DEPTH >= SERVER_THREADS:
+            logger.warning(f"HASH_WORKERS + HASH_QUEUE_DEPTH ({HASH_WORKERS + HASH_QUEUE_DEPTH}) is not "
+                           f"below SERVER_THREADS ({SERVER_THREADS}); a login flood can occupy "
+                           f"every request thread.")
+        rebase_trends()
+        start_search_index()
+        start_counter_flusher()
+        start_profiler()
+        resume_extractions()
+    return app
+
+@app.before_request
+def refresh_store():
+    # pick up writes made by other worker processes
+    store.refresh()
+
+# -------------------------
+# INSTRUMENTATION
+# -------------------------
+_profiler = None
+_render_starts = threading.local()
+
+def start_profiler():
+    global _profiler
+    if PROFILE_SAMPLE_INTERVAL > 0 and _profiler is None:
+        _profiler = metrics.StackSampler(PROFILE_SAMPLE_INTERVAL)
+        _profiler.start()
+    return _profiler
+
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+def _observe_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, (endpoint, request.method))
+        REQUESTS.inc((endpoint, str(response.status_code)))
+    return response
+
+def _template_started(sender, template, context, **extra):
+    _render_starts.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+def _template_done(sender, template, context, **extra):
+    stack = getattr(_render_starts, 'stack', None)
+    if stack:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), (template.name,))
+
+if metrics.ENABLED:
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_done, app)
 
 # -------------------------
 # ROUTES
@@ -244,11 +1990,27 @@ if not users_db:
 @app.route('/')
 def index():
     user = get_user_by_id(session['user_id']) if 'user_id' in session else None
-    recent_books = sorted(books_db.values(), key=lambda x: x.get('uploaded_at', datetime.min), reverse=True)[:6]
     return render_template('index.html', user=user,
-                           recent_books=recent_books,
-                           total_books=len(books_db),
-                           total_users=len(users_db))
+                           recent_books=recent_books(limit=6),
+                           most_read=popular_books('views', limit=SHELF_SIZE),
+                           most_downloaded=popular_books('downloads', limit=SHELF_SIZE),
+                           total_books=count_books(),
+                           total_users=count_users())
+
+@app.template_filter('decayed')
+def decayed_filter(score):
+    """A time-decayed score as a whole number of recent events."""
+    return round(popularity.decayed(score or 0, epoch=_trend_epoch))
+
+@app.route('/trending')
+def trending():
+    user = get_user_by_id(session['user_id']) if 'user_id' in session else None
+    category = request.args.get('category', '')
+    return render_template('trending.html', user=user,
+                           most_read=popular_books('views', TRENDING_SIZE, category or None),
+                           most_downloaded=popular_books('downloads', TRENDING_SIZE, category or None),
+                           categories=get_all_categories(),
+                           selected_category=category)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -278,6 +2040,8 @@ def register():
             flash('Passwords do not match.', 'error')
         elif get_user_by_username(username):
             flash('Username already exists.', 'error')
+        elif email and get_user_by_email(email):
+            flash('Email already registered.', 'error')
         else:
             if role not in ROLES:
                 role = 'reader'
@@ -287,6 +2051,15 @@ def register():
             return redirect(url_for('index'))
     return render_template('register.html', roles=ROLES)
 
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(e):
+    # login/register flood: answer at once instead of queueing for the hashing pool
+    flash('Too many sign-ins right now, please try again in a moment.', 'error')
+    template = 'register.html' if request.endpoint == 'register' else 'login.html'
+    response = Response(render_template(template, roles=ROLES), status=503)
+    response.retry_after = HASH_RETRY_AFTER
+    return response
+
 @app.route('/logout')
 def logout():
     session.pop('user_id', None)
@@ -300,16 +2073,35 @@ def browse():
     category = request.args.get('category', '')
     # read view mode from query string, default to 'grid'
     view_mode = request.args.get('view', 'grid')
-    books = search_books(q if q else None, category if category else None)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', BROWSE_PAGE_SIZE, type=int), 1), BROWSE_MAX_PAGE_SIZE)
+    offset = (page - 1) * per_page
 
-    # sort books if you want consistent order (optional)
-    books = sorted(books, key=lambda x: x.get('uploaded_at', datetime.min), reverse=True)
+    if q:
+        # search results are already ranked by relevance
+        matches = search_books(q, category if category else None)
+        total = len(matches)
+        books = matches[offset:offset + per_page]
+    else:
+        total = count_books(category or None)
+        books = recent_books(offset, per_page, category or None)
 
+    pages = max((total + per_page - 1) // per_page, 1)
     return render_template('browse.html', user=user, books=books,
-                           categories=get_all_categories(),
+                           category_counts=category_counts(),
                            query=q, selected_category=category,
-                           view_mode=view_mode)
+                           view_mode=view_mode, total=total,
+                           page=page, pages=pages, per_page=per_page)
+
 
+@app.route('/book/<int:book_id>')
+def book_detail(book_id):
+    user = get_user_by_id(session['user_id']) if 'user_id' in session else None
+    book = get_book(book_id)
+    if not book:
+        abort(404)
+    return render_template('book.html', user=user, book=book,
+                           related_books=related_books(book, RELATED_SIZE))
 
 @app.route('/upload', methods=['GET', 'POST'])
 @require_role('author')
@@ -329,13 +2121,8 @@ def upload():
             flash('Invalid file type. Only PDFs allowed.', 'error')
             return redirect(request.url)
 
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = secure_filename(f"{uuid.uuid4().hex}.{ext}")
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         try:
-            file.save(file_path)
-            logger.info(f"Saved uploaded file: {file_path}")
-            create_book(title, author, category, description, unique_filename, user['id'])
+            store_upload(file, title, author, category, description, user['id'])
             flash(f'Book "{title}" uploaded successfully!', 'success')
             return redirect(url_for('browse'))
         except Exception as e:
@@ -344,46 +2131,243 @@ def upload():
 
     return render_template('upload.html', user=user, categories=get_all_categories())
 
+# -------------------------
+# FILE DELIVERY
+# -------------------------
+# PDFs are served with strong ETags, Last-Modified, 304 handling and byte
+# ranges (single ranges via werkzeug, multiple ranges as multipart/byteranges)
+# so browser PDF viewers can seek without refetching the whole file.
+VIEW_SESSION_TTL = int(os.environ.get('VIEW_SESSION_TTL', 30 * 60))
+
+# 'direct' streams files from Python; 'x-accel' (nginx) and 'x-sendfile'
+# (Apache/lighttpd) only return an internal-redirect header for the proxy.
+FILE_DELIVERY = os.environ.get('FILE_DELIVERY', 'direct')
+X_ACCEL_LOCATION = os.environ.get('X_ACCEL_LOCATION', '/protected-uploads/')
+_MULTIPART_CHUNK = 64 * 1024
+
+_view_sessions = {}   # {(user_id, book_id): time the view was last counted}
+_view_sessions_lock = threading.Lock()
+
+def _file_etag(st):
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+def _starts_reading():
+    """True unless this is a follow-up range request into the middle of a file."""
+    rng = request.range
+    return rng is None or rng.ranges[0][0] == 0
+
+def _count_view(book):
+    """Count a view once per reader per VIEW_SESSION_TTL, not once per range chunk."""
+    now = time.monotonic()
+    key = (session.get('user_id'), book['id'])
+    with _view_sessions_lock:
+        last = _view_sessions.get(key)
+        if last is not None and now - last < VIEW_SESSION_TTL:
+            return
+        _view_sessions[key] = now
+        if len(_view_sessions) > 10000:
+            for k, t in list(_view_sessions.items()):
+                if now - t >= VIEW_SESSION_TTL:
+                    del _view_sessions[k]
+    bump_counter(book, 'views')
+
+def _if_range_matches(etag, mtime):
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(mtime) <= if_range.date.timestamp()
+    return True
+
+def _multirange_response(path, st, etag, ranges):
+    """Build a 206 multipart/byteranges response for several byte ranges."""
+    size = st.st_size
+    spans = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+    if not spans:
+        raise RequestedRangeNotSatisfiable(length=size)
+
+    boundary = uuid.uuid4().hex
+    heads = [(f"\r\n--{boundary}\r\nContent-Type: application/pdf\r\n"
+              f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode()
+             for start, stop in spans]
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(h) for h in heads) + sum(stop - start for start, stop in spans) + len(tail)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for head, (start, stop) in zip(heads, spans):
+                yield head
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = f.read(min(_MULTIPART_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        yield tail
+
+    response = Response(generate(), status=206,
+                        mimetype=f'multipart/byteranges; boundary={boundary}')
+    response.content_length = length
+    response.set_etag(etag)
+    response.last_modified = st.st_mtime
+    response.accept_ranges = 'bytes'
+    return response
+
+def _offload_response(book, filename, path, as_attachment):
+    """Hand the transfer to the front proxy via an internal-redirect header.
+
+    The proxy then deals with Range, conditional requests and slow clients;
+    the worker only returns headers.
+    """
+    response = Response(mimetype='application/pdf')
+    if FILE_DELIVERY == 'x-accel':
+        response.headers['X-Accel-Redirect'] = X_ACCEL_LOCATION.rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = path
+
+    download_name = f"{book.get('title','book')}.pdf"
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='')}"}
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', **names)
+    response.cache_control.private = True
+    return response
+
+class _ReportingFile:
+    """Proxy for a response's open file that runs a callback once the server closes it."""
+
+    def __init__(self, file, on_close):
+        self._file = file
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+def _on_body_closed(response, callback):
+    """Run callback when the server is done with the body.
+
+    send_file responses are passed straight to the server (so it can use
+    sendfile) and skip Response.close(); for those the callback rides on the
+    underlying file instead.
+    """
+    if not response.direct_passthrough:
+        response.call_on_close(callback)
+        return
+    body = getattr(response.response, 'iterable', response.response)  # werkzeug's Range wrapper
+    for attr in ('filelike', 'file'):   # wsgi.file_wrapper implementations
+        file = getattr(body, attr, None)
+        if file is not None:
+            proxy = _ReportingFile(file, callback)
+            setattr(body, attr, proxy)
+            if 'close' in vars(body):   # gunicorn and wsgiref bind file.close up front
+                body.close = proxy.close
+            return
+    response.response = ClosingIterator(response.response, callback)
+
+def _track_transfer(response):
+    """Count a PDF response as active until its body has been sent."""
+    if (not metrics.ENABLED or FILE_DELIVERY != 'direct' or request.method == 'HEAD'
+            or response.status_code not in (200, 206)):
+        return
+    labels = (request.endpoint,)
+    length = response.content_length or 0
+    ACTIVE_TRANSFERS.inc(labels)
+
+    def done():
+        ACTIVE_TRANSFERS.dec(labels)
+        BYTES_SERVED.inc(labels, length)
+    _on_body_closed(response, done)
+
+def send_pdf(book, as_attachment):
+    """Send a book's PDF honouring conditional and Range headers.
+
+    With FILE_DELIVERY set to 'x-accel' or 'x-sendfile' the bytes are sent by
+    the front proxy instead. Returns None when the file is missing so the
+    caller can redirect.
+    """
+    filename = resolve_upload(book.get('filename', ''))
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        logger.warning(f"Missing file for book {book['id']}: {path}")
+        return None
+    if filename != book.get('filename'):
+        # the file was migrated to the sharded layout; catch the record up
+        update_book(book['id'], filename=filename)
+    if FILE_DELIVERY != 'direct':
+        return _offload_response(book, filename, path, as_attachment)
+    etag = book.get('sha256') or _file_etag(st)
+    last_modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+
+    rng = request.range
+    if rng and len(rng.ranges) > 1 and _if_range_matches(etag, st.st_mtime):
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        response = _multirange_response(path, st, etag, rng.ranges)
+    else:
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       as_attachment=as_attachment,
+                                       download_name=f"{book.get('title','book')}.pdf",
+                                       mimetype='application/pdf',
+                                       conditional=True, etag=etag)
+    response.cache_control.private = True
+    return response
+
 # -------------------------
 # READ & DOWNLOAD ROUTES (fixed)
 # -------------------------
 @app.route('/download/<int:book_id>')
 @require_login
 def download(book_id):
-    book = books_db.get(book_id)
+    book = get_book(book_id)
     if not book:
         abort(404)
-    filename = book.get('filename', '')
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    logger.debug(f"Download path={file_path} exists={os.path.exists(file_path)}")
-    if not os.path.exists(file_path):
+    response = send_pdf(book, as_attachment=True)
+    if response is None:
         flash('File not found on server.', 'error')
         return redirect(url_for('browse'))
-    book['downloads'] = book.get('downloads', 0) + 1
-    save_data()
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename,
-                               as_attachment=True,
-                               download_name=f"{book.get('title','book')}.pdf",
-                               mimetype='application/pdf')
+    if response.status_code in (200, 206) and _starts_reading():
+        bump_counter(book, 'downloads')
+    _track_transfer(response)
+    return response
 
 @app.route('/read/<int:book_id>')
 @require_login
 def read(book_id):
-    book = books_db.get(book_id)
+    book = get_book(book_id)
     if not book:
         abort(404)
-    filename = book.get('filename', '')
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    logger.debug(f"Read path={file_path} exists={os.path.exists(file_path)}")
-    if not os.path.exists(file_path):
+    response = send_pdf(book, as_attachment=False)
+    if response is None:
         flash('File not found on server.', 'error')
         return redirect(url_for('browse'))
-    book['views'] = book.get('views', 0) + 1
-    save_data()
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename,
-                               as_attachment=False,
-                               download_name=f"{book.get('title','book')}.pdf",
-                               mimetype='application/pdf')
+    if response.status_code in (200, 206) and _starts_reading():
+        _count_view(book)
+    _track_transfer(response)
+    return response
 
 # -------------------------
 # ADMIN & PROFILE
@@ -392,8 +2376,8 @@ def read(book_id):
 @require_role('admin')
 def admin():
     user = get_user_by_id(session['user_id'])
-    all_users = sorted(users_db.values(), key=lambda x: x.get('created_at', datetime.min), reverse=True)
-    all_books = sorted(books_db.values(), key=lambda x: x.get('uploaded_at', datetime.min), reverse=True)
+    all_users = list_users()
+    all_books = recent_books()
     return render_template('admin.html', user=user, all_users=all_users, all_books=all_books)
 
 @app.route('/admin/delete_user/<int:user_id>')
@@ -401,10 +2385,8 @@ def admin():
 def delete_user(user_id):
     if user_id == session['user_id']:
         flash("You can't delete your own account.", 'error')
-    elif user_id in users_db:
-        username = users_db[user_id]['username']
-        del users_db[user_id]
-        save_data()
+    elif get_user_by_id(user_id):
+        username = remove_user(user_id)['username']
         flash(f'User "{username}" deleted.', 'success')
     else:
         flash('User not found.', 'error')
@@ -413,16 +2395,8 @@ def delete_user(user_id):
 @app.route('/admin/delete_book/<int:book_id>')
 @require_role('admin')
 def delete_book(book_id):
-    if book_id in books_db:
-        book = books_db[book_id]
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], book.get('filename', ''))
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                logger.error(f"Error deleting {file_path}: {e}")
-        del books_db[book_id]
-        save_data()
+    book = delete_book_and_file(book_id)
+    if book:
         flash(f'Book "{book.get("title")}" deleted.', 'success')
     else:
         flash('Book not found.', 'error')
@@ -434,12 +2408,206 @@ def profile():
     user = get_user_by_id(session['user_id'])
     user_books = []
     if user and user.get('role') in ['author', 'admin']:
-        user_books = [b for b in books_db.values() if b.get('uploaded_by') == user['id']]
-        user_books.sort(key=lambda x: x.get('uploaded_at', datetime.min), reverse=True)
+        user_books = books_by_uploader(user['id'])
     return render_template('profile.html', user=user, user_books=user_books)
 
+# -------------------------
+# JSON API
+# -------------------------
+# Read-only catalog for mobile and kiosk clients. Every response is tied to
+# catalog_version(): its ETag is the version plus a digest of the request,
+# so a revalidation that finds the catalog unchanged is answered 304 without
+# touching the store, and bodies are kept in a small in-process LRU until the
+# version moves. View/download counts change on every read and are left out,
+# so they do not invalidate everything. Until the search index is ready,
+# search answers are partial and the index landing does not move the
+# version, so nothing is cached or ETagged then.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+API_CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', 512))
+API_FIELDS = ('id', 'title', 'author', 'category', 'description', 'pages',
+              'uploaded_at', 'uploaded_by', 'sha256')
+API_LIST_FIELDS = ('id', 'title', 'author', 'category', 'pages', 'uploaded_at')
+
+API_CACHE_HITS = metrics.Counter('kitabghar_api_cache_total', 'Catalog API responses by outcome.',
+                                 ('outcome',))
+
+_api_cache = OrderedDict()   # {(version, path, args): body}
+_api_cache_lock = threading.Lock()
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+@app.errorhandler(ApiError)
+def api_error(e):
+    return Response(json.dumps({'error': str(e)}), status=e.status, mimetype='application/json')
+
+def _api_fields(default):
+    names = request.args.get('fields')
+    if not names:
+        return default
+    fields = ['id'] + [f for f in dict.fromkeys(n.strip() for n in names.split(',')) if f and f != 'id']
+    unknown = [f for f in fields if f not in API_FIELDS]
+    if unknown:
+        raise ApiError(400, f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+def _api_book(book, fields):
+    out = {}
+    for name in fields:
+        value = book.get(name)
+        out[name] = value.isoformat() if isinstance(value, datetime) else value
+    return out
+
+# Listings page by keyset: the cursor holds the last book's recency key, so
+# books added or deleted between fetches never make a page skip or repeat
+# one. Ranked search results have no such key; their cursor holds an offset
+# and the catalog version, and is refused once the catalog has changed.
+def _encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ApiError(400, 'invalid cursor') from None
+    if not isinstance(state, dict) or not (isinstance(state.get('k'), list) or
+                                           isinstance(state.get('o'), int) and state['o'] >= 0):
+        raise ApiError(400, 'invalid cursor')
+    return state
+
+def _cached_json(build):
+    """JSON response for this request, answered from the ETag or the cache when possible."""
+    version = catalog_version()
+    if not search_ready():
+        payload = build()
+        payload['catalog_version'] = version
+        response = Response(json.dumps(payload, separators=(',', ':')), mimetype='application/json')
+        response.cache_control.no_store = True
+        return response
+    args = tuple(sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(repr((request.path, args)).encode()).hexdigest()[:16]
+    etag = f"{version:x}-{digest}"
+    if etag in request.if_none_match:
+        if metrics.ENABLED:
+            API_CACHE_HITS.inc(('not_modified',))
+        response = Response(status=304)
+    else:
+        key = (version, request.path, args)
+        with _api_cache_lock:
+            body = _api_cache.get(key)
+            if body is not None:
+                _api_cache.move_to_end(key)
+        if metrics.ENABLED:
+            API_CACHE_HITS.inc(('hit' if body is not None else 'miss',))
+        if body is None:
+            payload = build()
+            payload['catalog_version'] = version
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            with _api_cache_lock:
+                _api_cache[key] = body
+                while len(_api_cache) > API_CACHE_SIZE:
+                    _api_cache.popitem(last=False)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # clients may keep responses but must revalidate; that costs a 304 at most
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/v1/books')
+def api_books():
+    """Newest first, or ranked matches with ?q=; ?category=, ?limit=, ?cursor=, ?fields=a,b."""
+    q = request.args.get('q', '').strip()
+    category = request.args.get('category', '').strip() or None
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    state = _decode_cursor(cursor) if cursor else {}
+    if state and ('k' in state) == bool(q):
+        raise ApiError(400, 'cursor is from another query')
+    fields = _api_fields(API_LIST_FIELDS)
+
+    def build():
+        next_state = None
+        if q:
+            version = catalog_version()
+            if state.get('v', version) != version:
+                raise ApiError(410, 'the catalog changed since this cursor; start again without it')
+            offset = state.get('o', 0)
+            matches = search_books(q, category)
+            total, books = len(matches), matches[offset:offset + limit]
+            if offset + len(books) < total:
+                next_state = {'o': offset + len(books), 'v': version}
+        else:
+            try:
+                books = recent_books(limit=limit + 1, category=category, before=state.get('k'))
+            except ValueError:
+                raise ApiError(400, 'invalid cursor') from None
+            total = count_books(category)
+            if len(books) > limit:
+                books = books[:limit]
+                next_state = {'k': store.recency_key(books[-1])}
+        return {'total': total,
+                'books': [_api_book(b, fields) for b in books],
+                'next_cursor': _encode_cursor(next_state) if next_state else None}
+    return _cached_json(build)
+
+@app.route('/api/v1/books/<int:book_id>')
+def api_book(book_id):
+    fields = _api_fields(API_FIELDS)
+
+    def build():
+        book = get_book(book_id)
+        if book is None:
+            raise ApiError(404, 'no such book')
+        return {'book': _api_book(book, fields)}
+    return _cached_json(build)
+
+@app.route('/api/v1/categories')
+def api_categories():
+    def build():
+        return {'categories': [{'name': name, 'count': count}
+                               for name, count in category_counts()]}
+    return _cached_json(build)
+
+SUGGEST_MAX = 20
+
+@app.route('/suggest')
+def suggestions():
+    """Completions for the browse search box, as the reader types."""
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', suggest.DEFAULT_LIMIT, type=int), 1), SUGGEST_MAX)
+
+    def build():
+        return {'q': q, 'suggestions': [{'text': text, 'kind': kind, 'books': books}
+                                        for text, kind, books in suggest_completions(q, limit)]}
+    return _cached_json(build)
+
+# -------------------------
+# METRICS ENDPOINTS
+# -------------------------
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.ENABLED:
+        abort(404)
+    PROCESS_INFO.set(1, (str(os.getpid()),))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/profile')
+@require_role('admin')
+def metrics_profile():
+    """Folded stacks from the sampler (flamegraph.pl input); ?reset=1 starts over."""
+    if _profiler is None:
+        abort(404)
+    body = f"# {_profiler.samples} samples every {_profiler.interval}s\n" + _profiler.folded()
+    if request.args.get('reset'):
+        _profiler.reset()
+    return Response(body, mimetype='text/plain')
+
 # -------------------------
 # MAIN
 # -------------------------
 if __name__ == '__main__':
+    init_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
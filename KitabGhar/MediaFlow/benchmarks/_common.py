@@ -0,0 +1,41 @@
+"""Setup shared by the benchmark and stress scripts.
+
+Importing this module puts the app directory on sys.path, so a script can
+import the app's modules (fuzzy, suggest, pdfinfo, ...) right after it.
+start_app() imports and starts the app itself inside a data directory.
+"""
+import os
+import sys
+import logging
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+def start_app(workdir=None, env=None, defaults=None, prefix='kitabghar-bench-',
+              log_level=logging.WARNING):
+    """Start the app in `workdir` (a new temp dir by default); returns the app module.
+
+    The app reads its settings from the environment when it is imported, so
+    `env` is set and `defaults` filled in where unset before that. PDF
+    extraction is off unless asked for, since the scripts time the store and
+    the routes, not the worker pool.
+    """
+    os.chdir(workdir or tempfile.mkdtemp(prefix=prefix))
+    os.environ.update(env or {})
+    for name, value in {'EXTRACT_ENABLED': '0', **(defaults or {})}.items():
+        os.environ.setdefault(name, value)
+    import app
+    app.init_app()
+    logging.getLogger().setLevel(log_level)
+    return app
+
+
+def percentile(sorted_values, p):
+    """The nearest-rank p-th percentile of an ascending list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
@@ -0,0 +1,101 @@
+"""Throughput of PDF extraction across worker processes.
+
+Runs pdfinfo.extract() over the PDFs in a directory (the app's uploads/ by
+default) with 1, 2, 4, ... worker processes up to the CPU count and
+reports files/s and MB/s for each.
+
+Then extracts a crafted "decompression bomb" of about a megabyte, whose page
+content and image streams inflate to over a gigabyte, in a fresh process,
+and reports that process's peak RSS. The caps in pdfinfo.py keep it small.
+
+    python benchmarks/bench_extract.py [pdf_dir] [rounds]
+"""
+import os
+import sys
+import glob
+import time
+import zlib
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from _common import APP_DIR
+import pdfinfo
+
+
+def deflate_zeros(size, prefix=b''):
+    packer = zlib.compressobj(9)
+    out = [packer.compress(prefix)]
+    block = bytes(2**20)
+    for _ in range(size // len(block)):
+        out.append(packer.compress(block))
+    out.append(packer.flush())
+    return b''.join(out)
+
+
+def write_bomb(path, content_mb=512, images=3, image_mb=256):
+    """A one-page PDF whose content stream and images are mostly zeros."""
+    content = deflate_zeros(content_mb * 2**20, b'BT /F1 12 Tf (bomb) Tj ET\n')
+    image = deflate_zeros(image_mb * 2**20)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R /Resources << /XObject << '
+        + b' '.join(b'/Im%d %d 0 R' % (i, 5 + i) for i in range(images)) + b' >> >> >>',
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream',
+    ]
+    for _ in range(images):
+        objects.append(b'<< /Type /XObject /Subtype /Image /Width 8192 /Height 8192 '
+                       b'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Length %d /Filter /FlateDecode >>'
+                       b'\nstream\n' % len(image) + image + b'\nendstream')
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.7\n')
+        for num, body in enumerate(objects, 1):
+            f.write(b'%d 0 obj\n' % num + body + b'\nendobj\n')
+        f.write(b'trailer\n<< /Root 1 0 R >>\n%%EOF\n')
+
+
+def peak_rss_mb(path):
+    """Peak RSS of a fresh process that extracts `path`."""
+    code = ('import resource, sys, pdfinfo; pdfinfo.extract(sys.argv[1]); '
+            'print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)')
+    out = subprocess.run([sys.executable, '-c', code, path], cwd=APP_DIR,
+                         capture_output=True, text=True, check=True).stdout
+    return int(out) / 1024   # ru_maxrss is in KB on Linux
+
+
+def check_bomb():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bomb.pdf')
+        write_bomb(path)
+        size_kb = os.path.getsize(path) / 1024
+        print(f"{size_kb:.0f} KB crafted PDF inflating to 1280 MB: "
+              f"peak RSS {peak_rss_mb(path):.0f} MB while extracting")
+
+
+def main():
+    pdf_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(APP_DIR, 'uploads')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    files = sorted(glob.glob(os.path.join(pdf_dir, '*.pdf'))) * rounds
+    if not files:
+        sys.exit(f"No PDFs found in {pdf_dir}")
+    total_mb = sum(os.path.getsize(f) for f in files) / (1024 * 1024)
+
+    print(f"{len(files)} files, {total_mb:.1f} MB")
+    print(f"{'workers':>8} {'seconds':>8} {'files/s':>8} {'MB/s':>8}")
+    workers = 1
+    while True:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            for _ in pool.map(pdfinfo.extract, files):
+                pass
+            elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:>8.2f} {len(files) / elapsed:>8.1f} {total_mb / elapsed:>8.1f}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
+    check_bomb()
+
+
+if __name__ == '__main__':
+    main()
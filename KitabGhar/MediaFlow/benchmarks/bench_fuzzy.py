@@ -0,0 +1,120 @@
+"""Latency of typo-tolerant title/author search at catalog scale.
+
+Builds a fuzzy.TrigramIndex over a synthetic catalog of transliterated
+Hindi/Urdu-style titles and author names. Then it times queries in which one
+letter of a real title or author word is dropped, doubled or swapped, and
+reports p50/p95/p99. For a sample of queries the top-k is checked against a
+brute-force scan that scores every book and sorts the lot.
+
+    python benchmarks/bench_fuzzy.py [books] [queries]
+"""
+import sys
+import time
+import random
+import tracemalloc
+
+from _common import percentile
+import fuzzy
+
+ONSETS = ['', 'b', 'bh', 'ch', 'd', 'dh', 'g', 'gh', 'h', 'j', 'k', 'kh', 'l', 'm', 'n',
+          'p', 'pr', 'r', 's', 'sh', 't', 'v', 'z']
+VOWELS = ['a', 'aa', 'e', 'i', 'ee', 'o', 'u', 'oo', 'ai']
+CODAS = ['', 'n', 'm', 'r', 'l', 'd', 'b', 'nd', 'sh', 'k']
+
+
+def words(rng, n):
+    vocab = set()
+    while len(vocab) < n:
+        vocab.add(''.join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+                          for _ in range(rng.randint(2, 3))))
+    return sorted(vocab)
+
+
+def catalog(n, rng):
+    title_words = words(rng, max(n // 4, 1000))
+    names = words(rng, max(n // 20, 500))
+    return [{'id': i,
+             'title': ' '.join(rng.sample(title_words, rng.randint(1, 4))).title(),
+             'author': f'{rng.choice(names)} {rng.choice(names)}'.title()}
+            for i in range(1, n + 1)]
+
+
+def misspell(word, rng):
+    i = rng.randrange(len(word))
+    op = rng.choice(('drop', 'double', 'swap'))
+    if op == 'drop' and len(word) > 3:
+        return word[:i] + word[i + 1:]
+    if op == 'swap' and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + word[i] + word[i:]
+
+
+def brute_force(index, books, query, k):
+    """Score every book and sort them all; what the heap is there to avoid."""
+    terms = fuzzy.tokenize(query)
+    scored = []
+    for book in books:
+        book_words = index._book_words(book)
+        total = 0
+        for term in terms:
+            grams = fuzzy.trigrams(term)
+            best = 0
+            for word, weight in book_words.items():
+                other = fuzzy.trigrams(word)
+                similarity = 2 * len(grams & other) / (len(grams) + len(other))
+                if similarity >= fuzzy.DEFAULT_THRESHOLD:
+                    best = max(best, similarity * weight)
+            if not best:
+                break
+            total += best
+        else:
+            scored.append((total, book['id']))
+    scored.sort(reverse=True)
+    return scored[:k]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = random.Random(7)
+    books = catalog(n, rng)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = fuzzy.TrigramIndex()
+    for book in books:
+        index.add(book)
+    build = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{n} books, {len(index)} distinct words: built in {build:.2f}s, "
+          f"{memory / 2**20:.1f} MB")
+
+    queries = []
+    for _ in range(n_queries):
+        book = rng.choice(books)
+        field = rng.choice(('title', 'author'))
+        queries.append(misspell(rng.choice(fuzzy.tokenize(book[field])), rng))
+
+    times, found = [], 0
+    for query in queries:
+        t = time.perf_counter()
+        hits = index.search(query)
+        times.append(time.perf_counter() - t)
+        found += bool(hits)
+    times.sort()
+    print(f"{n_queries} one-typo queries: p50 {percentile(times, 50) * 1000:.2f} ms, "
+          f"p95 {percentile(times, 95) * 1000:.2f} ms, p99 {percentile(times, 99) * 1000:.2f} ms; "
+          f"{found / n_queries:.0%} found something")
+
+    sample = queries[:5]
+    start = time.perf_counter()
+    for query in sample:
+        assert index.search(query) == brute_force(index, books, query, fuzzy.DEFAULT_LIMIT), query
+    per_query = (time.perf_counter() - start) / len(sample)
+    print(f"top-{fuzzy.DEFAULT_LIMIT} matches a full scan-and-sort on {len(sample)} queries "
+          f"(which takes {per_query * 1000:.0f} ms each)")
+
+
+if __name__ == '__main__':
+    main()
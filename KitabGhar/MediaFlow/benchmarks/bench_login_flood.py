@@ -0,0 +1,152 @@
+"""Throughput of /browse and /read while /login is being flooded.
+
+Starts gunicorn with threaded workers on a synthetic catalog (see corpus.py)
+and measures readers fetching /browse and /read pages for --seconds: first
+alone, then while --flooders threads post logins as fast as they can. For
+each phase it prints reader throughput and p95. For the flood it also prints
+logins that succeeded and logins refused with 503 by the hashing pool's
+overload check. With the pool bounded, reader throughput should hardly move.
+
+    python benchmarks/bench_login_flood.py [--books N] [--workers N] [--threads N]
+        [--readers N] [--flooders N] [--seconds S] [--data-dir DIR]
+
+The server runs with SERVER_THREADS set to --threads, so the pool gets its
+default size for that thread count. Pass HASH_WORKERS / HASH_QUEUE_DEPTH
+through the environment to try other pool sizes.
+"""
+import os
+import sys
+import time
+import random
+import signal
+import argparse
+import subprocess
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import corpus
+from _common import APP_DIR, percentile
+from bench_routes import _NoRedirect, _fetch, _free_port, _manifest, _opener
+
+
+def _reader(base, opener, manifest, stop, seed, latencies, lock):
+    rng = random.Random(seed)
+    categories = manifest['categories']
+    mine = []
+    while not stop.is_set():
+        if rng.random() < 0.5:
+            url = f"{base}/browse?category={urllib.parse.quote(rng.choice(categories))}"
+        else:
+            url = f"{base}/read/{rng.randrange(1, manifest['books'] + 1)}"
+        t = time.perf_counter()
+        try:
+            _fetch(opener, urllib.request.Request(url, headers={'Range': 'bytes=0-4095'}))
+            mine.append(time.perf_counter() - t)
+        except OSError:
+            pass
+    with lock:
+        latencies.extend(mine)
+
+
+def _flooder(base, manifest, stop, seed, outcomes, lock):
+    opener = urllib.request.build_opener(_NoRedirect())
+    rng = random.Random(seed)
+    counts = {}
+    while not stop.is_set():
+        form = urllib.parse.urlencode({'username': f"bench{rng.randrange(manifest['users'])}",
+                                       'password': manifest['password']}).encode()
+        try:
+            opener.open(urllib.request.Request(base + '/login', data=form)).read()
+            status = 200   # form shown again: wrong password
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 'error'
+        counts[status] = counts.get(status, 0) + 1
+    with lock:
+        for status, n in counts.items():
+            outcomes[status] = outcomes.get(status, 0) + n
+
+
+def phase(base, manifest, readers, flooders, seconds):
+    stop, lock = threading.Event(), threading.Lock()
+    latencies, outcomes = [], {}
+    # readers log in before the flood starts, so their own logins are not refused
+    openers = [_opener(base, login=True) for _ in range(readers)]
+    threads = [threading.Thread(target=_reader, args=(base, opener, manifest, stop, i, latencies, lock))
+               for i, opener in enumerate(openers)]
+    threads += [threading.Thread(target=_flooder, args=(base, manifest, stop, 1000 + i, outcomes, lock))
+                for i in range(flooders)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return len(latencies) / seconds, percentile(latencies, 95) * 1000, outcomes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    corpus.add_arguments(parser)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--flooders', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--data-dir', help='reuse a catalog made by corpus.py')
+    args = parser.parse_args(argv)
+
+    tmp = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        tmp = tempfile.TemporaryDirectory(prefix='kitabghar-flood-')
+        data_dir = tmp.name
+        subprocess.run([sys.executable, os.path.join(APP_DIR, 'benchmarks', 'corpus.py'), data_dir]
+                       + [f'--{k.replace("_", "-")}={v}' for k, v in corpus.options(args).items()],
+                       check=True)
+    manifest = _manifest(data_dir)
+
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, EXTRACT_ENABLED=os.environ.get('EXTRACT_ENABLED', '0'),
+               SERVER_THREADS=str(args.threads))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', str(args.workers),
+         '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', '--pythonpath', APP_DIR,
+         '--log-level', 'warning', 'main:app'],
+        cwd=data_dir, env=env, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(base + '/login', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('gunicorn did not come up')
+
+        quiet_rps, quiet_p95, _ = phase(base, manifest, args.readers, 0, args.seconds)
+        flood_rps, flood_p95, outcomes = phase(base, manifest, args.readers, args.flooders, args.seconds)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+        if tmp:
+            tmp.cleanup()
+
+    print(f"{'':>10} {'reads/s':>9} {'p95 ms':>8}")
+    print(f"{'quiet':>10} {quiet_rps:9.1f} {quiet_p95:8.1f}")
+    print(f"{'flooded':>10} {flood_rps:9.1f} {flood_p95:8.1f}")
+    print(f"logins during flood: {outcomes.get(302, 0) / args.seconds:.1f}/s ok, "
+          f"{outcomes.get(503, 0) / args.seconds:.1f}/s refused (503), "
+          f"other {sum(n for s, n in outcomes.items() if s not in (302, 503))}")
+    print(f"reader throughput under flood: {flood_rps / quiet_rps:.0%} of quiet")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
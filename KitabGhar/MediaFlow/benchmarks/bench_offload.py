@@ -0,0 +1,194 @@
+"""Worker time per PDF request, direct streaming vs proxy offload.
+
+First checks that the offload path reaches the files. With
+FILE_DELIVERY=x-accel, the X-Accel-Redirect header of each /download must
+name a file under the internal location of deploy/nginx.conf, whose alias
+(taken relative to the app directory, as `nginx -p "$PWD"` does) must map it
+to the book's file. When nginx is on PATH, the config is also run for real
+in front of the app. The file must come back whole, a Range request must
+get its bytes, and the internal location must not be reachable directly.
+
+Then times a full /download through the Flask test client for growing file
+sizes. In 'direct' mode the worker is busy for the whole transfer, so the
+time grows with the file; with 'x-accel' or 'x-sendfile' the worker only
+emits headers and the time stays flat.
+
+    python benchmarks/bench_offload.py [max_mb]
+"""
+import os
+import re
+import sys
+import shutil
+import socket
+import threading
+import subprocess
+import time
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from _common import APP_DIR, start_app
+
+NGINX_CONF = os.path.join(APP_DIR, 'deploy', 'nginx.conf')
+
+app = start_app()
+
+MODES = ('direct', 'x-accel', 'x-sendfile')
+REPEAT = 5
+
+
+def make_book(size_mb, sharded=False):
+    filename = f'bench-{size_mb}mb.pdf'
+    if sharded:
+        filename = app.shard_name(filename)
+    path = os.path.join(app.app.config['UPLOAD_FOLDER'], filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        f.write(os.urandom(1024))   # something for a Range request to compare
+        f.truncate(size_mb * 1024 * 1024)
+    return app.create_book(f'{size_mb} MB', 'Bench', 'Bench', '', filename, 1)
+
+
+def internal_alias(conf_text, location):
+    """The alias of the `location` block in an nginx config, which must be internal."""
+    block = re.search(r'location\s+' + re.escape(location) + r'\s*\{(.*?)\}', conf_text, re.S)
+    assert block, f"{NGINX_CONF} has no 'location {location}' block"
+    assert re.search(r'^\s*internal\s*;', block.group(1), re.M), f"{location} is not internal"
+    alias = re.search(r'^\s*alias\s+(\S+?)\s*;', block.group(1), re.M)
+    assert alias, f"{location} has no alias"
+    return alias.group(1)
+
+
+def check_alias(client, books):
+    """Every X-Accel-Redirect resolves through the nginx alias to the book's file."""
+    location = app.X_ACCEL_LOCATION
+    alias = internal_alias(open(NGINX_CONF).read(), location)
+    app.FILE_DELIVERY = 'x-accel'
+    try:
+        for book in books:
+            response = client.get(f'/download/{book["id"]}')
+            assert response.status_code == 200, response.status_code
+            target = response.headers.get('X-Accel-Redirect', '')
+            assert target.startswith(location), target
+            assert not response.get_data(), 'offloaded responses have no body'
+            relative = urllib.parse.unquote(target[len(location):])
+            path = os.path.join(os.getcwd(), alias, relative)
+            assert os.path.isfile(path), f"{target} maps to {path}, which does not exist"
+            assert os.path.samefile(path, app.upload_path(book['filename'])), target
+    finally:
+        app.FILE_DELIVERY = 'direct'
+    return len(books)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing is listening on port {port}")
+
+
+def check_nginx(nginx, books):
+    """Serve the app behind deploy/nginx.conf and download through it."""
+    app_port, nginx_port = free_port(), free_port()
+    conf = open(NGINX_CONF).read()
+    conf = conf.replace('server 127.0.0.1:5000;', f'server 127.0.0.1:{app_port};')
+    conf = conf.replace('listen 8080;', f'listen 127.0.0.1:{nginx_port};')
+    conf = re.sub(r'/tmp/kitabghar-nginx', os.path.join(os.getcwd(), 'nginx'), conf)
+    if not os.path.exists('/etc/nginx/mime.types'):
+        conf = conf.replace('include /etc/nginx/mime.types;', '')
+    with open('nginx.conf', 'w') as f:
+        f.write(conf)
+
+    app.FILE_DELIVERY = 'x-accel'
+    server = make_server('127.0.0.1', app_port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    proc = subprocess.Popen([nginx, '-p', os.getcwd(), '-c', os.path.abspath('nginx.conf'),
+                             '-g', 'daemon off;'])
+    try:
+        wait_for_port(nginx_port)
+        base = f'http://127.0.0.1:{nginx_port}'
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        form = urllib.parse.urlencode({'username': 'admin', 'password': 'admin123'}).encode()
+        opener.open(f'{base}/login', form).read()
+        for book in books:
+            with open(app.upload_path(book['filename']), 'rb') as f:
+                expected = f.read()
+            with opener.open(f'{base}/download/{book["id"]}') as response:
+                body = response.read()
+                assert 'X-Accel-Redirect' not in response.headers
+            assert body == expected, f"book {book['id']}: {len(body)} of {len(expected)} bytes"
+            ranged = urllib.request.Request(f'{base}/download/{book["id"]}',
+                                            headers={'Range': 'bytes=100-199'})
+            with opener.open(ranged) as response:
+                assert response.status == 206, response.status
+                assert response.read() == expected[100:200]
+            internal = f"{base}{app.X_ACCEL_LOCATION}{book['filename']}"
+            try:
+                opener.open(internal).read()
+                raise AssertionError(f"{internal} is reachable from outside")
+            except urllib.error.HTTPError as e:
+                assert e.code == 404, e.code
+    finally:
+        proc.terminate()
+        proc.wait()
+        server.shutdown()
+        app.FILE_DELIVERY = 'direct'
+    return len(books)
+
+
+def time_download(client, book_id):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        response = client.get(f'/download/{book_id}')
+        response.get_data()   # drain the body like a WSGI server would
+        response.close()
+    return (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    max_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+
+    books = [make_book(1), make_book(2, sharded=True)]
+    checked = check_alias(client, books)
+    print(f"X-Accel-Redirect maps to the book's file through the nginx alias for {checked} books")
+    nginx = shutil.which('nginx')
+    if nginx:
+        checked = check_nginx(nginx, books)
+        print(f"nginx with deploy/nginx.conf served {checked} books whole and by range, "
+              f"and kept {app.X_ACCEL_LOCATION} internal")
+    else:
+        print("nginx not found on PATH; the offload path was not run end to end")
+
+    print(f"{'size':>8} " + ' '.join(f'{m + " ms":>14}' for m in MODES))
+    size_mb = 1
+    while size_mb <= max_mb:
+        book = make_book(size_mb)
+        timings = []
+        for mode in MODES:
+            app.FILE_DELIVERY = mode
+            timings.append(time_download(client, book['id']) * 1000)
+        print(f"{size_mb:>5} MB " + ' '.join(f'{t:>14.2f}' for t in timings))
+        size_mb *= 4
+    app.FILE_DELIVERY = 'direct'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Per-record memory of plain-dict books vs records.Book, measured with tracemalloc.
+
+A synthetic catalog (see bench_storage.py) is serialized to JSON once, then
+loaded both ways: as the plain dicts with datetime values the memory store
+used to hold, and as Book records with interned strings and epoch
+timestamps. Only what each representation keeps alive is counted; the parsed
+JSON it was built from is freed first.
+
+    python benchmarks/bench_records.py [books]
+"""
+import sys
+import gc
+import json
+import tracemalloc
+from datetime import datetime
+
+import _common  # noqa: F401 (puts the app directory on sys.path)
+from bench_storage import synthetic_books
+from records import Book
+
+
+def as_dicts(raw_books):
+    books = []
+    for raw in raw_books:
+        book = raw.copy()
+        book['uploaded_at'] = datetime.fromisoformat(book['uploaded_at'])
+        books.append(book)
+    return books
+
+
+def as_records(raw_books):
+    return [Book(raw) for raw in raw_books]
+
+
+def measure(build, text):
+    gc.collect()
+    tracemalloc.start()
+    books = build(json.loads(text))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sample = books[len(books) // 2]
+    del books
+    return current, sample
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    text = json.dumps([{**b, 'uploaded_at': b['uploaded_at'].isoformat()}
+                       for b in synthetic_books(n)])
+
+    results = {}
+    for name, build in (('dict', as_dicts), ('record', as_records)):
+        total, sample = measure(build, text)
+        results[name] = total
+        print(f"{name:>7}: {total / 2**20:8.1f} MB total, {total / n:7.1f} B/book "
+              f"(e.g. {sample['title']!r}, {sample['uploaded_at']:%Y-%m-%d})")
+    saved = results['dict'] - results['record']
+    print(f"{n} books: records save {saved / 2**20:.1f} MB, "
+          f"{saved / n:.1f} B/book ({saved / results['dict']:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Cost and correctness of precomputed related books.
+
+Fits a related.Model over the synthetic catalog from bench_fuzzy.py, with
+categories and short descriptions added, and times Model.neighbours() for
+every book's top k. Peak memory is measured at two block sizes to show that
+the block size, not the catalog size, bounds it, also for a catalog whose
+descriptions share a small vocabulary, where the postings of a block's
+terms hold many times more entries than the block has cells. Then it checks:
+
+  * the blocked top k of a sample of books against a dense brute force (the
+    full TF-IDF matrix times its transpose, at a smaller catalog size);
+  * Model.nearest() for held-out "uploads" against the dense matrix times
+    their vector: their top k, and the books whose lists they now belong in.
+
+    python benchmarks/bench_related.py [books] [k]
+"""
+import sys
+import time
+import random
+import tracemalloc
+
+import _common  # noqa: F401 (puts the app directory on sys.path)
+from bench_fuzzy import catalog, words
+import related
+
+if not related.available():
+    raise SystemExit("bench_related.py needs NumPy")
+np = related.np
+
+CATEGORIES = ['Fiction', 'History', 'Science', 'Poetry', 'Travel', 'Children',
+              'Religion', 'Cooking', 'Art', 'Biography', 'Urdu Ghazal', 'Hindi Kahani']
+
+
+def books_for(n, rng, vocabulary=3000):
+    books = catalog(n, rng)
+    vocab = words(rng, vocabulary)
+    for book in books:
+        book['category'] = rng.choice(CATEGORIES)
+        book['description'] = ' '.join(rng.choices(vocab, k=rng.randint(5, 25)))
+    return books
+
+
+def dense(model):
+    matrix = np.zeros((len(model), len(model.terms)))
+    rows = np.repeat(np.arange(len(model)), np.diff(model.indptr))
+    matrix[rows, model.indices] = model.data
+    return matrix
+
+
+def check_blocked(n, k, rng):
+    model = related.Model.fit(books_for(n, rng))
+    scores = dense(model) @ dense(model).T
+    np.fill_diagonal(scores, 0)
+    got = dict(model.neighbours(k, block_cells=n * 7))   # several uneven blocks
+    for row in rng.sample(range(n), 200):
+        want = np.sort(scores[row])[::-1][:k]
+        have = [similarity for _, similarity in got[int(model.ids[row])]]
+        assert np.allclose(want[want > 0], have, atol=1e-5), row
+        for book_id, similarity in got[int(model.ids[row])]:
+            assert abs(scores[row, model.row_of[book_id]] - similarity) < 1e-5
+    return 200
+
+
+def check_nearest(n, k, rng):
+    books = books_for(n, rng)
+    held_out = books[-20:]
+    model = related.Model.fit(books[:-20])
+    for _ in model.neighbours(k):   # sets each book's k-th similarity
+        pass
+    matrix = dense(model)
+    for book in held_out:
+        vector = np.zeros(len(model.terms))
+        for term, count in related.term_counts(book).items():
+            if term in model.vocab:
+                vector[model.vocab[term]] = count * model.idf[model.vocab[term]]
+        scores = matrix @ (vector / np.linalg.norm(vector))
+        nearest, closer = model.nearest(book)
+        want = np.sort(scores)[::-1][:k]
+        assert np.allclose(want[want > 0], [s for _, s in nearest], atol=1e-5)
+        want = {int(model.ids[j]) for j in np.flatnonzero((scores > 0) & (scores > model.kth + 1e-6))}
+        assert want <= set(closer), book['id']
+    return len(held_out)
+
+
+def time_neighbours(model, k):
+    for cells in (related.BLOCK_CELLS // 4, related.BLOCK_CELLS):
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = sum(1 for _ in model.neighbours(k, cells))
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"top {k} for {count} books with {cells} cells per block: {seconds:.1f}s "
+              f"({count / seconds:.0f} books/s), peak {peak / 2**20:.0f} MB")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else related.DEFAULT_K
+    rng = random.Random(3)
+    books = books_for(n, rng)
+
+    start = time.perf_counter()
+    model = related.Model.fit(books)
+    fit = time.perf_counter() - start
+    print(f"{n} books: TF-IDF fit in {fit:.1f}s, {len(model.terms)} terms, {len(model.data)} entries")
+
+    time_neighbours(model, k)
+    common = related.Model.fit(books_for(n // 10, rng, vocabulary=40))
+    print(f"{len(common)} books drawing descriptions from 40 words:")
+    time_neighbours(common, k)
+
+    upload = books_for(1, random.Random(99))[0]
+    upload['id'] = n + 1
+    times = []
+    for _ in range(50):
+        start = time.perf_counter()
+        model.nearest(upload, k)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print(f"placing one upload: median {times[len(times) // 2] * 1000:.1f} ms")
+
+    checked = check_blocked(3000, k, rng)
+    print(f"blocked top {k} matches a dense brute force for {checked} sampled books")
+    checked = check_nearest(3000, k, rng)
+    print(f"incremental placement matches a full scan for {checked} held-out uploads")
+
+
+if __name__ == '__main__':
+    main()
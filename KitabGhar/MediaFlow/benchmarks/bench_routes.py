@@ -0,0 +1,389 @@
+"""Latency and throughput of every route, in-process and behind gunicorn.
+
+Generates a synthetic catalog (see corpus.py), or reuses one given with
+--data-dir. Then it runs each scenario below a fixed number of times:
+
+    client    sequentially through the Flask test client, in this process
+    gunicorn  from --threads concurrent clients against a local gunicorn
+              with --workers workers
+
+For every route it reports p50/p95/p99 latency, throughput and errors, and
+for each mode the peak RSS (all gunicorn processes summed). Results are
+printed as a table. --json writes them with the corpus options and git
+revision. --baseline compares against an earlier --json file and exits 1
+when a route's p95 or throughput is worse by more than --tolerance.
+
+    python benchmarks/bench_routes.py [--books N ...] [--requests N]
+        [--modes client,gunicorn] [--workers N] [--threads N]
+        [--json results.json] [--baseline old.json] [--tolerance 0.2]
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import signal
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import io
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import corpus
+from _common import APP_DIR, percentile, start_app
+ADMIN = ('admin', 'admin123')   # seeded by app.seed_default_users()
+
+
+def scenarios(manifest):
+    """(name, method, path(rng), form(rng) / 'upload' / None, needs a logged-in admin)."""
+    books = manifest['books']
+    categories = manifest['categories']
+    word = lambda rng: rng.choice(corpus.WORDS)[:4]   # noqa: E731
+    book = lambda rng: rng.randrange(1, books + 1)    # noqa: E731
+    bench_user = lambda rng: rng.randrange(manifest['users'])   # noqa: E731
+    return [
+        ('index', 'GET', lambda rng: '/', None, False),
+        ('browse', 'GET', lambda rng: f'/browse?page={rng.randrange(1, 5)}', None, False),
+        ('browse_list', 'GET', lambda rng: '/browse?view=list', None, False),
+        ('browse_q', 'GET', lambda rng: f'/browse?q={word(rng)}', None, False),
+        ('browse_category', 'GET',
+         lambda rng: '/browse?' + urllib.parse.urlencode({'category': rng.choice(categories)}),
+         None, False),
+        ('browse_q_category', 'GET',
+         lambda rng: '/browse?' + urllib.parse.urlencode({'q': word(rng), 'category': rng.choice(categories)}),
+         None, False),
+        ('api_books', 'GET', lambda rng: f'/api/v1/books?limit=20&category={rng.choice(categories)}',
+         None, False),
+        ('api_books_q', 'GET', lambda rng: f'/api/v1/books?q={word(rng)}', None, False),
+        ('api_book', 'GET', lambda rng: f'/api/v1/books/{book(rng)}', None, False),
+        ('login_form', 'GET', lambda rng: '/login', None, False),
+        ('login', 'POST', lambda rng: '/login',
+         lambda rng: {'username': f'bench{bench_user(rng)}', 'password': manifest['password']}, False),
+        ('read', 'GET', lambda rng: f'/read/{book(rng)}', None, True),
+        ('download', 'GET', lambda rng: f'/download/{book(rng)}', None, True),
+        ('admin', 'GET', lambda rng: '/admin', None, True),
+        ('profile', 'GET', lambda rng: '/profile', None, True),
+        # last: every upload adds a book
+        ('upload', 'POST', lambda rng: '/upload', 'upload', True),
+    ]
+
+
+def upload_form(rng):
+    index = rng.randrange(10**9)
+    return {
+        'title': f'Upload {index}', 'author': 'Bench', 'category': 'Uploads',
+        'description': 'uploaded by the route benchmark',
+        'file': (corpus.dummy_pdf(index, 16 * 1024), f'upload-{index}.pdf'),
+    }
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1e3, 3)   # noqa: E731
+    return {
+        'requests': len(latencies) + errors, 'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)), 'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+# -- in-process ---------------------------------------------------------------
+def run_client(data_dir, manifest, requests, seed):
+    app = start_app(data_dir)
+    app.start_search_index(wait=True)
+
+    anonymous = app.app.test_client()
+    client = app.app.test_client()
+    client.post('/login', data={'username': ADMIN[0], 'password': ADMIN[1]})
+    results = {}
+    for name, method, path, body, login in scenarios(manifest):
+        rng = random.Random(seed)
+        browser = client if login else anonymous
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            url = path(rng)
+            if body == 'upload':
+                data = upload_form(rng)
+                pdf, filename = data['file']
+                data['file'] = (io.BytesIO(pdf), filename)
+            else:
+                data = body(rng) if body else None
+            t = time.perf_counter()
+            response = browser.open(url, method=method, data=data)
+            response.get_data()   # drain streamed bodies like a WSGI server would
+            latency = time.perf_counter() - t
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(latency)
+        results[name] = summarize(latencies, errors, time.perf_counter() - start)
+    app.flush_counters()
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# -- gunicorn -----------------------------------------------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _tree_rss_mb(pid):
+    """Current RSS of a process and its children, from /proc (Linux only)."""
+    if not os.path.isdir('/proc'):
+        return None
+    pids = {pid}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.add(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+def _multipart(fields):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        if isinstance(value, tuple):
+            data, filename = value
+            head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                    f'filename="{filename}"\r\nContent-Type: application/pdf\r\n\r\n')
+            parts.append(head.encode() + data + b'\r\n')
+        else:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+                         f'\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time a redirecting route by itself, as the test client does."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _fetch(opener, request):
+    try:
+        with opener.open(request) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        if e.code >= 400:
+            raise
+
+
+def _opener(base, login):
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+    if login:
+        form = urllib.parse.urlencode({'username': ADMIN[0], 'password': ADMIN[1]}).encode()
+        _fetch(opener, urllib.request.Request(base + '/login', data=form))
+    return opener
+
+
+def _gunicorn_worker(base, scenario, count, seed, latencies, errors):
+    name, method, path, body, login = scenario
+    opener = _opener(base, login)
+    rng = random.Random(seed)
+    mine, failed = [], 0
+    for _ in range(count):
+        url = base + path(rng)
+        data, headers = None, {}
+        if body == 'upload':
+            data, headers['Content-Type'] = _multipart(upload_form(rng))
+        elif body:
+            data = urllib.parse.urlencode(body(rng)).encode()
+        t = time.perf_counter()
+        try:
+            _fetch(opener, urllib.request.Request(url, data=data, headers=headers, method=method))
+            mine.append(time.perf_counter() - t)
+        except OSError:
+            failed += 1
+    with _results_lock:
+        latencies.extend(mine)
+        errors.append(failed)
+
+
+_results_lock = threading.Lock()
+
+
+def run_gunicorn(data_dir, manifest, requests, seed, workers, threads):
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, EXTRACT_ENABLED=os.environ.get('EXTRACT_ENABLED', '0'))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', '1',
+         '-b', f'127.0.0.1:{port}', '--pythonpath', APP_DIR, '--log-level', 'warning', 'main:app'],
+        cwd=data_dir, env=env, stderr=subprocess.DEVNULL)
+    peak_rss = 0.0
+    results = {}
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(base + '/login', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('gunicorn did not come up')
+
+        for scenario in scenarios(manifest):
+            latencies, errors = [], []
+            per_thread = [requests // threads + (i < requests % threads) for i in range(threads)]
+            pool = [threading.Thread(target=_gunicorn_worker,
+                                     args=(base, scenario, n, seed + i, latencies, errors))
+                    for i, n in enumerate(per_thread) if n]
+            start = time.perf_counter()
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            results[scenario[0]] = summarize(latencies, sum(errors), time.perf_counter() - start)
+            peak_rss = max(peak_rss, _tree_rss_mb(server.pid) or 0.0)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return results, peak_rss or None
+
+
+# -- reporting ----------------------------------------------------------------
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(report):
+    columns = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')
+    for mode, result in report['modes'].items():
+        rss = result['rss_mb']
+        print(f"\n{mode}" + (f" (peak RSS {rss:.0f} MB)" if rss else ''))
+        print(f"{'route':>18} " + ' '.join(f'{c:>14}' for c in columns))
+        for name, row in result['routes'].items():
+            cells = ['-' if row[c] is None else f'{row[c]:.2f}' if isinstance(row[c], float) else str(row[c])
+                     for c in columns]
+            print(f"{name:>18} " + ' '.join(f'{c:>14}' for c in cells))
+
+
+def compare(report, baseline, tolerance):
+    """Routes whose p95 grew, or throughput fell, by more than `tolerance`."""
+    regressions = []
+    for mode, result in report['modes'].items():
+        old_routes = baseline.get('modes', {}).get(mode, {}).get('routes', {})
+        for name, row in result['routes'].items():
+            old = old_routes.get(name)
+            if not old:
+                continue
+            if old['p95_ms'] and row['p95_ms'] and row['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{mode}/{name}: p95 {old['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+            if old['throughput_rps'] and row['throughput_rps'] is not None and \
+                    row['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{mode}/{name}: throughput {old['throughput_rps']:.1f} -> "
+                                   f"{row['throughput_rps']:.1f} req/s")
+            if row['errors'] > old['errors']:
+                regressions.append(f"{mode}/{name}: errors {old['errors']} -> {row['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    corpus.add_arguments(parser)
+    parser.add_argument('--data-dir', help='reuse a catalog made by corpus.py')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and mode')
+    parser.add_argument('--modes', default='client,gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent gunicorn clients')
+    parser.add_argument('--json', help='write machine-readable results here')
+    parser.add_argument('--baseline', help='earlier --json output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--mode-only', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode_only == 'client':
+        # run in a child process so the app module starts fresh on the catalog
+        manifest = _manifest(args.data_dir)
+        results, rss = run_client(args.data_dir, manifest, args.requests, args.seed)
+        print(json.dumps({'routes': results, 'rss_mb': rss}))
+        return 0
+
+    data_dir = args.data_dir
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix='kitabghar-routes-')
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), 'corpus.py'), data_dir,
+                        *_corpus_argv(args)], check=True, stdout=subprocess.DEVNULL)
+    data_dir = os.path.abspath(data_dir)
+    manifest = _manifest(data_dir)
+
+    report = {
+        'revision': _git_revision(), 'python': platform.python_version(),
+        'storage_backend': manifest['storage_backend'],
+        'snapshot_format': os.environ.get('SNAPSHOT_FORMAT', 'binary'),
+        'corpus': {k: v for k, v in manifest.items() if k not in ('password', 'categories')},
+        'requests': args.requests, 'modes': {},
+    }
+    for mode in args.modes.split(','):
+        if mode == 'client':
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode-only', 'client',
+                                  '--data-dir', data_dir, '--requests', str(args.requests),
+                                  '--seed', str(args.seed)],
+                                 check=True, capture_output=True, text=True).stdout
+            report['modes'][mode] = json.loads(out.strip().splitlines()[-1])
+        elif mode == 'gunicorn':
+            results, rss = run_gunicorn(data_dir, manifest, args.requests, args.seed,
+                                        args.workers, args.threads)
+            report['modes'][mode] = {'routes': results, 'rss_mb': rss,
+                                     'workers': args.workers, 'threads': args.threads}
+        else:
+            parser.error(f'unknown mode {mode!r}')
+
+    print_table(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+def _manifest(data_dir):
+    with open(os.path.join(data_dir, corpus.MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _corpus_argv(args):
+    return [f'--{key.replace("_", "-")}={value}' for key, value in corpus.options(args).items()]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Memory-engine startup from a JSON vs a binary snapshot at growing catalog sizes.
+
+For each size the same synthetic catalog (see bench_storage.py), with long
+descriptions, is written once per SNAPSHOT_FORMAT. Then a fresh process
+imports the app and times the load. It also times the first browse page,
+the background build of the search index, which parses every description,
+and the first search on that index. Each measurement runs in its own interpreter so RSS is per
+process.
+
+    python benchmarks/bench_startup.py [max_books]
+"""
+import os
+import sys
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import time
+
+from bench_storage import WORDS, synthetic_books
+
+from _common import start_app
+
+FORMATS = ('json', 'binary')
+
+
+def _import_app(fmt, workdir):
+    return start_app(workdir, env={'STORAGE_BACKEND': 'memory', 'SNAPSHOT_FORMAT': fmt})
+
+
+def populate(fmt, workdir, n):
+    app = _import_app(fmt, workdir)
+    rng = random.Random(3)
+    books = []
+    for book in synthetic_books(n):
+        book['description'] = ' '.join(rng.choices(WORDS, k=120))
+        books.append(book)
+    app.store.import_records([], books)
+    path = app.SNAPSHOT_FILE if fmt == 'binary' else app.DATA_FILE
+    return {'file_mb': os.path.getsize(path) / 2**20}
+
+
+def measure(fmt, workdir):
+    start = time.perf_counter()
+    app = _import_app(fmt, workdir)
+    result = {'startup_s': time.perf_counter() - start}
+    result['startup_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    start = time.perf_counter()
+    assert client.get('/browse').status_code == 200
+    result['first_browse_ms'] = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    app.start_search_index(wait=True)
+    result['search_index_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    app.search_books('river gard')
+    result['first_search_ms'] = (time.perf_counter() - start) * 1e3
+    result['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _run(*args):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), *map(str, args)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('--populate', '--measure'):
+        fmt, workdir = sys.argv[2], sys.argv[3]
+        if sys.argv[1] == '--populate':
+            print(json.dumps(populate(fmt, workdir, int(sys.argv[4]))))
+        else:
+            print(json.dumps(measure(fmt, workdir)))
+        return
+
+    max_books = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    columns = ('file_mb', 'startup_s', 'startup_rss_mb', 'first_browse_ms',
+               'search_index_s', 'first_search_ms', 'rss_mb')
+    print(f"{'books':>9} {'format':>7} " + ' '.join(f'{c:>15}' for c in columns))
+    size = 10_000
+    while size <= max_books:
+        for fmt in FORMATS:
+            workdir = tempfile.mkdtemp(prefix=f'kitabghar-startup-{fmt}-')
+            row = _run('--populate', fmt, workdir, size)
+            row.update(_run('--measure', fmt, workdir))
+            print(f"{size:>9} {fmt:>7} " + ' '.join(f'{row[c]:>15.2f}' for c in columns))
+        size *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Memory vs SQLite storage engine at growing catalog sizes.
+
+For each size a synthetic catalog is written with the engine's bulk import,
+then a fresh process imports the app (loading the store as it would at
+startup) and times the hot lookups the routes make. Startup time and peak
+RSS are per process, so each measurement runs in its own interpreter.
+
+    python benchmarks/bench_storage.py [max_books]
+"""
+import os
+import sys
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from _common import start_app
+
+ENGINES = ('memory', 'sqlite')
+CATEGORIES = ['Fiction', 'History', 'Science', 'Poetry', 'Travel', 'Children',
+              'Religion', 'Cooking', 'Art', 'Biography']
+WORDS = ('river night garden stone light empire silent winter letters city '
+         'mountain journey mirror shadow harbor paper kingdom desert forest '
+         'memory ocean song glass fire iron thread road sky lantern machine').split()
+REPEAT = 200
+
+
+def _import_app(engine, workdir):
+    return start_app(workdir, env={'STORAGE_BACKEND': engine})
+
+
+def synthetic_books(n):
+    rng = random.Random(42)
+    base = datetime(2020, 1, 1)
+    for i in range(1, n + 1):
+        yield {
+            'id': i,
+            'title': ' '.join(rng.sample(WORDS, 3)).title(),
+            'author': f'Author {rng.randrange(n // 10 + 1)}',
+            'category': rng.choice(CATEGORIES),
+            'description': ' '.join(rng.choices(WORDS, k=12)),
+            'filename': f'{i:064x}.pdf',
+            'sha256': f'{i:064x}',
+            'uploaded_by': 1,
+            'uploaded_at': base + timedelta(seconds=i),
+            'downloads': 0,
+            'views': 0,
+        }
+
+
+def populate(engine, workdir, n):
+    app = _import_app(engine, workdir)
+    books = list(synthetic_books(n))
+    start = time.perf_counter()
+    app.store.import_records([], books)
+    return {'import_s': time.perf_counter() - start}
+
+
+def _per_call(fn, repeat=REPEAT):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def measure(engine, workdir):
+    start = time.perf_counter()
+    app = _import_app(engine, workdir)
+    startup = time.perf_counter() - start
+    app.start_search_index(wait=True)
+    n = app.count_books()
+    rng = random.Random(7)
+    ids = [rng.randrange(1, n + 1) for _ in range(REPEAT)]
+
+    result = {
+        'startup_s': startup,
+        'get_book_us': _per_call(lambda: app.get_book(ids[rng.randrange(REPEAT)])),
+        'recent_page_us': _per_call(lambda: app.recent_books(0, 24)),
+        'deep_page_us': _per_call(lambda: app.recent_books(n // 2, 24), 20),
+        'category_page_us': _per_call(lambda: app.recent_books(0, 24, 'Poetry'), 20),
+        'count_books_us': _per_call(app.count_books),
+        'search_us': _per_call(lambda: app.search_books('river gard'), 5),
+        'categories_us': _per_call(app.get_all_categories, 5),
+    }
+    start = time.perf_counter()
+    for book_id in ids * 5:
+        app.bump_counter(app.get_book(book_id), 'views')
+    app.flush_counters()
+    result['bump_flush_us'] = (time.perf_counter() - start) / (len(ids) * 5) * 1e6
+    result['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _run(*args):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), *map(str, args)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('--populate', '--measure'):
+        engine, workdir = sys.argv[2], sys.argv[3]
+        if sys.argv[1] == '--populate':
+            print(json.dumps(populate(engine, workdir, int(sys.argv[4]))))
+        else:
+            print(json.dumps(measure(engine, workdir)))
+        return
+
+    max_books = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    columns = ('import_s', 'startup_s', 'rss_mb', 'get_book_us', 'recent_page_us',
+               'deep_page_us', 'category_page_us', 'count_books_us', 'search_us',
+               'categories_us', 'bump_flush_us')
+    print(f"{'books':>9} {'engine':>7} " + ' '.join(f'{c:>16}' for c in columns))
+    size = 10_000
+    while size <= max_books:
+        for engine in ENGINES:
+            workdir = tempfile.mkdtemp(prefix=f'kitabghar-bench-{engine}-')
+            row = _run('--populate', engine, workdir, size)
+            row.update(_run('--measure', engine, workdir))
+            print(f"{size:>9} {engine:>7} " + ' '.join(f'{row[c]:>16.2f}' for c in columns))
+        size *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Latency of /suggest completions at catalog scale.
+
+Builds a suggest.PrefixIndex over the synthetic catalog from bench_fuzzy.py
+(with categories added). Then it times completions for prefixes of one to
+six letters taken from real titles and authors, the keystrokes of someone
+typing, and reports p50/p99 per prefix length. Prefixes up to
+suggest.RANKED_PREFIX letters long are answered from the completions the
+index keeps in count order for them.
+
+    python benchmarks/bench_suggest.py [books] [queries]
+"""
+import sys
+import time
+import random
+
+from _common import percentile
+from bench_fuzzy import catalog
+import suggest
+
+CATEGORIES = ['Fiction', 'History', 'Science', 'Poetry', 'Travel', 'Children',
+              'Religion', 'Cooking', 'Art', 'Biography', 'Urdu Ghazal', 'Hindi Kahani']
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(11)
+    books = catalog(n, rng)
+    for book in books:
+        book['category'] = rng.choice(CATEGORIES)
+
+    start = time.perf_counter()
+    index = suggest.PrefixIndex()
+    index.add_many(books)
+    print(f"{n} books, {len(index)} keys: built in {time.perf_counter() - start:.2f}s")
+
+    for length in range(1, 7):
+        times = []
+        for _ in range(n_queries):
+            book = rng.choice(books)
+            prefix = book[rng.choice(('title', 'author'))][:length]
+            t = time.perf_counter()
+            index.complete(prefix)
+            times.append(time.perf_counter() - t)
+        times.sort()
+        print(f"{length}-letter prefixes: p50 {percentile(times, 50) * 1e6:6.0f} us, "
+              f"p99 {percentile(times, 99) * 1e6:6.0f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Cost and correctness of the time-decayed popularity rankings.
+
+Replays a stream of read events over a synthetic catalog, spread over a few
+weeks, into a popularity.Ranking the way app.bump_counter() does. It reports
+the per-event update cost and the cost of reading the top k, overall and for
+one category. Then it checks both top-k lists against a brute-force
+recomputation. That recomputation decays every event of every book to "now"
+and sorts the whole catalog, which is what the ranking is there to avoid.
+Last, it repeats the check at a half-life of an hour over more than a year,
+long enough to overflow the weights of a fixed epoch, rebasing the scores
+the way app.rebase_trends() does.
+
+    python benchmarks/bench_trending.py [books] [events]
+"""
+import math
+import sys
+import time
+import random
+
+from _common import percentile
+import popularity
+
+CATEGORIES = ['Fiction', 'History', 'Science', 'Poetry', 'Travel', 'Children',
+              'Religion', 'Cooking', 'Art', 'Biography', 'Urdu Ghazal', 'Hindi Kahani']
+K = 20
+FIELD = 'views_trend'
+
+
+def brute_force(books, events, now, k, category=None):
+    """Top k [(decayed score, book_id)] from every event, by a full sort."""
+    scores = {}
+    for book_id, t in events:
+        scores[book_id] = scores.get(book_id, 0) + 2.0 ** (-(now - t) / popularity.HALF_LIFE)
+    ranked = [(-score, -book_id) for book_id, score in scores.items()
+              if category is None or books[book_id]['category'] == category]
+    ranked.sort()
+    return [(-score, -book_id) for score, book_id in ranked[:k]]
+
+
+def check(ranking, books, events, now, category=None, epoch=popularity.EPOCH):
+    expected = brute_force(books, events, now, K, category)
+    got = [(popularity.decayed(score, now, epoch), book_id)
+           for score, book_id in ranking.top(K, category)]
+    assert len(got) == len(expected), (category, len(got), len(expected))
+    for (want, want_id), (score, book_id) in zip(expected, got):
+        assert math.isclose(want, score, rel_tol=1e-9), (category, want, score)
+        # equal scores may come in either order; distinct ones must match
+        assert book_id == want_id or math.isclose(
+            popularity.decayed(books[want_id][FIELD], now, epoch), score, rel_tol=1e-9), category
+
+
+def check_rebase(rng, n=2000, n_events=50_000):
+    """Rankings at a one-hour half-life over 400 days, rebasing as they go."""
+    half_life, popularity.HALF_LIFE = popularity.HALF_LIFE, 3600.0
+    try:
+        books = {i: {'id': i, 'category': rng.choice(CATEGORIES), FIELD: 0}
+                 for i in range(1, n + 1)}
+        times = sorted(popularity.EPOCH + rng.random() * 400 * 86400 for _ in range(n_events))
+        events = list(zip(rng.choices(range(1, n + 1), k=n_events), times))
+        ranking = popularity.Ranking(FIELD)
+        epoch, rebases = popularity.EPOCH, 0
+        for book_id, t in events:
+            new = popularity.rebased(epoch, t)
+            if new != epoch:
+                factor = popularity.rescale(epoch, new)
+                for book in books.values():
+                    book[FIELD] *= factor
+                ranking.rebuild(books.values())
+                epoch, rebases = new, rebases + 1
+            book = books[book_id]
+            book[FIELD] += popularity.weight(t, epoch)
+            ranking.update(book)
+        now = times[-1] + 600
+        for category in (None, *CATEGORIES):
+            check(ranking, books, events, now, category, epoch)
+    finally:
+        popularity.HALF_LIFE = half_life
+    return rebases
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 500_000
+    rng = random.Random(5)
+    books = {i: {'id': i, 'category': rng.choice(CATEGORIES), FIELD: 0}
+             for i in range(1, n + 1)}
+    # a few books are much more popular than the rest, as with real reading
+    weights = [1 / i ** 0.8 for i in range(1, n + 1)]
+    start_t = popularity.EPOCH + 200 * 86400
+    span = 4 * 7 * 86400
+    times = sorted(start_t + rng.random() * span for _ in range(n_events))
+    events = list(zip(rng.choices(range(1, n + 1), weights, k=n_events), times))
+
+    ranking = popularity.Ranking(FIELD)
+    update_times = []
+    for book_id, t in events:
+        book = books[book_id]
+        start = time.perf_counter()
+        book[FIELD] += popularity.weight(t)
+        ranking.update(book)
+        update_times.append(time.perf_counter() - start)
+    update_times.sort()
+    print(f"{n} books, {n_events} reads over 4 weeks, {len(ranking)} books ranked")
+    print(f"per event: p50 {percentile(update_times, 50) * 1e6:.1f} us, "
+          f"p99 {percentile(update_times, 99) * 1e6:.1f} us")
+
+    for category in (None, CATEGORIES[0]):
+        start = time.perf_counter()
+        for _ in range(1000):
+            ranking.top(K, category)
+        per_top = (time.perf_counter() - start) / 1000
+        label = category or 'all'
+        print(f"top {K} ({label}): {per_top * 1e6:.1f} us")
+
+    now = times[-1] + 3600
+    start = time.perf_counter()
+    for category in (None, *CATEGORIES):
+        check(ranking, books, events, now, category)
+    per_check = (time.perf_counter() - start) / (len(CATEGORIES) + 1)
+    print(f"top {K} matches a brute-force recomputation overall and in {len(CATEGORIES)} "
+          f"categories (which takes {per_check * 1000:.0f} ms each)")
+    rebases = check_rebase(rng)
+    print(f"at a one-hour half-life over 400 days, {rebases} rebases keep the top {K} exact")
+
+
+if __name__ == '__main__':
+    main()
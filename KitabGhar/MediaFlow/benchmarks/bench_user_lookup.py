@@ -0,0 +1,61 @@
+"""Bulk-registration benchmark for the username/email indexes.
+
+Registers users in bulk and times get_user_by_username() /
+get_user_by_email() at growing user counts. With the indexes in place the
+per-lookup cost should stay flat as the user count grows.
+
+    python benchmarks/bench_user_lookup.py [max_users]
+"""
+import sys
+import random
+import time
+from datetime import datetime
+
+from _common import start_app
+
+app = start_app()
+
+LOOKUPS = 20000
+
+
+def register_bulk(start, stop, password_hash):
+    # Hashing a password per user would dominate the run, so reuse one hash
+    # and go through the same index path create_user() uses.
+    for i in range(start, stop):
+        user = {
+            'id': app.user_counter,
+            'username': f'User{i}',
+            'email': f'user{i}@example.com',
+            'password_hash': password_hash,
+            'role': 'reader',
+            'created_at': datetime.now(),
+        }
+        app.user_counter += 1
+        app.users_db[user['id']] = user
+        app._index_user(user)
+
+
+def time_lookups(n_users):
+    names = [f'user{random.randrange(n_users)}' for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for name in names:
+        assert app.get_user_by_username(name) is not None
+        assert app.get_user_by_email(name + '@EXAMPLE.com') is not None
+    return (time.perf_counter() - start) / (2 * LOOKUPS)
+
+
+def main():
+    max_users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    password_hash = app.generate_password_hash('secret')
+    registered = 0
+    size = 1000
+    print(f"{'users':>10} {'ns/lookup':>10}")
+    while size <= max_users:
+        register_bulk(registered, size, password_hash)
+        registered = size
+        print(f"{size:>10} {time_lookups(size) * 1e9:>10.0f}")
+        size *= 10
+
+
+if __name__ == '__main__':
+    main()
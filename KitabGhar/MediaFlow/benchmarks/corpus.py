@@ -0,0 +1,158 @@
+"""Generate a synthetic catalog in a data directory, for the route benchmarks.
+
+Creates users, books spread over a number of categories, and small but valid
+PDFs in the sharded uploads/ layout, then writes them with the store's bulk
+import so the directory starts like a real deployment would. The same seed
+always produces the same catalog. A corpus.json manifest records the options
+and the generated users' password.
+
+    python benchmarks/corpus.py DATA_DIR [--books N] [--users N] [--categories N]
+                                [--description-words N] [--pdfs N] [--pdf-kb N]
+
+Set STORAGE_BACKEND=sqlite to generate the catalog for the SQLite engine.
+"""
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+from _common import start_app
+MANIFEST = 'corpus.json'
+PASSWORD = 'bench-password'
+WORDS = ('river night garden stone light empire silent winter letters city '
+         'mountain journey mirror shadow harbor paper kingdom desert forest '
+         'memory ocean song glass fire iron thread road sky lantern machine '
+         'orchard bridge thunder copper willow meadow candle voyage ember salt').split()
+
+
+def dummy_pdf(index, size):
+    """A one-page PDF naming the book, padded with a comment to about `size` bytes."""
+    stream = f'BT /F1 18 Tf 72 720 Td (Benchmark book {index}) Tj ET'
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        '/Resources << /Font << /F1 5 0 R >> >> >>',
+        f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        f'<< /Title (Benchmark book {index}) /Producer (kitabghar corpus) >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    padding = max(size - 900, 0)
+    while padding > 0:
+        line = min(padding, 120)
+        out += b'%' + b'x' * (line - 2) + b'\n'
+        padding -= line
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode()
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode()
+    out += (f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info 6 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n').encode()
+    return bytes(out)
+
+
+def generate(data_dir, books=1000, users=100, categories=10, description_words=40,
+             pdfs=50, pdf_kb=64, seed=42):
+    """Fill an empty data directory with a synthetic catalog; returns the manifest."""
+    os.makedirs(data_dir, exist_ok=True)
+    app = start_app(data_dir)
+    if app.count_books() or app.count_users() > 3:
+        raise SystemExit(f"{data_dir} already holds a catalog")
+
+    rng = random.Random(seed)
+    category_names = [WORDS[i % len(WORDS)].title() + (f' {i // len(WORDS)}' if i >= len(WORDS) else '')
+                      for i in range(categories)]
+
+    files = []
+    for i in range(pdfs):
+        data = dummy_pdf(i, pdf_kb * 1024)
+        sha256 = hashlib.sha256(data).hexdigest()
+        filename = app.shard_name(f'{sha256}.pdf')
+        path = os.path.join(app.app.config['UPLOAD_FOLDER'], filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        files.append((filename, sha256))
+
+    password_hash = app.generate_password_hash(PASSWORD)
+    first_user = max((u['id'] for u in app.list_users()), default=0) + 1
+    base = datetime(2020, 1, 1)
+    new_users = []
+    for i in range(users):
+        new_users.append({
+            'id': first_user + i,
+            'username': f'bench{i}',
+            'email': f'bench{i}@example.com',
+            'password_hash': password_hash,
+            'role': 'author' if i % 10 == 0 else 'reader',
+            'created_at': base + timedelta(minutes=i),
+        })
+    authors = [u['id'] for u in new_users if u['role'] == 'author'] or [1]
+
+    new_books = []
+    for i in range(books):
+        filename, sha256 = files[i % len(files)]
+        new_books.append({
+            'id': i + 1,
+            'title': ' '.join(rng.sample(WORDS, 3)).title(),
+            'author': f'Author {rng.randrange(books // 20 + 1)}',
+            'category': rng.choice(category_names),
+            'description': ' '.join(rng.choices(WORDS, k=description_words)),
+            'filename': filename,
+            'sha256': sha256,
+            'uploaded_by': rng.choice(authors),
+            'uploaded_at': base + timedelta(seconds=i * 37),
+            'downloads': rng.randrange(500),
+            'views': rng.randrange(5000),
+        })
+    app.store.import_records(new_users, new_books)
+    app.store.checkpoint()
+
+    manifest = {
+        'books': books, 'users': users, 'categories': category_names,
+        'description_words': description_words, 'pdfs': pdfs, 'pdf_kb': pdf_kb,
+        'seed': seed, 'password': PASSWORD, 'first_user': first_user,
+        'storage_backend': app.STORAGE_BACKEND,
+    }
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def add_arguments(parser):
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--description-words', type=int, default=40)
+    parser.add_argument('--pdfs', type=int, default=50,
+                        help='distinct PDF files, shared round-robin by the books')
+    parser.add_argument('--pdf-kb', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def options(args):
+    return {'books': args.books, 'users': args.users, 'categories': args.categories,
+            'description_words': args.description_words, 'pdfs': args.pdfs,
+            'pdf_kb': args.pdf_kb, 'seed': args.seed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('data_dir')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    manifest = generate(os.path.abspath(args.data_dir), **options(args))
+    print(f"{manifest['books']} books, {manifest['users']} users, "
+          f"{len(manifest['categories'])} categories in {args.data_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Many threads mutating and reading one store: no lost updates, no torn files.
+
+Writer threads create users and books, bump counters and edit/delete books
+while reader threads browse, search and list categories, and a small
+JOURNAL_COMPACT_EVERY keeps snapshots being written underneath them. At the
+end every id must be unique, every counter bump accounted for, and the
+snapshot + journal on disk must reload to exactly the in-memory state.
+
+    python benchmarks/stress_threads.py [writers] [readers] [ops_per_writer]
+"""
+import sys
+import random
+import threading
+import time
+import logging
+import traceback
+from collections import Counter
+
+from _common import start_app
+
+app = start_app(prefix='kitabghar-stress-', log_level=logging.CRITICAL, defaults={
+    'JOURNAL_COMPACT_EVERY': '200',
+    'COUNTER_FLUSH_INTERVAL': '0.05',
+    'COUNTER_FLUSH_THRESHOLD': '20',
+    # every writer thread may be hashing at once; this checks the store, not load shedding
+    'HASH_QUEUE_DEPTH': '64',
+})
+
+WORDS = 'river night garden stone light empire silent winter letters city'.split()
+errors = []
+done = threading.Event()
+
+
+def writer(index, ops, bumps, created_users, created_books):
+    rng = random.Random(index)
+    mine = []
+    try:
+        for i in range(ops):
+            roll = rng.random()
+            if roll < 0.01:   # password hashing is deliberately slow
+                user = app.create_user(f'w{index}u{i}', f'w{index}u{i}@example.com', 'x')
+                created_users.append(user['id'])
+            elif roll < 0.25 or not mine:
+                book = app.create_book(' '.join(rng.sample(WORDS, 3)), f'Author {index}',
+                                       rng.choice(WORDS).title(), 'stress', f'w{index}-{i}.pdf', 1)
+                mine.append(book['id'])
+                created_books.append(book['id'])
+            elif roll < 0.30 and len(mine) > 1:
+                app.delete_book_and_file(mine.pop(0))
+            elif roll < 0.40:
+                app.update_book(rng.choice(mine), description=' '.join(rng.sample(WORDS, 4)))
+            else:
+                book_id = rng.choice(mine)
+                book = app.get_book(book_id)
+                app.bump_counter(book, 'views')
+                bumps[book_id] += 1
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def reader(index):
+    rng = random.Random(1000 + index)
+    client = app.app.test_client()
+    try:
+        while not done.is_set():
+            roll = rng.random()
+            if roll < 0.3:
+                app.search_books(rng.choice(WORDS)[:3])
+            elif roll < 0.5:
+                app.recent_books(rng.randrange(50), 24, rng.choice([None, rng.choice(WORDS).title()]))
+            elif roll < 0.6:
+                app.get_all_categories()
+            elif roll < 0.7:
+                app.count_books(rng.choice(WORDS).title())
+            else:
+                response = client.get(f'/browse?q={rng.choice(WORDS)[:4]}')
+                assert response.status_code == 200, response.status_code
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def state():
+    """Comparable view of the store: books without derived fields, users by id."""
+    books = {b['id']: (b['title'], b['description'], b.get('views', 0)) for b in app.recent_books()}
+    users = {u['id']: u['username'] for u in app.list_users()}
+    return books, users
+
+
+def main():
+    n_writers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    n_readers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    ops = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    app.start_counter_flusher()
+
+    bumps = [Counter() for _ in range(n_writers)]
+    created_users, created_books = [], []
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(n_readers)]
+    writers = [threading.Thread(target=writer, args=(i, ops, bumps[i], created_users, created_books))
+               for i in range(n_writers)]
+    start = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    app.flush_counters()
+
+    ok = not errors
+    for err in errors[:3]:
+        print(err)
+    print(f"{n_writers} writers x {ops} ops, {n_readers} readers: {elapsed:.1f}s, "
+          f"{len(errors)} thread errors")
+
+    ids_ok = (len(set(created_users)) == len(created_users)
+              and len(set(created_books)) == len(created_books))
+    print(f"  ids: {len(created_users)} users, {len(created_books)} books, "
+          f"{'unique' if ids_ok else 'COLLIDED'}")
+    ok &= ids_ok
+
+    expected = sum(bumps, Counter())
+    lost = 0
+    for book_id, n in expected.items():
+        book = app.get_book(book_id)
+        if book is not None and book.get('views', 0) != n:
+            lost += abs(n - book.get('views', 0))
+    print(f"  counters: {sum(expected.values())} bumps, {lost} lost")
+    ok &= lost == 0
+
+    app.read_snapshot()   # a torn snapshot would not parse
+    before = state()
+    app.load_data()
+    reloaded = state() == before
+    print(f"  reload from disk: {'identical' if reloaded else 'DIFFERENT'}")
+    ok &= reloaded
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Several gunicorn workers sharing one store: no lost counters or ids.
+
+Starts gunicorn with N workers on a fresh data directory, registers one
+account per client thread (exercising id allocation in every worker), then
+hammers /download. A tiny JOURNAL_COMPACT_EVERY forces compactions while the
+load runs. After gunicorn exits, the download totals read back from the
+store must equal the number of successful downloads, book by book.
+
+    python benchmarks/stress_workers.py [workers] [threads] [requests_per_thread]
+
+Set STORAGE_BACKEND=sqlite to run the same check against the SQLite engine.
+"""
+import os
+import sys
+import random
+import signal
+import socket
+import subprocess
+import threading
+import time
+import http.cookiejar
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+from _common import APP_DIR, start_app
+
+app = start_app(prefix='kitabghar-stress-', defaults={
+    'JOURNAL_COMPACT_EVERY': '50',
+    'COUNTER_FLUSH_INTERVAL': '0.2',
+})
+
+BOOKS = 5
+
+
+def make_books():
+    books = []
+    for i in range(BOOKS):
+        filename = app.shard_name(f'stress-{i}.pdf')
+        path = os.path.join(app.app.config['UPLOAD_FOLDER'], filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + os.urandom(2048))
+        books.append(app.create_book(f'Stress {i}', 'Bench', 'Bench', '', filename, 1)['id'])
+    return books
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(base):
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base + '/login', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not come up')
+
+
+def client(base, index, book_ids, requests, counts, failures):
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    form = urllib.parse.urlencode({
+        'username': f'stress{index}', 'email': f'stress{index}@example.com',
+        'password': 'pw', 'confirm_password': 'pw', 'role': 'reader',
+    }).encode()
+    opener.open(base + '/register', form).read()
+    rng = random.Random(index)
+    local = Counter()
+    for _ in range(requests):
+        book_id = rng.choice(book_ids)
+        try:
+            with opener.open(f'{base}/download/{book_id}') as response:
+                response.read()
+                if response.status == 200:
+                    local[book_id] += 1
+        except OSError:
+            failures.append(book_id)
+    with counts_lock:
+        counts.update(local)
+
+
+counts_lock = threading.Lock()
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    book_ids = make_books()
+    app.flush_counters()
+
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+         '--pythonpath', APP_DIR, '--log-level', 'warning', 'main:app'],
+        stderr=subprocess.DEVNULL)
+    try:
+        wait_for(base)
+        counts, failures = Counter(), []
+        pool = [threading.Thread(target=client, args=(base, i, book_ids, requests, counts, failures))
+                for i in range(threads)]
+        start = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+        time.sleep(float(os.environ['COUNTER_FLUSH_INTERVAL']) * 3)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    app.store.refresh()
+    total = sum(counts.values())
+    print(f"{workers} workers, {threads} threads: {total} downloads in {elapsed:.1f}s "
+          f"({total / elapsed:.0f}/s), {len(failures)} failed requests")
+    ok = True
+    for book_id in book_ids:
+        stored = app.get_book(book_id)['downloads']
+        mark = 'ok' if stored == counts[book_id] else 'MISMATCH'
+        ok &= stored == counts[book_id]
+        print(f"  book {book_id}: served {counts[book_id]:>6}, stored {stored:>6}  {mark}")
+    ids = [u['id'] for u in app.list_users()]
+    names = {u['username'] for u in app.list_users()}
+    registered = sum(1 for i in range(threads) if f'stress{i}' in names)
+    ids_ok = len(ids) == len(set(ids)) and registered == threads
+    ok &= ids_ok
+    print(f"  users: {registered}/{threads} registered, ids {'unique' if ids_ok else 'COLLIDED'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Compute every book's related books and save the model new uploads use.
+
+Run from the app directory (where the data store lives), with the same
+STORAGE_BACKEND the app uses, whenever the catalog has changed a lot
+(nightly, or after a bulk import):
+
+    python build_related.py [--k N] [--block-cells N] [--batch N]
+
+Each book's top k (default RELATED_K, 8) goes into its 'related' field,
+--batch books per store write (one journal append, or one SQLite
+transaction). Lists that did not change are not written. The model is saved
+to RELATED_MODEL_FILE. Running workers pick it up for the next upload, which
+is then placed without a rebuild (see app._link_related()).
+
+Needs NumPy. --block-cells bounds memory: that many similarities are held at
+once, 8 bytes each, and term products are made that many at a time.
+"""
+import sys
+import time
+import argparse
+import logging
+
+import app
+import related
+
+logger = logging.getLogger('build_related')
+
+
+def build(k=related.DEFAULT_K, block_cells=related.BLOCK_CELLS, batch=5000):
+    stats = {'books': 0, 'written': 0}
+    start = time.perf_counter()
+    books = {book['id']: book for book in app.store.recent_books()}
+    model = related.Model.fit(books.values())
+    stats['fit_seconds'] = time.perf_counter() - start
+    logger.info(f"TF-IDF over {len(model)} books, {len(model.terms)} terms, "
+                f"{len(model.data)} entries in {stats['fit_seconds']:.1f}s")
+
+    updates = {}
+    for book_id, neighbours in model.neighbours(k, block_cells):
+        stats['books'] += 1
+        found = [list(pair) for pair in neighbours]
+        if books[book_id].get('related') != found:
+            updates[book_id] = {'related': found}
+        if len(updates) >= batch:
+            app.store.update_books(updates)
+            stats['written'] += len(updates)
+            updates.clear()
+            logger.info(f"{stats['books']} of {len(model)} books done")
+    if updates:
+        app.store.update_books(updates)
+        stats['written'] += len(updates)
+    model.save(related.MODEL_FILE)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--k', type=int, default=related.DEFAULT_K,
+                        help='related books kept per book (default: %(default)s)')
+    parser.add_argument('--block-cells', type=int, default=related.BLOCK_CELLS,
+                        help='similarities held in memory at once (default: %(default)s)')
+    parser.add_argument('--batch', type=int, default=5000,
+                        help='books per store write (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not related.available():
+        raise SystemExit("build_related.py needs NumPy: pip install numpy, "
+                         "or install the app with its 'related' extra")
+
+    app.init_app(serve=False)
+    logging.getLogger().setLevel(logging.INFO)
+    stats = build(args.k, args.block_cells, args.batch)
+    app.store.checkpoint()
+    print(f"related books for {stats['books']} books in {stats['seconds']:.1f}s "
+          f"({stats['written']} lists changed); model saved to {related.MODEL_FILE}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
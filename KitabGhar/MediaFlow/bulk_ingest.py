@@ -0,0 +1,268 @@
+"""Import a directory of PDFs into the catalog in bulk.
+
+Run from the app directory (where the data store lives), with the same
+STORAGE_BACKEND the app uses:
+
+    python bulk_ingest.py PDF_DIR MANIFEST [--uploader admin] [--workers N] [--batch N]
+
+MANIFEST is a CSV file with a header row, or a JSON Lines file (.jsonl), with
+one book per row. 'file' is the PDF's path relative to PDF_DIR. 'title',
+'author', 'category' and 'description' are optional. A missing title or
+author is taken from the PDF's Info metadata, and failing that the title is
+the file name.
+
+Worker processes hash each file and copy it to a temp file in uploads/.
+Unless EXTRACT_ENABLED=0 they also extract its page count and text, so each
+file is read only once. The book records are then created in batches of
+--batch (default: all of them). Each batch is one persistence commit: one
+journal append for the memory engine, one transaction for SQLite. Like an
+upload, a batch moves its files into the content-addressed layout and adds
+its books under the store lock, so a book deleted meanwhile by the running
+app cannot take a file a new book is about to use.
+
+Every row becomes its own book. Rows whose files have the same content share
+one stored file, which is kept until the last of their books is deleted, as
+with uploads.
+
+An interrupted run can be started again. Committed rows are kept in
+MANIFEST.progress, keyed by row number, path, size and mtime, so they are
+skipped and their files are not even read a second time. A batch's rows are
+written there as pending (and synced) before it is committed, and confirmed
+after. Each book records its row's key as 'import_key', so rows left pending
+by a crash are looked up in the store: those that made it in are skipped,
+the rest imported again. Temp files a crashed run left in uploads/ are
+removed at the start of the next.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import app
+import pdfinfo
+
+logger = logging.getLogger('bulk_ingest')
+
+TEMP_SUFFIX = '.ingest.part'   # left in uploads/ only by a run that crashed
+
+
+def read_manifest(path):
+    """[(row number, {field: value})] from a CSV or JSON Lines manifest."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson')):
+            return [(n, json.loads(line)) for n, line in enumerate(f, 1) if line.strip()]
+        return list(enumerate(csv.DictReader(f), 2))   # row 1 is the header
+
+
+def _progress_key(number, row_file, st):
+    return f"{number}\0{row_file}\0{st.st_size}\0{st.st_mtime_ns}"
+
+
+def load_progress(path):
+    """({key: sha256} committed, {key: (sha256, upload time)} left pending) by earlier runs."""
+    done, pending = {}, {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue   # torn last line from an interrupted run
+                if 'pending' in rec:
+                    pending[rec['key']] = (rec['sha256'], rec['pending'])
+                else:
+                    done[rec['key']] = rec['sha256']
+                    pending.pop(rec['key'], None)
+    except FileNotFoundError:
+        pass
+    return done, pending
+
+
+def _write_progress(path, records, sync=False):
+    with open(path, 'a', encoding='utf-8') as log:
+        log.writelines(json.dumps(rec) + '\n' for rec in records)
+        if sync:
+            log.flush()
+            os.fsync(log.fileno())
+
+
+def _stored_keys(pending):
+    """The pending progress keys whose books are in the store.
+
+    Only books uploaded since the oldest pending row are read, newest
+    first: after a crash that is the last batch and whatever followed it.
+    """
+    since = min(datetime.fromisoformat(at) for _, at in pending.values())
+    since -= timedelta(seconds=1)   # the memory engine keeps whole seconds
+    found, before = set(), None
+    while True:
+        books = app.store.recent_books(limit=500, before=before)
+        for book in books:
+            if book.get('uploaded_at') is None or book['uploaded_at'] < since:
+                return found
+            if book.get('import_key') in pending:
+                found.add(book['import_key'])
+        if len(books) < 500:
+            return found
+        before = app.store.recency_key(books[-1])
+
+
+def _ingest_file(path, extract):
+    """Copy one PDF to a temp file in uploads/ and extract it; runs in a worker process.
+
+    Returns a result dict, with 'error' set instead of raising so one bad
+    file does not stop the batch.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(4) != b'%PDF':
+                return {'error': 'not a PDF file'}
+            f.seek(0)
+            tmp_path, sha256 = app.stream_to_temp(f, TEMP_SUFFIX)
+        size = os.path.getsize(tmp_path)
+    except OSError as e:
+        return {'error': str(e)}
+
+    result = {'sha256': sha256, 'tmp_path': tmp_path, 'size': size}
+    if extract:
+        try:
+            info = pdfinfo.extract(tmp_path, app.EXTRACT_MAX_TEXT)
+            result.update(extract_status='done', pages=info.get('pages'),
+                          pdf_meta=info.get('meta', {}), content_text=info.get('text', ''))
+        except Exception as e:
+            logger.warning(f"Extraction failed for {path}: {e}")
+            result['extract_status'] = 'failed'
+    return result
+
+
+def _book_record(row, path, result, uploader_id, key):
+    meta = result.get('pdf_meta') or {}
+    book = {
+        'title': (row.get('title') or '').strip() or meta.get('title')
+                 or os.path.splitext(os.path.basename(path))[0],
+        'author': (row.get('author') or '').strip() or meta.get('author', ''),
+        'category': (row.get('category') or '').strip() or 'Uncategorized',
+        'description': (row.get('description') or '').strip(),
+        'sha256': result['sha256'],
+        'uploaded_by': uploader_id,
+        'uploaded_at': datetime.now(),
+        'downloads': 0,
+        'views': 0,
+        'import_key': key,
+    }
+    for field in ('extract_status', 'pages', 'pdf_meta', 'content_text'):
+        if field in result:
+            book[field] = result[field]
+    return book
+
+
+def ingest(pdf_dir, manifest_path, uploader='admin', workers=None, batch=0):
+    user = app.get_user_by_username(uploader)
+    if user is None:
+        raise SystemExit(f"no user named {uploader!r} to record as the uploader")
+    upload_dir = app.app.config['UPLOAD_FOLDER']
+    for name in os.listdir(upload_dir):
+        if name.endswith(TEMP_SUFFIX):
+            os.unlink(os.path.join(upload_dir, name))
+    progress_path = manifest_path + '.progress'
+    done, pending_keys = load_progress(progress_path)
+    if pending_keys:
+        stored = _stored_keys(pending_keys)
+        _write_progress(progress_path, [{'key': key, 'sha256': pending_keys[key][0]}
+                                        for key in stored])
+        done.update((key, pending_keys[key][0]) for key in stored)
+    stats = {'added': 0, 'skipped': 0, 'failed': 0, 'files': 0, 'bytes': 0}
+
+    todo = []
+    for number, row in read_manifest(manifest_path):
+        row_file = (row.get('file') or '').strip()
+        path = os.path.join(pdf_dir, row_file)
+        if not row_file or not app.allowed_file(row_file):
+            logger.warning(f"Row {number}: no PDF named in 'file'; skipped.")
+            stats['failed'] += 1
+            continue
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logger.warning(f"Row {number}: {e}")
+            stats['failed'] += 1
+            continue
+        key = _progress_key(number, row_file, st)
+        if key in done and app.store.file_in_use(f"{done[key]}.pdf"):
+            stats['skipped'] += 1
+            continue
+        todo.append((number, row, path, key))
+
+    pending = []   # [(temp path, book record)]
+    start = time.perf_counter()
+
+    def commit():
+        _write_progress(progress_path, [
+            {'key': book['import_key'], 'sha256': book['sha256'],
+             'pending': book['uploaded_at'].isoformat()} for _, book in pending], sync=True)
+        app.store_uploads(pending)
+        _write_progress(progress_path, [{'key': book['import_key'], 'sha256': book['sha256']}
+                                        for _, book in pending])
+        stats['added'] += len(pending)
+        pending.clear()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=app.worker_context()) as pool:
+            results = pool.map(_ingest_file, [path for _, _, path, _ in todo],
+                               [app.EXTRACT_ENABLED] * len(todo), chunksize=8)
+            for (number, row, path, key), result in zip(todo, results):
+                if 'error' in result:
+                    logger.warning(f"Row {number}: {path}: {result['error']}")
+                    stats['failed'] += 1
+                    continue
+                stats['files'] += 1
+                stats['bytes'] += result['size']
+                pending.append((result['tmp_path'],
+                                _book_record(row, path, result, user['id'], key)))
+                if batch and len(pending) >= batch:
+                    commit()
+                    elapsed = time.perf_counter() - start
+                    logger.info(f"{stats['added']} books added, {stats['files'] / elapsed:.1f} files/s")
+            if pending:
+                commit()
+    finally:
+        for tmp_path, _ in pending:   # files of a batch that never got committed
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+    stats['seconds'] = time.perf_counter() - start
+    app.flush_counters()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pdf_dir', help='directory the manifest paths are relative to')
+    parser.add_argument('manifest', help='CSV (with header) or JSON Lines file, one book per row')
+    parser.add_argument('--uploader', default='admin',
+                        help='username recorded as the uploader (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='commit every N books (default: everything in one commit)')
+    args = parser.parse_args(argv)
+
+    app.init_app(serve=False)
+    logging.getLogger().setLevel(logging.INFO)
+    stats = ingest(args.pdf_dir, args.manifest, args.uploader, args.workers, args.batch)
+    seconds = max(stats['seconds'], 1e-9)
+    print(f"added {stats['added']} books, skipped {stats['skipped']} already imported, "
+          f"{stats['failed']} failed")
+    print(f"read {stats['files']} files ({stats['bytes'] / 2**20:.1f} MB) in {seconds:.1f}s: "
+          f"{stats['files'] / seconds:.1f} files/s, {stats['bytes'] / 2**20 / seconds:.1f} MB/s")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
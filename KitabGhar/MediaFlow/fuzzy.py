@@ -0,0 +1,137 @@
+"""Typo-tolerant title and author search over character trigrams.
+
+TrigramIndex keeps the vocabulary of words in book titles and authors, each
+word with the books using it, plus an index from trigram to words. A query
+word is padded ('  premchnd ') and cut into trigrams. Vocabulary words
+sharing enough trigrams with it count as matches, scored by the Dice
+coefficient of the two trigram sets. "premchnd" against "premchand" shares 7
+of 9 and 10 trigrams, for 0.74.
+
+Matching runs against the vocabulary, not every book, so its cost follows
+the number of distinct words. Book scores add up each query word's best
+(similarity x field weight). Only the top k are kept, with a bounded heap.
+
+The index is not thread-safe by itself. The memory engine changes it under
+_index_write() and reads it through _consistent_read(), like its other
+indexes.
+"""
+import os
+import heapq
+import re
+
+TOKEN_RE = re.compile(r'\w+')
+DEFAULT_FIELDS = (('title', 3), ('author', 2))
+# minimum Dice similarity for a word to match, and how many books to return
+DEFAULT_THRESHOLD = float(os.environ.get('FUZZY_THRESHOLD', 0.5))
+DEFAULT_LIMIT = int(os.environ.get('FUZZY_LIMIT', 100))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Words of the indexed fields -> books, searchable by trigram similarity."""
+
+    def __init__(self, fields=DEFAULT_FIELDS):
+        self.fields = fields
+        self._words = {}   # {word: {book_id: weight}}
+        self._grams = {}   # {trigram: {word, ...}}
+        self._sizes = {}   # {word: number of trigrams}
+
+    def __len__(self):
+        return len(self._words)
+
+    def _book_words(self, book):
+        weights = {}
+        for field, weight in self.fields:
+            for word in tokenize(book.get(field)):
+                weights[word] = max(weights.get(word, 0), weight)
+        return weights
+
+    def add(self, book):
+        book_id = book['id']
+        for word, weight in self._book_words(book).items():
+            postings = self._words.get(word)
+            if postings is None:
+                postings = self._words[word] = {}
+                grams = trigrams(word)
+                self._sizes[word] = len(grams)
+                for gram in grams:
+                    self._grams.setdefault(gram, set()).add(word)
+            postings[book_id] = weight
+
+    def add_many(self, books):
+        for book in books:
+            self.add(book)
+
+    def remove(self, book):
+        book_id = book['id']
+        for word in self._book_words(book):
+            postings = self._words.get(word)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if postings:
+                continue
+            del self._words[word]
+            del self._sizes[word]
+            for gram in trigrams(word):
+                words = self._grams.get(gram)
+                if words is not None:
+                    words.discard(word)
+                    if not words:
+                        del self._grams[gram]
+
+    def clear(self):
+        self._words.clear()
+        self._grams.clear()
+        self._sizes.clear()
+
+    def similar_words(self, term, threshold=DEFAULT_THRESHOLD):
+        """{word: similarity} for vocabulary words at least `threshold` alike."""
+        grams = trigrams(term)
+        shared = {}
+        for gram in grams:
+            for word in self._grams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        n = len(grams)
+        # Dice >= threshold needs 2 * shared >= threshold * (n + size)
+        found = {}
+        for word, count in shared.items():
+            score = 2 * count / (n + self._sizes[word])
+            if score >= threshold:
+                found[word] = score
+        return found
+
+    def search(self, query, k=DEFAULT_LIMIT, threshold=DEFAULT_THRESHOLD, accept=None):
+        """Top-k [(score, book_id)], best first; every query word must match.
+
+        accept, if given, is called with a book id to filter candidates
+        (e.g. by category) before they are ranked.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        scores = None
+        for term in terms:
+            best = {}
+            for word, similarity in self.similar_words(term, threshold).items():
+                for book_id, weight in self._words[word].items():
+                    score = similarity * weight
+                    if score > best.get(book_id, 0):
+                        best[book_id] = score
+            if scores is None:
+                scores = best
+            else:
+                scores = {b: s + best[b] for b, s in scores.items() if b in best}
+            if not scores:
+                return []
+        candidates = ((s, b) for b, s in scores.items() if accept is None or accept(b))
+        # ties go to the newer (higher) id, as in the exact search
+        return heapq.nlargest(k, candidates)
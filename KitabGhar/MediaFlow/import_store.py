@@ -0,0 +1,52 @@
+"""Copy the JSON snapshot + journal into a SQLite database.
+
+Run from the app directory (where data_store.json lives), with the app
+stopped:
+
+    python import_store.py [--db kitabghar.db]
+
+The snapshot and journal are loaded exactly as the memory engine would at
+startup, then every user and book is written to the database in one
+transaction, keeping their ids. The target database must not already hold
+records. Afterwards start the app with STORAGE_BACKEND=sqlite.
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['EXTRACT_ENABLED'] = '0'
+
+import app  # noqa: E402
+from sqlite_store import SQLiteStore  # noqa: E402
+
+
+def import_store(db_path):
+    target = SQLiteStore(db_path)
+    target.load()
+    if target.count_users() or target.count_books():
+        raise SystemExit(f"{db_path} already holds records; refusing to import over them")
+    # the trend scores come over as they are, so they count from the same epoch
+    target.rebase_trends(target.trend_epoch(), app.store.trend_epoch())
+    target.import_records(app.users_db.values(), app.books_db.values())
+    target.checkpoint()
+    return target.count_users(), target.count_books()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=app.SQLITE_PATH,
+                        help='SQLite database to create (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    app.init_app(serve=False)
+    start = time.perf_counter()
+    users, books = import_store(args.db)
+    print(f"imported {users} users and {books} books into {args.db} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,9 @@
-from app import app
+from app import app, init_app
+
+# Process pool workers (see app.worker_context()) import the main module
+# again as __mp_main__; only the serving process starts the app.
+if __name__ != '__mp_main__':
+    init_app()
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,212 @@
+"""In-process metrics in Prometheus text format, plus a sampling profiler.
+
+Counters, gauges and histograms live in a module-level registry and are
+rendered by render() for the app's /metrics endpoint. Updates take one small
+lock per metric. Histograms keep per-bucket counts over fixed bounds, so an
+observation is a bisect and an increment.
+
+With METRICS_ENABLED=0 instrumentation is meant to disappear, not just get
+cheap. timed() hands back the undecorated function, the app skips
+registering its request and template hooks, and the remaining call sites
+test ENABLED first.
+
+Every process keeps its own registry. Behind several gunicorn workers each
+scrape shows the worker that answered, labelled with its pid in
+kitabghar_process_info.
+
+StackSampler is the optional profiler. A daemon thread reads every other
+thread's stack at a fixed interval and counts the stacks in the folded
+format that flamegraph.pl and speedscope read.
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+from functools import wraps
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# seconds; wide enough for a search over a large catalog or a slow snapshot write
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}   # {label values: value}
+        _registry.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}'
+                                 for k, v in items]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; with fn=, read from fn() at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labels=(), fn=None):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def inc(self, labels=(), n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def dec(self, labels=(), n=1):
+        self.inc(labels, -n)
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                self.set(self.fn())
+            except Exception:
+                return []
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (last one is +Inf), then sum and count
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self._header()
+        bounds = self.buckets + (float('inf'),)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-2])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {state[-1]}')
+        return lines
+
+
+def timed(histogram, labels=()):
+    """Decorator observing the call's duration; a no-op when metrics are disabled."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    """The whole registry in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class StackSampler(threading.Thread):
+    """Samples every thread's stack each `interval` seconds into folded-stack counts."""
+
+    MAX_DEPTH = 64
+
+    def __init__(self, interval, max_stacks=10000):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stacks = {}   # {'outer;...;inner': samples}
+
+    @staticmethod
+    def _fold(frame, depth):
+        names = []
+        while frame is not None and len(names) < depth:
+            code = frame.f_code
+            names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            me = threading.get_ident()
+            stacks = [self._fold(frame, self.MAX_DEPTH)
+                      for ident, frame in sys._current_frames().items() if ident != me]
+            with self._lock:
+                self.samples += 1
+                for stack in stacks:
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def folded(self):
+        """The samples so far, one 'stack count' line each, busiest first."""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
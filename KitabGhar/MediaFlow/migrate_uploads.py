@@ -0,0 +1,82 @@
+"""Move flat uploads/<name>.pdf files into the sharded uploads/ab/cd/ layout.
+
+Run from the app directory (where data_store.json lives), with the same
+STORAGE_BACKEND the app uses:
+
+    python migrate_uploads.py [--dry-run]
+
+Each book is handled on its own: its file is renamed into place, then its
+'filename' is rewritten through app.update_book(). An interrupted run can simply
+be started again; books already pointing at a sharded path are skipped and
+files that were moved without their record being updated are picked up.
+
+The app keeps serving while files move, since resolve_upload() finds a flat
+filename at either location.
+"""
+import os
+import sys
+import argparse
+import logging
+
+import app
+
+logger = logging.getLogger('migrate_uploads')
+
+
+def migrate(dry_run=False):
+    upload_dir = app.app.config['UPLOAD_FOLDER']
+    moved = updated = skipped = missing = 0
+
+    for book in app.recent_books():
+        filename = book.get('filename', '')
+        if not filename or '/' in filename:
+            skipped += 1
+            continue
+        sharded = app.shard_name(filename)
+        src = os.path.join(upload_dir, filename)
+        dst = os.path.join(upload_dir, sharded)
+
+        if os.path.exists(src):
+            if not dry_run:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)
+            moved += 1
+        elif not os.path.exists(dst):
+            logger.warning(f"Book {book['id']}: {filename} not found, left as is.")
+            missing += 1
+            continue
+
+        if not dry_run:
+            app.update_book(book['id'], filename=sharded)
+        updated += 1
+
+    referenced = {os.path.basename(b.get('filename', '')) for b in app.recent_books()}
+    orphans = [name for name in os.listdir(upload_dir)
+               if name.endswith('.pdf') and name not in referenced]
+
+    if not dry_run:
+        app.flush_counters()
+        app.store.checkpoint()
+    return {'moved': moved, 'updated': updated, 'skipped': skipped,
+            'missing': missing, 'orphans': len(orphans)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would change without touching anything')
+    args = parser.parse_args(argv)
+
+    app.init_app(serve=False)
+    logging.getLogger().setLevel(logging.INFO)
+    result = migrate(dry_run=args.dry_run)
+    print(f"moved {result['moved']} files, updated {result['updated']} records, "
+          f"{result['skipped']} already sharded, {result['missing']} missing")
+    if result['orphans']:
+        print(f"{result['orphans']} flat PDFs in {app.app.config['UPLOAD_FOLDER']} "
+              f"are not referenced by any book and were left in place")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,505 @@
+"""Best-effort PDF page count, metadata and text extraction.
+
+Pure standard library so it runs offline and inside worker processes. It
+understands plain and FlateDecode streams, object streams, the document
+Info dictionary and the text-showing operators of content streams.
+
+Uploads are untrusted, so the file is memory-mapped rather than read, and
+only the streams text extraction needs are inflated: object streams, page
+content streams (with the forms they draw) and ToUnicode maps. Images and
+embedded fonts are never decompressed. Each stream inflates to at most
+MAX_STREAM_BYTES and a document to at most MAX_INFLATE_BYTES in all. Past
+that, what was extracted so far is returned.
+
+Text is decoded through each font's ToUnicode map. Text in fonts without
+one is skipped, since its bytes are glyph ids or a font-specific encoding
+that would only add garbage to the search index.
+"""
+import bisect
+import mmap
+import re
+import zlib
+
+MAX_TEXT_CHARS = 200_000
+MAX_STREAM_BYTES = 8 * 2**20    # inflated size of any one stream
+MAX_INFLATE_BYTES = 64 * 2**20  # inflated size of all streams of a document
+MAX_FORM_DEPTH = 4              # forms drawn by forms drawn by a page
+_READ_CHUNK = 2**20             # compressed bytes handed to zlib at a time
+
+META_KEYS = ('Title', 'Author', 'Subject', 'Keywords', 'Creator', 'Producer',
+             'CreationDate', 'ModDate')
+
+_OBJ_RE = re.compile(rb'(\d+)\s+\d+\s+obj\b')
+_STREAM_RE = re.compile(rb'stream(?:\r\n|\n|\r)')
+_LENGTH_RE = re.compile(rb'/Length\s+(\d+)(?!\s+\d+\s+R)')
+_COUNT_RE = re.compile(rb'/Count\s+(\d+)')
+_INFO_RE = re.compile(rb'/Info\s+(\d+)\s+\d+\s+R')
+_REF_RE = re.compile(rb'(\d+)\s+\d+\s+R')
+_NAMED_REF_RE = re.compile(rb'/([^\s/<>\[\]()]+)\s*(\d+)\s+\d+\s+R')
+_PAGES_TYPE_RE = re.compile(rb'/Type\s*/Pages(?![A-Za-z])')
+_PAGE_TYPE_RE = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+_OBJSTM_RE = re.compile(rb'/Type\s*/ObjStm(?![A-Za-z])')
+_FORM_RE = re.compile(rb'/Subtype\s*/Form(?![A-Za-z])')
+_TEXT_BLOCK_RE = re.compile(rb'(?<![A-Za-z])BT(?![A-Za-z])(.*?)(?<![A-Za-z])ET(?![A-Za-z])', re.S)
+_TEXT_TOKEN_RE = re.compile(rb'/[^\s/\[\]()<>{}%]+|\(|<[0-9A-Fa-f\s]*>|\[|\]|-?\d*\.?\d+|T[Jj*dDf]|\'|"')
+_SET_FONT_RE = re.compile(rb'/([^\s/\[\]()<>{}%]+)\s+[-+]?\d*\.?\d+\s+Tf')
+_DO_RE = re.compile(rb'/([^\s/\[\]()<>{}%]+)\s+Do(?![A-Za-z])')
+_HEX_RE = re.compile(rb'<([0-9A-Fa-f\s]*)>')
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def _read_literal(data, pos):
+    """Parse a literal string starting at the '(' at `pos`.
+
+    Returns (bytes, index just past the closing paren).
+    """
+    out = bytearray()
+    depth = 1
+    i = pos + 1
+    n = len(data)
+    while i < n:
+        c = data[i:i + 1]
+        if c == b'\\':
+            nxt = data[i + 1:i + 2]
+            if nxt in _ESCAPES:
+                out += _ESCAPES[nxt]
+                i += 2
+            elif nxt.isdigit():
+                m = re.match(rb'[0-7]{1,3}', data[i + 1:i + 4])
+                if m:
+                    out.append(int(m.group(), 8) & 0xFF)
+                i += 1 + (len(m.group()) if m else 1)
+            elif nxt in (b'\r', b'\n'):
+                i += 2
+                if nxt == b'\r' and data[i:i + 1] == b'\n':
+                    i += 1
+            else:
+                out += nxt
+                i += 2
+            continue
+        if c == b'(':
+            depth += 1
+        elif c == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(out), i + 1
+        out += c
+        i += 1
+    return bytes(out), n
+
+
+def _hex_bytes(digits):
+    digits = re.sub(rb'\s', b'', digits)
+    try:
+        return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode())
+    except ValueError:
+        return b''
+
+
+def _decode_string(raw):
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', 'ignore')
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return raw[3:].decode('utf-8', 'ignore')
+    return raw.decode('latin-1')
+
+
+def _printable(text):
+    """Keep metadata that looks like real characters, drop binary noise."""
+    if not text:
+        return ''
+    good = sum(1 for ch in text if ch.isprintable() or ch.isspace())
+    return text if good >= 0.9 * len(text) else ''
+
+
+def _dict_at(data, pos):
+    """The '<< ... >>' dictionary starting at `pos`, nested ones included."""
+    depth = 0
+    i = pos
+    while i < len(data) - 1:
+        pair = data[i:i + 2]
+        if pair == b'<<':
+            depth += 1
+            i += 2
+        elif pair == b'>>':
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return data[pos:i]
+        else:
+            i += 1
+    return data[pos:]
+
+
+class _ToUnicode:
+    """A font's ToUnicode CMap: character codes to text."""
+
+    def __init__(self, cmap):
+        self.chars = {}    # {(code length, code): text}
+        self.ranges = {}   # {code length: sorted [(first code, last code, text or [texts])]}
+        lengths = set()
+        for block in re.findall(rb'begincodespacerange(.*?)endcodespacerange', cmap, re.S):
+            lengths.update(len(_hex_bytes(lo)) for lo in _HEX_RE.findall(block)[0::2])
+        for block in re.findall(rb'beginbfchar(.*?)endbfchar', cmap, re.S):
+            codes = _HEX_RE.findall(block)
+            for src, dst in zip(codes[0::2], codes[1::2]):
+                src = _hex_bytes(src)
+                self.chars[(len(src), int.from_bytes(src, 'big'))] = _utf16(dst)
+                lengths.add(len(src))
+        for block in re.findall(rb'beginbfrange(.*?)endbfrange', cmap, re.S):
+            for m in re.finditer(rb'<([0-9A-Fa-f\s]*)>\s*<([0-9A-Fa-f\s]*)>\s*(<[^>]*>|\[[^\]]*\])', block):
+                lo, hi = _hex_bytes(m.group(1)), _hex_bytes(m.group(2))
+                dst = m.group(3)
+                if dst.startswith(b'['):
+                    dst = [_utf16(d) for d in _HEX_RE.findall(dst)]
+                else:
+                    dst = _utf16(dst[1:-1])
+                self.ranges.setdefault(len(lo), []).append(
+                    (int.from_bytes(lo, 'big'), int.from_bytes(hi, 'big'), dst))
+                lengths.add(len(lo))
+        for ranges in self.ranges.values():
+            ranges.sort(key=lambda r: r[0])
+        self._firsts = {n: [r[0] for r in ranges] for n, ranges in self.ranges.items()}
+        self.lengths = sorted(n for n in lengths if 0 < n <= 4)
+
+    def _lookup(self, n, code):
+        text = self.chars.get((n, code))
+        if text is not None:
+            return text
+        ranges = self.ranges.get(n)
+        if not ranges:
+            return None
+        i = bisect.bisect_right(self._firsts[n], code) - 1
+        if i < 0 or code > ranges[i][1]:
+            return None
+        first, _, dst = ranges[i]
+        if isinstance(dst, list):
+            return dst[code - first] if code - first < len(dst) else None
+        if not dst or ord(dst[-1]) + code - first > 0x10FFFF:
+            return None
+        return dst[:-1] + chr(ord(dst[-1]) + code - first)
+
+    def decode(self, raw):
+        out = []
+        i = 0
+        while i < len(raw):
+            for n in self.lengths:
+                text = self._lookup(n, int.from_bytes(raw[i:i + n], 'big'))
+                if text is not None:
+                    out.append(text)
+                    i += n
+                    break
+            else:
+                i += self.lengths[0] if self.lengths else len(raw)
+        return ''.join(out)
+
+
+def _utf16(digits):
+    raw = _hex_bytes(digits)
+    try:
+        return raw.decode('utf-16-be')
+    except UnicodeDecodeError:
+        return raw.decode('utf-16-be', 'ignore')
+
+
+class _Document:
+    """The objects of a mapped PDF, with streams inflated on demand under the caps."""
+
+    def __init__(self, data, max_inflate=MAX_INFLATE_BYTES):
+        self.data = data
+        self.budget = max_inflate
+        self.objects = {}   # {object number: (dictionary bytes, (start, end) of raw stream or None)}
+        self._fonts = {}    # {font object number: _ToUnicode or None}
+        self._scan()
+
+    @property
+    def exhausted(self):
+        return self.budget <= 0
+
+    def _scan(self):
+        data = self.data
+        pos = 0
+        while True:
+            m = _OBJ_RE.search(data, pos)
+            if not m:
+                break
+            start = m.end()
+            end = data.find(b'endobj', start)
+            if end == -1:
+                end = len(data)
+            s = _STREAM_RE.search(data, start, end)
+            if s is None:
+                self.objects[int(m.group(1))] = (data[start:end], None)
+                pos = end + 6
+                continue
+            head = data[start:s.start()]
+            length = _LENGTH_RE.search(head)
+            stream_end = s.end() + int(length.group(1)) if length else -1
+            if not length or stream_end > len(data):
+                stream_end = data.find(b'endstream', s.end())
+                if stream_end == -1:
+                    stream_end = len(data)
+            self.objects[int(m.group(1))] = (head, (s.end(), stream_end))
+            end = data.find(b'endobj', stream_end)
+            pos = len(data) if end == -1 else end + 6
+
+        # Objects packed into object streams (PDF 1.5+).
+        for num, (head, span) in list(self.objects.items()):
+            if span is None or not _OBJSTM_RE.search(head):
+                continue
+            stream = self.stream(num)
+            first = re.search(rb'/First\s+(\d+)', head)
+            count = re.search(rb'/N\s+(\d+)', head)
+            if not stream or not first or not count:
+                continue
+            first = int(first.group(1))
+            nums = [int(x) for x in stream[:first].split() if x.isdigit()]
+            pairs = list(zip(nums[0::2], nums[1::2]))[:int(count.group(1))]
+            for idx, (obj, offset) in enumerate(pairs):
+                end = first + pairs[idx + 1][1] if idx + 1 < len(pairs) else len(stream)
+                self.objects.setdefault(obj, (stream[first + offset:end], None))
+
+    def head(self, num):
+        obj = self.objects.get(num)
+        return obj[0] if obj else b''
+
+    def stream(self, num):
+        """The decoded stream of object `num`, cut at the caps; None if it cannot be read."""
+        head, span = self.objects.get(num, (b'', None))
+        if span is None or self.exhausted:
+            return None
+        limit = min(MAX_STREAM_BYTES, self.budget)
+        start, end = span
+        if b'/Filter' not in head:
+            out = self.data[start:min(end, start + limit)]
+        elif b'/FlateDecode' in head and b'/DCTDecode' not in head:
+            out = self._inflate(start, end, limit)
+        else:
+            return None   # other filters: images and binary data
+        self.budget -= len(out)
+        return out or None
+
+    def _inflate(self, start, end, limit):
+        """Inflate data[start:end] to at most `limit` bytes, keeping what a corrupt stream yields."""
+        inflater = zlib.decompressobj()
+        pieces, size = [], 0
+        for pos in range(start, end, _READ_CHUNK):
+            try:
+                piece = inflater.decompress(self.data[pos:min(pos + _READ_CHUNK, end)], limit - size)
+            except zlib.error:
+                break
+            pieces.append(piece)
+            size += len(piece)
+            if size >= limit or inflater.eof:
+                break
+        return b''.join(pieces)
+
+    def entry(self, head, key):
+        """A dictionary entry that is itself a dictionary, following a reference to it."""
+        m = re.search(rb'/' + key + rb'\s*(?:(\d+)\s+\d+\s+R|(<<))', head)
+        if not m:
+            return None
+        if m.group(2):
+            return _dict_at(head, m.start(2))
+        return self.head(int(m.group(1)))
+
+    def refs(self, head, key):
+        """Object numbers of an entry holding one reference or an array of them."""
+        m = re.search(rb'/' + key + rb'\s*(?:(\d+)\s+\d+\s+R|\[([^\]]*)\])', head)
+        if not m:
+            return []
+        if m.group(1):
+            num = int(m.group(1))
+            target, span = self.objects.get(num, (b'', None))
+            if span is None and target.lstrip().startswith(b'['):
+                return [int(r) for r in _REF_RE.findall(target)]   # an indirect array
+            return [num]
+        return [int(r) for r in _REF_RE.findall(m.group(2))]
+
+    def font(self, num):
+        """The _ToUnicode of a font object, or None when it has none."""
+        if num not in self._fonts:
+            cmap = None
+            m = re.search(rb'/ToUnicode\s+(\d+)\s+\d+\s+R', self.head(num))
+            if m:
+                stream = self.stream(int(m.group(1)))
+                if stream:
+                    cmap = _ToUnicode(stream)
+                    cmap = cmap if cmap.lengths else None
+            self._fonts[num] = cmap
+        return self._fonts[num]
+
+    def fonts(self, resources):
+        """{resource name: _ToUnicode or None} for a /Resources dictionary."""
+        fonts = self.entry(resources, rb'Font') or b''
+        return {name: self.font(int(num)) for name, num in _NAMED_REF_RE.findall(fonts)}
+
+    def contents(self, page):
+        """A page's content streams, which are one stream split up."""
+        return b'\n'.join(filter(None, (self.stream(num) for num in self.refs(page, rb'Contents'))))
+
+    def pages(self):
+        """[(page dictionary, its /Resources)] in page-tree order."""
+        roots = [num for num, (head, _) in sorted(self.objects.items())
+                 if _PAGES_TYPE_RE.search(head) and b'/Parent' not in head]
+        found, seen = [], set()
+        stack = [(num, b'') for num in reversed(roots)]
+        while stack:
+            num, inherited = stack.pop()
+            if num in seen:
+                continue
+            seen.add(num)
+            head = self.head(num)
+            resources = self.entry(head, rb'Resources') or inherited
+            if _PAGES_TYPE_RE.search(head):
+                stack.extend((kid, resources) for kid in reversed(self.refs(head, rb'Kids')))
+            elif _PAGE_TYPE_RE.search(head):
+                found.append((head, resources))
+        if not found:
+            found = [(head, self.entry(head, rb'Resources') or b'')
+                     for _, (head, _) in sorted(self.objects.items()) if _PAGE_TYPE_RE.search(head)]
+        return found
+
+
+def _page_count(objects):
+    counts = []
+    singles = 0
+    for head, _ in objects.values():
+        if _PAGES_TYPE_RE.search(head):
+            if b'/Parent' not in head:
+                m = _COUNT_RE.search(head)
+                if m:
+                    counts.append(int(m.group(1)))
+        elif _PAGE_TYPE_RE.search(head):
+            singles += 1
+    return max(counts) if counts else (singles or None)
+
+
+def _metadata(data, objects):
+    refs = _INFO_RE.findall(data)
+    if not refs:
+        refs = [m.group(1) for head, _ in objects.values() for m in [_INFO_RE.search(head)] if m]
+    for ref in reversed(refs):
+        info = objects.get(int(ref))
+        if info is None:
+            continue
+        meta = {}
+        head = info[0]
+        for key in META_KEYS:
+            m = re.search(rb'/' + key.encode() + rb'\s*([(<])', head)
+            if not m:
+                continue
+            if m.group(1) == b'(':
+                raw, _ = _read_literal(head, m.start(1))
+            else:
+                end = head.find(b'>', m.start(1))
+                raw = _hex_bytes(head[m.start(1) + 1:end])
+                if not raw:
+                    continue
+            value = _printable(_decode_string(raw).strip())
+            if value:
+                meta[key.lower()] = value
+        return meta
+    return {}
+
+
+def _content_text(stream, fonts):
+    """Pull the strings shown by Tj/TJ/'/" operators out of a content stream.
+
+    `fonts` maps the resource names Tf selects to their _ToUnicode; strings
+    shown in a font without one are dropped.
+    """
+    parts = []
+    font = None
+    pos = 0
+    for block in _TEXT_BLOCK_RE.finditer(stream):
+        # the font is graphics state, so it may be chosen outside BT/ET
+        for m in _SET_FONT_RE.finditer(stream, pos, block.start()):
+            font = fonts.get(m.group(1))
+        pos = block.end()
+        body = block.group(1)
+        operands = []
+        in_array = False
+        name = None
+        at = 0
+        while True:
+            m = _TEXT_TOKEN_RE.search(body, at)
+            if not m:
+                break
+            tok = m.group()
+            at = m.end()
+            if tok.startswith(b'/'):
+                name = tok[1:]
+            elif tok == b'Tf':
+                font = fonts.get(name)
+            elif tok == b'(':
+                raw, at = _read_literal(body, m.start())
+                operands.append(font.decode(raw) if font else '')
+            elif tok.startswith(b'<'):
+                operands.append(font.decode(_hex_bytes(tok[1:-1])) if font else '')
+            elif tok == b'[':
+                operands = []
+                in_array = True
+            elif tok == b']':
+                in_array = False
+            elif tok in (b'Tj', b"'", b'"', b'TJ'):
+                if tok in (b"'", b'"'):
+                    parts.append('\n')
+                parts.append(''.join(operands))
+                operands = []
+            elif tok in (b'Td', b'TD', b'T*'):
+                parts.append('\n')
+                operands = []
+            elif in_array and font and float(tok) < -250:
+                operands.append(' ')
+        parts.append('\n')
+    return ''.join(parts)
+
+
+def _page_text(doc, stream, resources, depth=0):
+    """Text shown by a page's content stream and by the forms it draws."""
+    text = [_content_text(stream, doc.fonts(resources))] if b'BT' in stream else []
+    if depth < MAX_FORM_DEPTH and b'Do' in stream:
+        xobjects = doc.entry(resources, rb'XObject') or b''
+        named = dict(_NAMED_REF_RE.findall(xobjects))
+        for name in dict.fromkeys(_DO_RE.findall(stream)):
+            num = named.get(name)
+            form = doc.head(int(num)) if num else b''
+            if not _FORM_RE.search(form):
+                continue
+            content = doc.stream(int(num))
+            if content:
+                form_resources = doc.entry(form, rb'Resources') or resources
+                text.append(_page_text(doc, content, form_resources, depth + 1))
+    return ''.join(text)
+
+
+def extract(path, max_text_chars=MAX_TEXT_CHARS):
+    """Extract {'pages', 'meta', 'text'} from the PDF at `path`."""
+    with open(path, 'rb') as f:
+        if f.read(4) != b'%PDF':
+            raise ValueError('not a PDF file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _extract(data, max_text_chars)
+
+
+def _extract(data, max_text_chars):
+    doc = _Document(data)
+    result = {'pages': _page_count(doc.objects), 'meta': {}, 'text': ''}
+    if re.search(rb'/Encrypt\s+\d+\s+\d+\s+R', data):
+        result['encrypted'] = True
+        return result
+
+    result['meta'] = _metadata(data, doc.objects)
+    chunks = []
+    size = 0
+    for page, resources in doc.pages():
+        text = _page_text(doc, doc.contents(page), resources)
+        if text.strip():
+            chunks.append(text)
+            size += len(text)
+        if size >= max_text_chars or doc.exhausted:
+            break
+    text = re.sub(r'[ \t]+', ' ', ''.join(chunks))
+    result['text'] = re.sub(r'\n\s*\n+', '\n', text).strip()[:max_text_chars]
+    return result
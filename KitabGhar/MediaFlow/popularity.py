@@ -0,0 +1,200 @@
+"""Time-decayed popularity: the "most read" and "most downloaded" shelves.
+
+Each read or download adds weight(now) to the book's views_trend or
+downloads_trend. Weights double every HALF_LIFE seconds after EPOCH
+("forward decay"), so score / weight(now) is the book's event count with
+every event halved for each HALF_LIFE of age. All books are divided by the
+same weight(now), so an event only moves its own book in the order, and no
+score is ever recomputed as time passes. Scores are plain sums. Their
+increments are buffered and journaled like the views/downloads counters.
+
+Ranking keeps the books with a score in sorted key lists, one overall and
+one per category, so the top k is a slice. The lists are split into runs of
+at most a few hundred keys. Moving a book after an event is then a bisect
+over the run maxima and one within a run, and the list shifts stay the size
+of a run, not of the catalog. Like the other in-memory indexes, a Ranking is
+not thread-safe by itself. Writers are serialized by the caller. A reader
+racing a move may miss that one book for that read.
+
+Weights leave float range about 1000 half-lives after the epoch they are
+counted from, which is only 41 days at a half-life of an hour. So the epoch
+moves: once it is REBASE_AFTER half-lives old, rebased() moves it forward by
+a whole number of half-lives and every stored score is multiplied by
+rescale(), an exact power of two. Scores that would be subnormal just become
+0. The stores keep the current epoch with the scores, and increments are
+passed along with the epoch they were counted from. EPOCH is the epoch of a
+store that has never been rebased.
+"""
+import bisect
+import math
+import os
+import time
+
+# counter field -> its time-decayed score field
+TREND_FIELDS = {'views': 'views_trend', 'downloads': 'downloads_trend'}
+HALF_LIFE = float(os.environ.get('TRENDING_HALF_LIFE', 7 * 24 * 3600))   # seconds
+EPOCH = 1767225600   # 2026-01-01 UTC
+REBASE_AFTER = 64    # half-lives; weights then stay below 2**64
+
+
+def weight(now=None, epoch=EPOCH):
+    """What one event at `now` (default: the current time) adds to a score
+    counted from `epoch`. OverflowError once the epoch is far too old."""
+    if now is None:
+        now = time.time()
+    return 2.0 ** ((now - epoch) / HALF_LIFE)
+
+
+def decayed(score, now=None, epoch=EPOCH):
+    """A stored score as a count of events, each decayed to `now`."""
+    if now is None:
+        now = time.time()
+    return score * 2.0 ** ((epoch - now) / HALF_LIFE)
+
+
+def rebased(epoch, now=None):
+    """The epoch to count from at `now`: `epoch`, or once it is REBASE_AFTER
+    half-lives old, the last whole half-life after it."""
+    if now is None:
+        now = time.time()
+    lives = int((now - epoch) // HALF_LIFE)
+    return epoch + lives * HALF_LIFE if lives >= REBASE_AFTER else epoch
+
+
+def rescale(old, new):
+    """What to multiply a score counted from epoch `old` by to count it from `new`."""
+    return math.ldexp(1.0, round((old - new) / HALF_LIFE))
+
+
+class _SortedKeys:
+    """A sorted list kept as runs of at most 2 * LOAD keys."""
+
+    LOAD = 256
+
+    def __init__(self, keys=()):
+        self.reset(keys)
+
+    def __len__(self):
+        return sum(len(run) for run in self._runs)
+
+    def __bool__(self):
+        return bool(self._runs)   # runs are never left empty
+
+    def reset(self, keys):
+        """Replace the contents with `keys`, which must already be sorted."""
+        keys = list(keys)
+        self._runs = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [run[-1] for run in self._runs]
+
+    def add(self, key):
+        runs, maxes = self._runs, self._maxes
+        if not runs:
+            runs.append([key])
+            maxes.append(key)
+            return
+        i = min(bisect.bisect_left(maxes, key), len(runs) - 1)
+        run = runs[i]
+        bisect.insort(run, key)
+        maxes[i] = run[-1]
+        if len(run) > 2 * self.LOAD:
+            # trim before inserting the tail, so a reader never sees a key twice
+            tail = run[self.LOAD:]
+            del run[self.LOAD:]
+            maxes[i] = run[-1]
+            runs.insert(i + 1, tail)
+            maxes.insert(i + 1, tail[-1])
+
+    def discard(self, key):
+        runs, maxes = self._runs, self._maxes
+        i = bisect.bisect_left(maxes, key)
+        if i == len(runs):
+            return
+        run = runs[i]
+        j = bisect.bisect_left(run, key)
+        if j < len(run) and run[j] == key:
+            del run[j]
+            if run:
+                maxes[i] = run[-1]
+            else:
+                del runs[i]
+                del maxes[i]
+
+    def head(self, k):
+        """The k smallest keys."""
+        found = []
+        for run in self._runs:
+            if len(found) >= k:
+                break
+            found.extend(run[:k - len(found)])
+        return found
+
+
+class Ranking:
+    """Books with a non-zero `field`, highest first, overall and per category."""
+
+    def __init__(self, field):
+        self.field = field
+        self._all = _SortedKeys()   # (-score, -book_id); ties go to the newer book
+        self._by_category = {}      # {category: _SortedKeys of the same}
+        self._placed = {}           # {book_id: (key, category)} as last placed
+
+    def __len__(self):
+        return len(self._placed)
+
+    def _key(self, book):
+        score = book.get(self.field) or 0
+        return (-score, -book['id']) if score > 0 else None
+
+    def update(self, book):
+        """Move a book to where its current score and category put it."""
+        key = self._key(book)
+        category = book.get('category') or ''
+        if self._placed.get(book['id']) == (key, category):
+            return
+        self.remove(book['id'])
+        if key is None:
+            return
+        self._all.add(key)
+        keys = self._by_category.get(category)
+        if keys is None:
+            keys = self._by_category[category] = _SortedKeys()
+        keys.add(key)
+        self._placed[book['id']] = (key, category)
+
+    def remove(self, book_id):
+        placed = self._placed.pop(book_id, None)
+        if placed is None:
+            return
+        key, category = placed
+        self._all.discard(key)
+        keys = self._by_category.get(category)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_category[category]
+
+    def rebuild(self, books):
+        """Replace the contents with `books`, sorting once."""
+        self._placed.clear()
+        every, by_category = [], {}
+        for book in books:
+            key = self._key(book)
+            if key is None:
+                continue
+            category = book.get('category') or ''
+            every.append(key)
+            by_category.setdefault(category, []).append(key)
+            self._placed[book['id']] = (key, category)
+        self._all.reset(sorted(every))
+        self._by_category = {category: _SortedKeys(sorted(keys))
+                             for category, keys in by_category.items()}
+
+    def clear(self):
+        self.rebuild(())
+
+    def top(self, k, category=None):
+        """[(score, book_id)] for the k highest scores, best first."""
+        keys = self._all if category is None else self._by_category.get(category)
+        if keys is None:
+            return []
+        return [(-score, -book_id) for score, book_id in keys.head(k)]
@@ -0,0 +1,207 @@
+"""Compact user and book records for the memory store.
+
+A record keeps its common fields in __slots__ instead of a per-record dict.
+Category, author and role strings are interned, so thousands of books share
+one copy of each. created_at/uploaded_at are held as integer epoch seconds
+and only turned into a datetime when read. Any other field (description,
+content_text, pdf_meta, ...) goes in a small side dict.
+
+Records are mutable mappings, so the store, journal and snapshot code keep
+using book['title'], book.get(...), book.update(...) and {**book}, and
+templates keep using book.title and book.uploaded_at.strftime(...).
+
+A record read from a binary snapshot (see snapshot.py) starts with only its
+slots filled. Its side dict is parsed from the snapshot the first time a
+field outside the slots, or the whole record, is used.
+"""
+import sys
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime
+
+_load_lock = threading.Lock()
+
+
+def to_timestamp(value):
+    """Epoch seconds for a datetime or ISO string; anything else is kept as is."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return value
+
+
+def to_datetime(value):
+    return datetime.fromtimestamp(value) if isinstance(value, int) else value
+
+
+class Record(MutableMapping):
+    """Base for slot-backed records; subclasses list their FIELDS and slots."""
+
+    __slots__ = ('_extra', '_spans', '_row')
+
+    FIELDS = ()              # keys kept in slots, in order
+    DATE_FIELD = None        # key read as a datetime ...
+    TS_SLOT = None           # ... but stored in this slot as epoch seconds
+    INTERNED = frozenset()   # keys whose string values are interned
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.SLOT_OF = {key: cls.TS_SLOT if key == cls.DATE_FIELD else key for key in cls.FIELDS}
+
+    def __init__(self, fields=(), **kwargs):
+        self._extra = None
+        self._spans = None
+        self.update(fields, **kwargs)
+
+    @classmethod
+    def from_row(cls, slots, values, spans=None, row=0):
+        """Build a record straight from slot values (used by snapshot.read())."""
+        record = cls.__new__(cls)
+        record._extra = None
+        record._spans = spans
+        record._row = row
+        for slot, value in zip(slots, values):
+            setattr(record, slot, value)
+        return record
+
+    # -- deferred fields ---------------------------------------------------
+    def _load(self):
+        with _load_lock:
+            spans = self._spans
+            if spans is None:
+                return
+            if self._extra is None:
+                self._extra = {}
+            # values set since the snapshot was read win
+            for key, value in spans.fields(self._row).items():
+                self._extra.setdefault(key, value)
+            self._spans = None
+
+    def _extra_for_write(self):
+        if self._extra is None:
+            with _load_lock:
+                if self._extra is None:
+                    self._extra = {}
+        return self._extra
+
+    def unparsed_span(self):
+        """The snapshot bytes behind the deferred fields, if never parsed or added to."""
+        with _load_lock:
+            spans = self._spans
+            if spans is not None and not self._extra:
+                return spans.raw(self._row)
+        return None
+
+    def extra_fields(self):
+        """The fields outside the slots, parsing deferred ones first."""
+        if self._spans is not None:
+            self._load()
+        return self._extra or {}
+
+    # -- mapping protocol --------------------------------------------------
+    def __getitem__(self, key):
+        slot = self.SLOT_OF.get(key)
+        if slot is not None:
+            try:
+                value = getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key) from None
+            return to_datetime(value) if slot == self.TS_SLOT else value
+        return self.extra_fields()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        slot = self.SLOT_OF.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        return key in self.extra_fields()
+
+    def __setitem__(self, key, value):
+        self.update(((key, value),))
+
+    def update(self, other=(), /, **kwargs):
+        # one loop instead of a __setitem__ call per field: records are built
+        # a whole catalog at a time when a JSON snapshot or journal is loaded
+        if isinstance(other, dict):
+            other = other.items()
+        elif hasattr(other, 'keys'):
+            other = [(key, other[key]) for key in other.keys()]
+        slot_of, ts_slot, interned = self.SLOT_OF, self.TS_SLOT, self.INTERNED
+        for pairs in (other, kwargs.items()):
+            for key, value in pairs:
+                slot = slot_of.get(key)
+                if slot is None:
+                    self._extra_for_write()[key] = value
+                elif slot == ts_slot:
+                    setattr(self, slot, to_timestamp(value))
+                else:
+                    if key in interned and value.__class__ is str:
+                        value = sys.intern(value)
+                    setattr(self, slot, value)
+
+    def __delitem__(self, key):
+        slot = self.SLOT_OF.get(key)
+        if slot is None:
+            del self.extra_fields()[key]
+            return
+        try:
+            delattr(self, slot)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key, slot in self.SLOT_OF.items():
+            if hasattr(self, slot):
+                yield key
+        yield from list(self.extra_fields())
+
+    def __len__(self):
+        return sum(1 for slot in self.SLOT_OF.values() if hasattr(self, slot)) + len(self.extra_fields())
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class User(Record):
+    __slots__ = ('id', 'username', 'email', 'password_hash', 'role', 'created_ts')
+
+    FIELDS = ('id', 'username', 'email', 'password_hash', 'role', 'created_at')
+    DATE_FIELD = 'created_at'
+    TS_SLOT = 'created_ts'
+    INTERNED = frozenset({'role'})
+
+    @property
+    def created_at(self):
+        return to_datetime(getattr(self, 'created_ts', None))
+
+
+class Book(Record):
+    __slots__ = ('id', 'title', 'author', 'category', 'filename', 'sha256', 'uploaded_by',
+                 'uploaded_ts', 'downloads', 'views', 'extract_status', 'pages',
+                 'views_trend', 'downloads_trend')
+
+    FIELDS = ('id', 'title', 'author', 'category', 'filename', 'sha256', 'uploaded_by',
+              'uploaded_at', 'downloads', 'views', 'extract_status', 'pages',
+              'views_trend', 'downloads_trend')
+    DATE_FIELD = 'uploaded_at'
+    TS_SLOT = 'uploaded_ts'
+    INTERNED = frozenset({'author', 'category'})
+
+    @property
+    def uploaded_at(self):
+        return to_datetime(getattr(self, 'uploaded_ts', None))
@@ -0,0 +1,213 @@
+"""Related books from TF-IDF cosine similarity.
+
+Each book is a vector of weighted term counts from its title, author,
+category and description, scaled by inverse document frequency and
+L2-normalized. Two books are related in proportion to the dot product of
+their vectors. Terms in more than MAX_DF of all books (stop words, mostly)
+are left out.
+
+Model.fit() builds the vectors as a sparse row matrix, with postings (the
+same matrix by term) next to it. Model.neighbours() finds every book's top k
+in blocks of rows. For a block it multiplies the block's entries by the
+postings of their terms, sums the products per (row, book) with np.bincount
+into a dense block x catalog array, and cuts each row's top k with
+np.argpartition. The block holds at most block_cells similarities, and the
+products are made block_cells at a time, however long the postings of the
+block's terms are, so memory stays bounded however large the catalog is.
+
+build_related.py runs this as a batch job. It stores each book's list in its
+'related' field, so serving a list is a field read, and saves the model.
+Model.nearest() then ranks a new upload against the saved model without a
+rebuild.
+
+NumPy is only needed to build and to rank new uploads. Serving the stored
+lists works without it.
+"""
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:   # related books are then served but not computed
+    np = None
+
+FIELDS = (('title', 3), ('author', 2), ('category', 2), ('description', 1))
+DEFAULT_K = int(os.environ.get('RELATED_K', 8))
+MAX_DF = 0.5
+BLOCK_CELLS = 500_000   # similarities held at once: 4 MB of float64
+MODEL_FILE = os.environ.get('RELATED_MODEL_FILE', 'related_model.npz')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def available():
+    return np is not None
+
+
+def term_counts(book):
+    """{term: count}, each occurrence weighted by its field."""
+    counts = {}
+    for field, weight in FIELDS:
+        text = book.get(field)
+        for term in _TOKEN_RE.findall(text.casefold()) if text else ():
+            counts[term] = counts.get(term, 0) + weight
+    return counts
+
+
+class Model:
+    """TF-IDF rows for a catalog, by book and by term."""
+
+    def __init__(self, ids, terms, idf, indptr, indices, data, kth=None, k=DEFAULT_K):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.terms = list(terms)
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)     # rows, as CSR
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.row_of = {int(book_id): i for i, book_id in enumerate(self.ids)}
+        # list length, and each book's k-th best similarity when its list was built (0: fewer)
+        self.k = int(k)
+        self.kth = np.zeros(len(self.ids)) if kth is None else np.asarray(kth, dtype=np.float64)
+        # postings: the same entries ordered by term
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        self.post_rows = rows[order]
+        self.post_data = self.data[order]
+        self.post_ptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.terms)), out=self.post_ptr[1:])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def fit(cls, books, max_df=MAX_DF):
+        ids, rows, df = [], [], {}
+        for book in books:
+            counts = term_counts(book)
+            ids.append(book['id'])
+            rows.append(counts)
+            for term in counts:
+                df[term] = df.get(term, 0) + 1
+        n = len(ids)
+        terms = sorted(t for t, d in df.items() if d <= max(max_df * n, 1))
+        vocab = {term: i for i, term in enumerate(terms)}
+        idf = np.log((1 + n) / (1 + np.array([df[t] for t in terms], dtype=np.float64))) + 1
+        indptr, indices, data = [0], [], []
+        for counts in rows:
+            cols = sorted(vocab[t] for t in counts if t in vocab)
+            indices.extend(cols)
+            data.extend(counts[terms[c]] for c in cols)
+            indptr.append(len(indices))
+        indices = np.array(indices, dtype=np.int64)
+        data = np.array(data, dtype=np.float64) * idf[indices]
+        lengths = np.diff(indptr)
+        norms = np.sqrt(np.bincount(np.repeat(np.arange(n), lengths), weights=data ** 2, minlength=n))
+        norms[norms == 0] = 1
+        data /= np.repeat(norms, lengths)
+        return cls(ids, terms, idf, indptr, indices, data)
+
+    def _products(self, rows, cols, vals, limit=BLOCK_CELLS):
+        """Yield (row, other row, product) for entries (rows, cols, vals) against
+        the postings, at most `limit` products at a time.
+
+        An entry contributes one product per book in its term's postings, so
+        a few common terms can make far more products than there are entries.
+        Chunks end between entries, unless one entry alone has more postings
+        than `limit`; those are taken `limit` at a time.
+        """
+        starts = self.post_ptr[cols]
+        lengths = self.post_ptr[cols + 1] - starts
+        ends = np.cumsum(lengths)   # each entry's products end here
+        first = 0
+        while first < len(cols):
+            last = int(np.searchsorted(ends, ends[first] - lengths[first] + limit, side='right'))
+            if last == first:
+                for lo in range(starts[first], starts[first] + lengths[first], limit):
+                    positions = np.arange(lo, min(lo + limit, starts[first] + lengths[first]))
+                    yield (np.full(len(positions), rows[first]), self.post_rows[positions],
+                           vals[first] * self.post_data[positions])
+                first += 1
+                continue
+            part = slice(first, last)
+            counts = lengths[part]
+            # positions into the postings: each entry's start, counting up its length
+            offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(starts[part], counts) + offsets
+            yield (np.repeat(rows[part], counts), self.post_rows[positions],
+                   np.repeat(vals[part], counts) * self.post_data[positions])
+            first = last
+
+    @staticmethod
+    def _top(scores, k):
+        """Column indices of each row's k highest positive scores, best first."""
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in range(scores.shape[0])]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        picked = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-picked, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        picked = np.take_along_axis(picked, order, axis=1)
+        return [t[p > 0] for t, p in zip(top, picked)]
+
+    def neighbours(self, k=DEFAULT_K, block_cells=BLOCK_CELLS):
+        """Yield (book_id, [(book_id, similarity)]) for every book, best first."""
+        n = len(self.ids)
+        self.k = k
+        block = max(block_cells // max(n, 1), 1)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            lo, hi = self.indptr[start], self.indptr[stop]
+            rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+            scores = np.zeros((stop - start) * n)
+            for local, other, products in self._products(rows, self.indices[lo:hi],
+                                                         self.data[lo:hi], block_cells):
+                scores += np.bincount(local * n + other, weights=products, minlength=len(scores))
+            scores = scores.reshape(stop - start, n)
+            scores[np.arange(stop - start), np.arange(start, stop)] = 0   # not itself
+            for i, top in enumerate(self._top(scores, k)):
+                found = [(int(self.ids[j]), round(float(scores[i, j]), 6)) for j in top]
+                self.kth[start + i] = found[-1][1] if len(found) == k else 0
+                yield int(self.ids[start + i]), found
+
+    def similarities(self, book):
+        """Similarity of `book` to every book in the model, in model order."""
+        counts = term_counts(book)
+        cols = np.array(sorted(self.vocab[t] for t in counts if t in self.vocab), dtype=np.int64)
+        scores = np.zeros(len(self.ids))
+        if not len(cols):
+            return scores
+        vals = np.array([counts[self.terms[c]] for c in cols], dtype=np.float64) * self.idf[cols]
+        vals /= np.sqrt((vals ** 2).sum())
+        for _, other, products in self._products(np.zeros(len(cols), dtype=np.int64), cols, vals):
+            scores += np.bincount(other, weights=products, minlength=len(self.ids))
+        return scores
+
+    def nearest(self, book, k=None):
+        """Place a book that is not in the model.
+
+        Returns ([(book_id, similarity)] of the k (default: self.k) books
+        most like it, best first, and {book_id: similarity} for the books it
+        may now rank among the self.k most like them.
+        """
+        scores = self.similarities(book)
+        row = self.row_of.get(book.get('id'))
+        if row is not None:
+            scores[row] = 0
+        top = self._top(scores[np.newaxis], self.k if k is None else k)[0]
+        closer = np.flatnonzero((scores > 0) & (scores > self.kth))
+        return ([(int(self.ids[j]), round(float(scores[j]), 6)) for j in top],
+                {int(self.ids[j]): round(float(scores[j]), 6) for j in closer})
+
+    def save(self, path=MODEL_FILE):
+        tmp = f'{path}.tmp.npz'
+        np.savez(tmp, ids=self.ids, terms=np.array(self.terms, dtype=str), idf=self.idf,
+                 indptr=self.indptr, indices=self.indices, data=self.data, kth=self.kth, k=self.k)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with np.load(path) as f:
+            return cls(f['ids'], f['terms'].tolist(), f['idf'], f['indptr'], f['indices'], f['data'],
+                       f['kth'], int(f['k']))
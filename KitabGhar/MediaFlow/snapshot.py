@@ -0,0 +1,178 @@
+"""Compact binary snapshot of the memory store.
+
+Selected with SNAPSHOT_FORMAT=binary (see app.py). The file is laid out as
+
+    MAGIC, u32 header length, header (JSON), then each table's sections
+
+with every integer little-endian. The header holds user_counter,
+book_counter and journal_seq, and for each table its row count and the
+(offset, length) of three sections:
+
+    columns  {field: [value per row]} as one JSON object, one list per slot
+             of the record type (see records.py), dates as epoch seconds
+    offsets  n + 1 u64 offsets into 'lazy', delimiting each row's span
+    lazy     every other field of a row (descriptions, extracted text, PDF
+             metadata) as a compact JSON object per row
+
+read() memory-maps the file and decodes only the columns. Each record keeps
+a reference to its span of 'lazy' and parses it the first time a field
+outside the slots, or the record as a whole, is used. dumps() copies spans
+that were never parsed straight across, so writing a snapshot does not
+parse them either.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+from records import Book, User, to_timestamp
+
+MAGIC = b'KGSNAP\x00\x01'
+TABLES = (('users', User), ('books', Book))
+
+_HEADER_LEN = struct.Struct('<I')
+_MISSING = object()
+
+
+class SnapshotError(ValueError):
+    """The file is not a complete binary snapshot."""
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=_to_json).encode('utf-8')
+
+
+class _LazySpans:
+    """The 'lazy' section of one table, shared by all of its records."""
+
+    __slots__ = ('buf', 'offsets')
+
+    def __init__(self, buf, offsets):
+        self.buf = buf
+        self.offsets = offsets
+
+    def raw(self, row):
+        return bytes(self.buf[self.offsets[row]:self.offsets[row + 1]])
+
+    def fields(self, row):
+        return json.loads(self.raw(row))
+
+
+def _span(record):
+    """The bytes of a record's fields outside the slots."""
+    raw = record.unparsed_span()
+    if raw is not None:
+        return raw
+    extra = record.extra_fields()
+    return _dumps(extra) if extra else b''
+
+
+def dumps(users, books, **meta):
+    """Encode users and books (iterables of records) plus meta as a snapshot."""
+    sections = []
+    header = dict(meta)
+    position = 0
+    for (table, cls), rows in zip(TABLES, (users, books)):
+        values = {key: [] for key in cls.FIELDS}
+        absent = {}
+        offsets = array('Q', [0])
+        spans = []
+        size = 0
+        for row, record in enumerate(rows):
+            for key, slot in cls.SLOT_OF.items():
+                value = getattr(record, slot, _MISSING)
+                if value is _MISSING:
+                    absent.setdefault(key, []).append(row)
+                    value = None
+                values[key].append(value)
+            span = _span(record)
+            spans.append(span)
+            size += len(span)
+            offsets.append(size)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        column_bytes = _dumps({'values': values, 'absent': absent})
+        table_header = {'rows': len(offsets) - 1}
+        for name, data in (('columns', [column_bytes]), ('offsets', [offsets.tobytes()]),
+                           ('lazy', spans)):
+            length = sum(len(part) for part in data)
+            table_header[name] = (position, length)
+            sections.extend(data)
+            position += length
+        header[table] = table_header
+
+    header_bytes = _dumps(header)
+    return b''.join([MAGIC, _HEADER_LEN.pack(len(header_bytes)), header_bytes, *sections])
+
+
+def _section(buf, base, table_header, name):
+    offset, length = table_header[name]
+    start = base + offset
+    if start + length > len(buf):
+        raise SnapshotError(f'{name} section runs past the end of the file')
+    return start, start + length
+
+
+def read(path):
+    """Map a snapshot and return its meta with 'users' and 'books' as record lists."""
+    with open(path, 'rb') as f:
+        if os.name == 'nt':
+            # a mapped file cannot be replaced on Windows, so read it whole
+            buf = f.read()
+        else:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[:len(MAGIC)] != MAGIC:
+        raise SnapshotError(f'{path} is not a binary snapshot')
+    start = len(MAGIC) + _HEADER_LEN.size
+    (header_len,) = _HEADER_LEN.unpack(buf[len(MAGIC):start])
+    header = json.loads(buf[start:start + header_len])
+    base = start + header_len
+
+    result = {k: v for k, v in header.items() if k not in dict(TABLES)}
+    for table, cls in TABLES:
+        table_header = header[table]
+        n = table_header['rows']
+        lo, hi = _section(buf, base, table_header, 'columns')
+        decoded = json.loads(buf[lo:hi])
+        values, absent = decoded['values'], decoded['absent']
+        for key in cls.FIELDS:
+            if key not in values:
+                # a field added to the record type since this file was written
+                values[key] = [None] * n
+                absent[key] = range(n)
+        values[cls.DATE_FIELD] = [v if isinstance(v, int) else to_timestamp(v)
+                                  for v in values[cls.DATE_FIELD]]
+        for key in cls.INTERNED:
+            values[key] = [sys.intern(v) if isinstance(v, str) else v for v in values[key]]
+
+        lo, hi = _section(buf, base, table_header, 'offsets')
+        offsets = array('Q')
+        offsets.frombytes(buf[lo:hi])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        if len(offsets) != n + 1:
+            raise SnapshotError(f'{table}: expected {n + 1} offsets, found {len(offsets)}')
+        lo, hi = _section(buf, base, table_header, 'lazy')
+        if offsets[-1] != hi - lo:
+            raise SnapshotError(f'{table}: lazy section is truncated')
+        spans = _LazySpans(memoryview(buf)[lo:hi], offsets)
+
+        slots = [cls.SLOT_OF[key] for key in cls.FIELDS]
+        columns = zip(*(values[key] for key in cls.FIELDS))
+        records = [cls.from_row(slots, row_values,
+                                spans if offsets[row] != offsets[row + 1] else None, row)
+                   for row, row_values in enumerate(columns)]
+        for key, rows in absent.items():
+            for row in rows:
+                delattr(records[row], cls.SLOT_OF[key])
+        result[table] = records
+    return result
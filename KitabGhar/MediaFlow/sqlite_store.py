@@ -0,0 +1,685 @@
+"""SQLite storage engine for users and books.
+
+Selected with STORAGE_BACKEND=sqlite (see app.py). Records live in one
+database file in WAL mode, so startup does not read the catalog into memory
+and several worker processes can share it. Title/author/description/text
+search goes through an FTS5 table kept in step by triggers; where SQLite was
+built without FTS5 it falls back to substring scans.
+
+Records are returned as plain dicts shaped like the in-memory ones, with
+datetimes parsed back from ISO strings. Each call returns a fresh copy, so
+changes must go through update_book()/record_counts().
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import fuzzy
+import popularity
+import suggest
+
+USER_COLUMNS = ('id', 'username', 'email', 'password_hash', 'role', 'created_at')
+BOOK_COLUMNS = ('id', 'title', 'author', 'category', 'description', 'filename', 'sha256',
+                'uploaded_by', 'uploaded_at', 'downloads', 'views', 'extract_status', 'pages',
+                'views_trend', 'downloads_trend')
+COUNTER_FIELDS = ('views', 'downloads', 'views_trend', 'downloads_trend')
+TREND_FIELDS = ('views_trend', 'downloads_trend')
+# columns added since the first schema; load() adds them to older databases
+ADDED_BOOK_COLUMNS = (('views_trend', 'REAL NOT NULL DEFAULT 0'),
+                      ('downloads_trend', 'REAL NOT NULL DEFAULT 0'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    username      TEXT NOT NULL,
+    username_key  TEXT NOT NULL,
+    email         TEXT,
+    email_key     TEXT,
+    password_hash TEXT NOT NULL,
+    role          TEXT NOT NULL DEFAULT 'reader',
+    created_at    TEXT,
+    extra         TEXT
+);
+CREATE INDEX IF NOT EXISTS users_username_key ON users(username_key);
+CREATE INDEX IF NOT EXISTS users_email_key ON users(email_key);
+
+CREATE TABLE IF NOT EXISTS books (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    title          TEXT DEFAULT '',
+    author         TEXT DEFAULT '',
+    category       TEXT DEFAULT '',
+    description    TEXT DEFAULT '',
+    filename       TEXT,
+    blob           TEXT,
+    sha256         TEXT,
+    uploaded_by    INTEGER,
+    uploaded_at    TEXT,
+    downloads      INTEGER NOT NULL DEFAULT 0,
+    views          INTEGER NOT NULL DEFAULT 0,
+    extract_status TEXT,
+    pages          INTEGER,
+    content_text   TEXT DEFAULT '',
+    extra          TEXT,
+    views_trend    REAL NOT NULL DEFAULT 0,
+    downloads_trend REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS books_recent ON books(uploaded_at, id);
+CREATE INDEX IF NOT EXISTS books_category_recent ON books(category, uploaded_at, id);
+CREATE INDEX IF NOT EXISTS books_uploader ON books(uploaded_by, uploaded_at, id);
+CREATE INDEX IF NOT EXISTS books_blob ON books(blob);
+CREATE INDEX IF NOT EXISTS books_extract_status ON books(extract_status);
+
+-- bumped by every change to the catalog except view/download counts
+CREATE TABLE IF NOT EXISTS catalog_version (n INTEGER NOT NULL);
+INSERT INTO catalog_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version);
+CREATE TRIGGER IF NOT EXISTS books_version_ai AFTER INSERT ON books BEGIN
+    UPDATE catalog_version SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS books_version_ad AFTER DELETE ON books BEGIN
+    UPDATE catalog_version SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS books_version_au
+AFTER UPDATE OF title, author, category, description, filename, sha256, uploaded_by,
+                uploaded_at, extract_status, pages, content_text, extra ON books BEGIN
+    UPDATE catalog_version SET n = n + 1;
+END;
+
+-- bumped only when a title, author or category changes: all that the
+-- in-process fuzzy and suggest indexes are built from
+CREATE TABLE IF NOT EXISTS names_version (n INTEGER NOT NULL);
+INSERT INTO names_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM names_version);
+CREATE TRIGGER IF NOT EXISTS books_names_ai AFTER INSERT ON books BEGIN
+    UPDATE names_version SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS books_names_ad AFTER DELETE ON books BEGIN
+    UPDATE names_version SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS books_names_au AFTER UPDATE OF title, author, category ON books
+WHEN old.title IS NOT new.title OR old.author IS NOT new.author OR old.category IS NOT new.category BEGIN
+    UPDATE names_version SET n = n + 1;
+END;
+"""
+
+# the title, author and category each book had before every insert, rename
+# or delete, so the in-process fuzzy and suggest indexes catch up on a few
+# changes instead of being rebuilt; only the last NAME_CHANGES_KEPT are kept
+NAME_CHANGES_KEPT = 10_000
+NAME_CHANGES_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS name_changes (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id  INTEGER NOT NULL,
+    existed  INTEGER NOT NULL,   -- 0: an insert, nothing to remove
+    title    TEXT,
+    author   TEXT,
+    category TEXT
+);
+CREATE TRIGGER IF NOT EXISTS books_name_changes_ai AFTER INSERT ON books BEGIN
+    INSERT INTO name_changes (book_id, existed) VALUES (new.id, 0);
+END;
+CREATE TRIGGER IF NOT EXISTS books_name_changes_ad AFTER DELETE ON books BEGIN
+    INSERT INTO name_changes (book_id, existed, title, author, category)
+    VALUES (old.id, 1, old.title, old.author, old.category);
+END;
+CREATE TRIGGER IF NOT EXISTS books_name_changes_au AFTER UPDATE OF title, author, category ON books
+WHEN old.title IS NOT new.title OR old.author IS NOT new.author OR old.category IS NOT new.category BEGIN
+    INSERT INTO name_changes (book_id, existed, title, author, category)
+    VALUES (old.id, 1, old.title, old.author, old.category);
+END;
+CREATE TRIGGER IF NOT EXISTS name_changes_trim AFTER INSERT ON name_changes BEGIN
+    DELETE FROM name_changes WHERE seq <= new.seq - {NAME_CHANGES_KEPT};
+END;
+"""
+
+# time-decayed popularity (see popularity.py): the top k is an index walk,
+# and trend_epoch holds the epoch the scores count from
+TREND_SCHEMA = f"""
+CREATE INDEX IF NOT EXISTS books_views_trend ON books(views_trend, id);
+CREATE INDEX IF NOT EXISTS books_category_views_trend ON books(category, views_trend, id);
+CREATE INDEX IF NOT EXISTS books_downloads_trend ON books(downloads_trend, id);
+CREATE INDEX IF NOT EXISTS books_category_downloads_trend ON books(category, downloads_trend, id);
+CREATE TABLE IF NOT EXISTS trend_epoch (epoch REAL NOT NULL);
+INSERT INTO trend_epoch SELECT {popularity.EPOCH} WHERE NOT EXISTS (SELECT 1 FROM trend_epoch);
+"""
+
+# live book counts per category, kept by triggers; load() fills the table
+# in the same transaction that creates it, for databases that predate it
+CATEGORY_SCHEMA = (
+    """CREATE TABLE category_counts (
+        category TEXT PRIMARY KEY,
+        n        INTEGER NOT NULL
+    )""",
+    """CREATE TRIGGER category_counts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO category_counts (category, n) VALUES (coalesce(new.category, ''), 1)
+        ON CONFLICT (category) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER category_counts_ad AFTER DELETE ON books BEGIN
+        UPDATE category_counts SET n = n - 1 WHERE category = coalesce(old.category, '');
+        DELETE FROM category_counts WHERE category = coalesce(old.category, '') AND n <= 0;
+    END""",
+    """CREATE TRIGGER category_counts_au AFTER UPDATE OF category ON books
+    WHEN coalesce(old.category, '') != coalesce(new.category, '') BEGIN
+        UPDATE category_counts SET n = n - 1 WHERE category = coalesce(old.category, '');
+        DELETE FROM category_counts WHERE category = coalesce(old.category, '') AND n <= 0;
+        INSERT INTO category_counts (category, n) VALUES (coalesce(new.category, ''), 1)
+        ON CONFLICT (category) DO UPDATE SET n = n + 1;
+    END""",
+    """INSERT INTO category_counts (category, n)
+    SELECT coalesce(category, ''), count(*) FROM books GROUP BY coalesce(category, '')""",
+)
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, description, content_text,
+    content='books', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, author, description, content_text)
+    VALUES (new.id, new.title, new.author, new.description, new.content_text);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author, description, content_text)
+    VALUES ('delete', old.id, old.title, old.author, old.description, old.content_text);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_au
+AFTER UPDATE OF title, author, description, content_text ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, author, description, content_text)
+    VALUES ('delete', old.id, old.title, old.author, old.description, old.content_text);
+    INSERT INTO books_fts(rowid, title, author, description, content_text)
+    VALUES (new.id, new.title, new.author, new.description, new.content_text);
+END;
+"""
+
+# bm25() weights, in FTS column order; mirrors app.SEARCH_FIELDS
+FTS_WEIGHTS = (3.0, 2.0, 1.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+')
+_BOOK_SELECT = 'SELECT ' + ', '.join('b.' + c for c in BOOK_COLUMNS) + ', b.extra FROM books b'
+_USER_SELECT = 'SELECT ' + ', '.join(USER_COLUMNS) + ', extra FROM users'
+
+
+def _normalize_key(value):
+    return value.strip().casefold() if value else None
+
+
+def _names(book_id, title, author, category):
+    """The part of a book the in-process fuzzy and suggest indexes are built from."""
+    return {'id': book_id, 'title': title, 'author': author, 'category': category}
+
+
+def _to_db(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _from_iso(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _row_to_record(row, columns, date_field):
+    record = dict(zip(columns, row))
+    extra = row[len(columns)]
+    if extra:
+        record.update(json.loads(extra))
+    record[date_field] = _from_iso(record.get(date_field))
+    return record
+
+
+def _split_fields(fields, columns):
+    """Split a record into (column values, JSON-encoded extra or None)."""
+    values = {k: _to_db(v) for k, v in fields.items() if k in columns}
+    extra = {k: v for k, v in fields.items() if k not in columns}
+    return values, (json.dumps(extra, default=_to_db) if extra else None)
+
+
+class SQLiteStore:
+    """Users and books in a SQLite database, one connection per thread."""
+
+    # records are copies; counters bumped on them must be overlaid by the caller
+    live_records = False
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        self.has_fts = False
+        self._derived = {}   # {index class: (names version, last name_changes seq, index)}
+        self._derived_lock = threading.Lock()
+
+    # -- connections ------------------------------------------------------
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            conn.execute('PRAGMA cache_size=-16000')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def _transaction(self):
+        """This thread's connection inside one IMMEDIATE transaction."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write(self, statements):
+        """Run [(sql, params)] in one IMMEDIATE transaction; returns the last cursor."""
+        with self._transaction() as conn:
+            cur = None
+            for sql, params in statements:
+                cur = conn.execute(sql, params)
+        return cur
+
+    def load(self):
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.executescript(NAME_CHANGES_SCHEMA)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(books)')}
+        for name, decl in ADDED_BOOK_COLUMNS:
+            if name not in columns:
+                try:
+                    conn.execute(f'ALTER TABLE books ADD COLUMN {name} {decl}')
+                except sqlite3.OperationalError:
+                    pass   # another worker added it first
+        conn.executescript(TREND_SCHEMA)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'category_counts'").fetchone():
+                for sql in CATEGORY_SCHEMA:
+                    conn.execute(sql)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+
+    def refresh(self):
+        """Nothing to do: every read goes to the shared database."""
+
+    def checkpoint(self):
+        self._conn().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    # -- users ------------------------------------------------------------
+    def _user_params(self, user):
+        values, extra = _split_fields(user, USER_COLUMNS)
+        values['username_key'] = _normalize_key(user.get('username'))
+        values['email_key'] = _normalize_key(user.get('email'))
+        values['extra'] = extra
+        return values
+
+    def add_user(self, user):
+        values = self._user_params(user)
+        values.pop('id', None)
+        sql = f"INSERT INTO users ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})"
+        user['id'] = self._write([(sql, tuple(values.values()))]).lastrowid
+        return user
+
+    def update_user(self, user_id, fields):
+        values, extra = _split_fields(fields, USER_COLUMNS)
+        values.pop('id', None)
+        for name in ('username', 'email'):
+            if name in fields:
+                values[f'{name}_key'] = _normalize_key(fields[name])
+        assignments = [f'{name} = ?' for name in values]
+        params = list(values.values())
+        if extra:
+            assignments.append("extra = json_patch(coalesce(extra, '{}'), ?)")
+            params.append(extra)
+        if assignments:
+            sql = f"UPDATE users SET {', '.join(assignments)} WHERE id = ?"
+            self._write([(sql, params + [user_id])])
+        return self.get_user(user_id)
+
+    def delete_user(self, user_id):
+        user = self.get_user(user_id)
+        if user:
+            self._write([('DELETE FROM users WHERE id = ?', (user_id,))])
+        return user
+
+    def _one_user(self, where, params, exact=None):
+        order, args = 'id', params
+        if exact:
+            # users whose names differ only in case share a key; prefer the exact spelling
+            column, value = exact
+            order, args = f'{column} = ? DESC, id', (*params, value.strip())
+        row = self._conn().execute(f'{_USER_SELECT} WHERE {where} ORDER BY {order} LIMIT 1',
+                                   args).fetchone()
+        return _row_to_record(row, USER_COLUMNS, 'created_at') if row else None
+
+    def get_user(self, user_id):
+        return self._one_user('id = ?', (user_id,))
+
+    def get_user_by_username(self, username):
+        return self._one_user('username_key = ?', (_normalize_key(username),), ('username', username))
+
+    def get_user_by_email(self, email):
+        return self._one_user('email_key = ?', (_normalize_key(email),), ('email', email))
+
+    def list_users(self):
+        rows = self._conn().execute(f'{_USER_SELECT} ORDER BY id DESC')
+        return [_row_to_record(r, USER_COLUMNS, 'created_at') for r in rows]
+
+    def count_users(self):
+        return self._conn().execute('SELECT count(*) FROM users').fetchone()[0]
+
+    # -- books ------------------------------------------------------------
+    def _book_params(self, book):
+        values, extra = _split_fields(book, BOOK_COLUMNS + ('content_text',))
+        values['blob'] = os.path.basename(book.get('filename') or '')
+        values['extra'] = extra
+        return values
+
+    def _books(self, where='', params=(), order='', limit=None, offset=0):
+        sql = _BOOK_SELECT + (f' WHERE {where}' if where else '') + (f' ORDER BY {order}' if order else '')
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params = tuple(params) + (-1 if limit is None else limit, offset)
+        rows = self._conn().execute(sql, params)
+        return [_row_to_record(r, BOOK_COLUMNS, 'uploaded_at') for r in rows]
+
+    def add_book(self, book):
+        values = self._book_params(book)
+        values.pop('id', None)
+        sql = f"INSERT INTO books ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})"
+        book['id'] = self._write([(sql, tuple(values.values()))]).lastrowid
+        return book
+
+    def add_books(self, books):
+        """Insert new books in a single transaction, assigning their ids."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for book in books:
+                values = self._book_params(book)
+                values.pop('id', None)
+                book['id'] = conn.execute(
+                    f"INSERT INTO books ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+                    tuple(values.values())).lastrowid
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return books
+
+    def get_book(self, book_id):
+        books = self._books('b.id = ?', (book_id,))
+        return books[0] if books else None
+
+    def _update_statement(self, book_id, fields):
+        """(sql, params) setting fields on one book, or None if there is nothing to set."""
+        values, extra = _split_fields(fields, BOOK_COLUMNS + ('content_text',))
+        values.pop('id', None)
+        if 'filename' in fields:
+            values['blob'] = os.path.basename(fields['filename'] or '')
+        assignments = [f'{name} = ?' for name in values]
+        params = list(values.values())
+        if extra:
+            assignments.append("extra = json_patch(coalesce(extra, '{}'), ?)")
+            params.append(extra)
+        if not assignments:
+            return None
+        return f"UPDATE books SET {', '.join(assignments)} WHERE id = ?", params + [book_id]
+
+    def update_book(self, book_id, fields):
+        statement = self._update_statement(book_id, fields)
+        if statement:
+            self._write([statement])
+        return self.get_book(book_id)
+
+    def update_books(self, updates):
+        """update_book() for each {book_id: fields}, in one transaction."""
+        statements = [self._update_statement(book_id, fields) for book_id, fields in updates.items()]
+        statements = [statement for statement in statements if statement]
+        if statements:
+            self._write(statements)
+
+    def delete_book(self, book_id):
+        book = self.get_book(book_id)
+        if book:
+            self._write([('DELETE FROM books WHERE id = ?', (book_id,))])
+        return book
+
+    def count_books(self, category=None):
+        if category:
+            row = self._conn().execute('SELECT n FROM category_counts WHERE category = ?',
+                                       (category,)).fetchone()
+            return row[0] if row else 0
+        return self._conn().execute('SELECT count(*) FROM books').fetchone()[0]
+
+    def recent_books(self, offset=0, limit=None, category=None, before=None):
+        clauses, params = (['b.category = ?'], [category]) if category else ([], [])
+        if before is not None:
+            if (not isinstance(before, (list, tuple)) or len(before) != 2
+                    or not isinstance(before[0], (str, type(None))) or type(before[1]) is not int):
+                raise ValueError(f'not a recency key: {before!r}')
+            uploaded_at, book_id = before
+            if uploaded_at is None:
+                # books without an upload time sort last (NULL is smallest)
+                clauses.append('b.uploaded_at IS NULL AND b.id < ?')
+                params.append(book_id)
+            else:
+                clauses.append('((b.uploaded_at, b.id) < (?, ?) OR b.uploaded_at IS NULL)')
+                params += [uploaded_at, book_id]
+        return self._books(' AND '.join(clauses), params, 'b.uploaded_at DESC, b.id DESC', limit, offset)
+
+    def recency_key(self, book):
+        """The book's place in recent_books(), as a JSON-safe [uploaded_at, id]."""
+        return [_to_db(book.get('uploaded_at')), book['id']]
+
+    def popular_books(self, field, limit=None, category=None):
+        if field not in TREND_FIELDS:
+            raise ValueError(f'not a popularity field: {field}')
+        where, params = f'b.{field} > 0', ()
+        if category:
+            where, params = f'b.category = ? AND {where}', (category,)
+        return self._books(where, params, f'b.{field} DESC, b.id DESC', limit)
+
+    def books_by_uploader(self, user_id):
+        return self._books('b.uploaded_by = ?', (user_id,), 'b.uploaded_at DESC, b.id DESC')
+
+    def books_pending_extraction(self):
+        return self._books("b.extract_status = 'pending'")
+
+    def file_in_use(self, blob):
+        row = self._conn().execute('SELECT 1 FROM books WHERE blob = ? LIMIT 1', (blob,)).fetchone()
+        return row is not None
+
+    def get_all_categories(self):
+        return [category for category, _ in self.category_counts()]
+
+    def category_counts(self):
+        rows = self._conn().execute(
+            "SELECT category, n FROM category_counts WHERE category != '' ORDER BY category")
+        return [tuple(r) for r in rows]
+
+    def catalog_version(self):
+        return self._conn().execute('SELECT n FROM catalog_version').fetchone()[0]
+
+    def search_ready(self):
+        return True   # FTS5 is kept in step by triggers; fuzzy and suggest build on demand
+
+    def record_counts(self, deltas, epoch=popularity.EPOCH):
+        """Apply [((book_id, field), n)] counter increments in one transaction.
+
+        Trend increments count from `epoch`; they are rescaled if another
+        worker has rebased the scores since.
+        """
+        for (book_id, field), n in deltas:
+            if field not in COUNTER_FIELDS:
+                raise ValueError(f'not a counter field: {field}')
+        if not deltas:
+            return
+        with self._transaction() as conn:
+            current = conn.execute('SELECT epoch FROM trend_epoch').fetchone()[0]
+            factor = popularity.rescale(epoch, current)
+            for (book_id, field), n in deltas:
+                if field in TREND_FIELDS:
+                    n *= factor
+                conn.execute(f'UPDATE books SET {field} = {field} + ? WHERE id = ?', (n, book_id))
+
+    def trend_epoch(self):
+        return self._conn().execute('SELECT epoch FROM trend_epoch').fetchone()[0]
+
+    def rebase_trends(self, epoch, new):
+        """Count trend scores from `new` instead of `epoch`, unless another worker already moved it."""
+        with self._transaction() as conn:
+            if conn.execute('SELECT epoch FROM trend_epoch').fetchone()[0] != epoch:
+                return
+            factor = popularity.rescale(epoch, new)
+            conn.execute('UPDATE books SET views_trend = views_trend * ?, downloads_trend = downloads_trend * ?'
+                         ' WHERE views_trend > 0 OR downloads_trend > 0', (factor, factor))
+            conn.execute('UPDATE trend_epoch SET epoch = ?', (new,))
+
+    def search_books(self, query=None, category=None, mode='index'):
+        if not query:
+            where, params = ('b.category = ?', (category,)) if category else ('', ())
+            return self._books(where, params, 'b.id')
+        terms = _TOKEN_RE.findall(query.casefold())
+        if not terms:
+            # no words to look up (e.g. "++"); match the query as typed, as MemoryStore does
+            mode = 'substring'
+        if mode == 'fuzzy':
+            return self.search_fuzzy(query, category)
+
+        clauses, params = [], []
+        if mode == 'substring' or not self.has_fts:
+            # mode='substring' matches the whole query; without FTS5 every term must match
+            needles = [query.lower()] if mode == 'substring' else terms
+            for needle in needles:
+                clauses.append('(instr(lower(b.title), ?) OR instr(lower(b.author), ?)'
+                               ' OR instr(lower(b.description), ?))')
+                params += [needle] * 3
+            order = 'b.id'
+            sql_from = ''
+        else:
+            clauses.append('books_fts MATCH ?')
+            params.append(' AND '.join(f'"{t}"*' for t in terms))
+            order = f"bm25(books_fts, {', '.join(map(str, FTS_WEIGHTS))}), b.id DESC"
+            sql_from = ' JOIN books_fts ON books_fts.rowid = b.id'
+        if category:
+            clauses.append('b.category = ?')
+            params.append(category)
+        sql = f"{_BOOK_SELECT}{sql_from} WHERE {' AND '.join(clauses)} ORDER BY {order}"
+        rows = self._conn().execute(sql, params)
+        books = [_row_to_record(r, BOOK_COLUMNS, 'uploaded_at') for r in rows]
+        if not books and mode == 'index':
+            # nothing matched as typed; try typo-tolerant title/author matching
+            return self.search_fuzzy(query, category)
+        return books
+
+    @contextmanager
+    def _derived_index(self, cls):
+        """An in-process cls() index over titles, authors and categories.
+
+        Brought up to date whenever a title, author or category has changed,
+        which also picks up other processes' writes. Uploads of extracted
+        text, related lists and the like leave it alone. The index is
+        changed in place, so it is only used while this holds _derived_lock.
+        """
+        version = self._conn().execute('SELECT n FROM names_version').fetchone()[0]
+        with self._derived_lock:
+            built = self._derived.get(cls)
+            if built is None or built[0] != version:
+                built = self._derived[cls] = self._catch_up(cls, built)
+            yield built[2]
+
+    def _catch_up(self, cls, built):
+        """(names version, last seq, index) for `built` plus the name_changes since.
+
+        The changes and the books are read in one transaction, so they are
+        consistent with each other. The first change to each book since
+        `built` holds what the index has for it; that comes out and the
+        book as it is now goes in. The index is rebuilt from the table when
+        there is none yet or the changes it missed were trimmed.
+        """
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            version = conn.execute('SELECT n FROM names_version').fetchone()[0]
+            last = conn.execute('SELECT coalesce(max(seq), 0) FROM name_changes').fetchone()[0]
+            if built is None or built[1] < last - NAME_CHANGES_KEPT:
+                index = cls()
+                rows = conn.execute('SELECT id, title, author, category FROM books')
+                index.add_many(_names(*row) for row in rows)
+                return version, last, index
+            index, since = built[2], built[1]
+            indexed = {}
+            rows = conn.execute('SELECT book_id, existed, title, author, category FROM name_changes'
+                                ' WHERE seq > ? AND seq <= ? ORDER BY seq', (since, last))
+            for book_id, existed, title, author, category in rows:
+                indexed.setdefault(book_id, _names(book_id, title, author, category) if existed else None)
+            for names in indexed.values():
+                if names is not None:
+                    index.remove(names)
+            rows = conn.execute('SELECT id, title, author, category FROM books WHERE id IN'
+                                ' (SELECT book_id FROM name_changes WHERE seq > ? AND seq <= ?)',
+                                (since, last))
+            index.add_many(_names(*row) for row in rows)
+            return version, last, index
+        finally:
+            conn.execute('COMMIT')
+
+    def search_fuzzy(self, query, category=None, limit=fuzzy.DEFAULT_LIMIT, threshold=fuzzy.DEFAULT_THRESHOLD):
+        accept = None
+        if category:
+            ids = {r[0] for r in self._conn().execute('SELECT id FROM books WHERE category = ?', (category,))}
+            accept = ids.__contains__
+        with self._derived_index(fuzzy.TrigramIndex) as index:
+            hits = index.search(query, limit, threshold, accept)
+        if not hits:
+            return []
+        ids = [book_id for _, book_id in hits]
+        found = {b['id']: b for b in self._books(f"b.id IN ({', '.join('?' * len(ids))})", ids)}
+        return [found[i] for i in ids if i in found]
+
+    def suggest(self, prefix, limit=suggest.DEFAULT_LIMIT):
+        with self._derived_index(suggest.PrefixIndex) as index:
+            return index.complete(prefix, limit)
+
+    # -- bulk -------------------------------------------------------------
+    def import_records(self, users, books):
+        """Insert users and books keeping their ids, in a single transaction."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for user in users:
+                values = self._user_params(user)
+                conn.execute(f"INSERT INTO users ({', '.join(values)}) "
+                             f"VALUES ({', '.join('?' * len(values))})", tuple(values.values()))
+            for book in books:
+                values = self._book_params(book)
+                conn.execute(f"INSERT INTO books ({', '.join(values)}) "
+                             f"VALUES ({', '.join('?' * len(values))})", tuple(values.values()))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
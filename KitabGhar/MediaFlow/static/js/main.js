@@ -97,7 +97,68 @@ function setupSearch() {
                 searchForm.submit();
             }
         });
+
+        setupSuggestions(searchForm, searchInput, categorySelect);
+    }
+}
+
+// Search-as-you-type: completions from /suggest, debounced so typing doesn't
+// send a request (let alone a full /browse) on every keystroke
+function setupSuggestions(searchForm, searchInput, categorySelect) {
+    var list = document.getElementById(searchInput.getAttribute('list'));
+    var url = searchInput.dataset.suggestUrl;
+    if (!list || !url) return;
+
+    var cache = {};
+    var kinds = {};
+    var timer = null;
+    var controller = null;
+
+    function show(suggestions) {
+        list.innerHTML = '';
+        kinds = {};
+        suggestions.forEach(function(s) {
+            var option = document.createElement('option');
+            option.value = s.text;
+            option.label = s.kind + ' · ' + s.books + (s.books === 1 ? ' book' : ' books');
+            list.appendChild(option);
+            kinds[s.text] = s.kind;
+        });
     }
+
+    function fetchSuggestions(q) {
+        if (cache[q]) {
+            show(cache[q]);
+            return;
+        }
+        if (controller) controller.abort();
+        controller = new AbortController();
+        fetch(url + '?q=' + encodeURIComponent(q), { signal: controller.signal })
+            .then(function(response) { return response.ok ? response.json() : { suggestions: [] }; })
+            .then(function(data) {
+                cache[q] = data.suggestions;
+                if (searchInput.value.trim() === q) show(data.suggestions);
+            })
+            .catch(function() {});   // aborted by a newer keystroke, or offline
+    }
+
+    searchInput.addEventListener('input', function(e) {
+        var q = searchInput.value.trim();
+        // Picking a category from the list filters by it rather than searching its name
+        var picked = !e.inputType || e.inputType === 'insertReplacementText';
+        if (picked && kinds[q] === 'category' && categorySelect) {
+            categorySelect.value = q;
+            searchInput.value = '';
+            searchForm.submit();
+            return;
+        }
+        clearTimeout(timer);
+        if (q.length < 2) {
+            show([]);
+            return;
+        }
+        timer = setTimeout(function() { fetchSuggestions(q); }, 150);
+    });
 }
 
 // File upload validation
@@ -0,0 +1,158 @@
+"""Search-as-you-type completions over titles, authors and categories.
+
+PrefixIndex keeps one sorted list of casefolded keys, so every key sharing a
+prefix sits in one contiguous run, found with two bisects. Titles are keyed
+by the whole title. Authors and categories are also keyed from each later
+word, so "prem" finds "Munshi Premchand". Each entry counts the books behind
+it, and completions are the entries with the most books.
+
+Short prefixes have the longest runs and are the most typed, so every
+prefix up to RANKED_PREFIX letters keeps its completions in count order,
+moved on every add and remove; completing one is a slice. A longer prefix
+ranks its run, or when the run is longer than `scan` keys, walks its
+RANKED_PREFIX-letter prefix's order for completions that match it.
+
+Like fuzzy.TrigramIndex, this is not thread-safe by itself. The memory
+engine changes it under _index_write() and reads it through
+_consistent_read().
+"""
+import bisect
+import heapq
+
+KINDS = ('category', 'author', 'title')
+DEFAULT_LIMIT = 8
+RANKED_PREFIX = 3   # prefixes up to this long keep their completions in count order
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split()) if text else ''
+
+
+def _keys(kind, text):
+    """The keys a (kind, text) entry is found by."""
+    key = normalize(text)
+    yield key
+    if kind != 'title':
+        start = key.find(' ')
+        while start != -1:
+            yield key[start + 1:]
+            start = key.find(' ', start + 1)
+
+
+class PrefixIndex:
+    """Sorted (key, kind, text) entries with book counts, searched by prefix."""
+
+    def __init__(self, scan=1000):
+        self.scan = scan
+        self._keys = []     # sorted [(key, kind, text)]
+        self._counts = {}   # {(key, kind, text): number of books}
+        self._ranked = {}   # {short prefix: sorted [(-books, len(text), text, kind)]}
+
+    def __len__(self):
+        return len(self._counts)
+
+    @staticmethod
+    def _entries(book):
+        for kind in KINDS:
+            text = ' '.join((book.get(kind) or '').split())
+            if text:
+                yield kind, text
+
+    def _update(self, books, delta):
+        """Count books in (delta=1) or out (delta=-1); {(kind, text): (books before, after)}."""
+        changed = {}
+        for book in books:
+            for kind, text in set(self._entries(book)):
+                # every key of an entry counts the same books
+                before = self._counts.get((normalize(text), kind, text), 0)
+                if before + delta < 0:
+                    continue
+                changed[kind, text] = (changed.get((kind, text), (before,))[0], before + delta)
+                for key in _keys(kind, text):
+                    self._counts[key, kind, text] = before + delta
+        return changed
+
+    def _apply(self, changed):
+        """Move the changed entries in _keys and _ranked."""
+        added, removed, moves = [], set(), {}
+        for (kind, text), (before, after) in changed.items():
+            if before == after:
+                continue
+            keys = list(_keys(kind, text))
+            if not before:
+                added.extend((key, kind, text) for key in keys)
+            if not after:
+                for key in keys:
+                    del self._counts[key, kind, text]
+                    removed.add((key, kind, text))
+            old = (-before, len(text), text, kind) if before else None
+            new = (-after, len(text), text, kind) if after else None
+            for prefix in {key[:n] for key in keys for n in range(1, min(len(key), RANKED_PREFIX) + 1)}:
+                moves.setdefault(prefix, ([], []))
+                if old:
+                    moves[prefix][0].append(old)
+                if new:
+                    moves[prefix][1].append(new)
+        self._keys = self._merged(self._keys, removed, added)
+        for prefix, (out, into) in moves.items():
+            ranked = self._merged(self._ranked.get(prefix, []), set(out), into)
+            if ranked:
+                self._ranked[prefix] = ranked
+            else:
+                self._ranked.pop(prefix, None)
+
+    @staticmethod
+    def _merged(items, out, into):
+        """Sorted `items` less `out` plus `into`: in place for a few, re-sorted for many."""
+        if len(out) + len(into) > len(items) // 8 + 16:
+            items = [item for item in items if item not in out] if out else items
+            items.extend(into)
+            items.sort()
+            return items
+        for item in out:
+            i = bisect.bisect_left(items, item)
+            if i < len(items) and items[i] == item:
+                del items[i]
+        for item in into:
+            bisect.insort(items, item)
+        return items
+
+    def add(self, book):
+        self._apply(self._update((book,), 1))
+
+    def add_many(self, books):
+        """add() for every book, merging the changes in once at the end."""
+        self._apply(self._update(books, 1))
+
+    def remove(self, book):
+        self._apply(self._update((book,), -1))
+
+    def clear(self):
+        self._keys.clear()
+        self._counts.clear()
+        self._ranked.clear()
+
+    def complete(self, prefix, limit=DEFAULT_LIMIT):
+        """Up to `limit` [(text, kind, books)], most books first."""
+        prefix = normalize(prefix)
+        if not prefix or limit <= 0:
+            return []
+        if len(prefix) <= RANKED_PREFIX:
+            ranked = self._ranked.get(prefix, ())[:limit]
+        else:
+            keys = self._keys
+            lo = bisect.bisect_left(keys, (prefix,))
+            hi = bisect.bisect_left(keys, (prefix + '\U0010ffff',), lo)
+            if hi - lo <= self.scan:
+                # one suggestion per (kind, text), however many word keys reached it
+                found = {entry[1:]: self._counts[entry] for entry in keys[lo:hi]}
+                ranked = heapq.nsmallest(limit, ((-count, len(text), text, kind)
+                                                 for (kind, text), count in found.items()))
+            else:
+                ranked = []
+                for item in self._ranked.get(prefix[:RANKED_PREFIX], ()):
+                    if any(key.startswith(prefix) for key in _keys(item[3], item[2])):
+                        ranked.append(item)
+                        if len(ranked) == limit:
+                            break
+        return [(text, kind, -count) for count, _, text, kind in ranked]